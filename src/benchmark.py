@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+# NOTE: 記録しておいた入力 (雨雲のスクリーンショット，週間天気予報の HTML，
+# 天気アイコン) を使って，サイトにアクセスせずに描画処理の性能を測る．
+#
+# Usage: benchmark.py [-c CONFIG] [--record] [--save-baseline] [PNG]
+#   --record        実際のサイトから入力を取得して保存する
+#   --save-baseline 今回の結果を基準値として保存する
+import sys
+import io
+import time
+import json
+import hashlib
+import datetime
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+import unittest.mock
+import logging
+
+import cv2
+import numpy as np
+import PIL.Image
+
+import rain_cloud_panel
+import rain_cloud_tile
+import weekly_forecast_panel
+import weather_icon
+import create_image
+import dither
+import fb_format
+from constants import DATA_PATH
+
+BENCH_REPEAT = 10
+
+FIXTURE_PATH = DATA_PATH / "benchmark"
+FIXTURE_MANIFEST_PATH = FIXTURE_PATH / "manifest.json"
+# NOTE: 基準値は実行するマシンに依存するので，マシン毎に保存する
+BASELINE_PATH = FIXTURE_PATH / "baseline.json"
+# NOTE: 基準値からこの割合を超えて悪化したら NG にする
+BASELINE_TOLERANCE = 0.2
+
+
+def retouch_cloud_image_reference(png_data):
+    # NOTE: 変換表を使う前の実装．結果が一致することの確認に使う．
+    img_rgb = cv2.imdecode(
+        np.asarray(bytearray(png_data), dtype=np.uint8), cv2.IMREAD_COLOR
+    )
+
+    img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2HSV_FULL).astype(np.float32)
+    h, s, v = cv2.split(img_hsv)
+
+    for i, level in enumerate(rain_cloud_panel.RAINFALL_INTENSITY_LEVEL):
+        img_hsv[level["func"](h, s), 0] = 0
+        img_hsv[level["func"](h, s), 1] = 80
+        img_hsv[level["func"](h, s), 2] = 256 / 16 * (16 - i * 2)
+
+    img_hsv[s < 30, 2] = np.clip(pow(v[(s < 30)], 1.35) * 0.3, 0, 255)
+
+    return PIL.Image.fromarray(
+        cv2.cvtColor(
+            cv2.cvtColor(img_hsv.astype(np.uint8), cv2.COLOR_HSV2RGB_FULL),
+            cv2.COLOR_RGB2RGBA,
+        )
+    )
+
+
+def create_cloud_png(width=1600, height=1200):
+    # NOTE: 実際のスクリーンショットが無い場合は，全ての色を含むノイズ画像を使う
+    img = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+def measure(func, *args, repeat=BENCH_REPEAT):
+    func(*args)
+
+    elapsed_list = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed_list.append(time.perf_counter() - start)
+
+    return {"min": min(elapsed_list), "avg": sum(elapsed_list) / len(elapsed_list)}
+
+
+def measure_peak(func, *args):
+    # NOTE: 時間の計測に影響しないように，メモリは別に1回だけ測る．
+    # tracemalloc で追えるのは Python と NumPy の確保分だけ．
+    tracemalloc.start()
+    try:
+        func(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def load_fixture():
+    try:
+        with open(FIXTURE_MANIFEST_PATH, "r") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+
+    def read(name):
+        with open(FIXTURE_PATH / name, "rb") as file:
+            return file.read()
+
+    return {
+        "time": datetime.datetime.fromisoformat(manifest["time"]),
+        "rain_cloud": {
+            int(hour): read(name)
+            for hour, name in manifest["rain_cloud"]["png"].items()
+        },
+        "weekly_forecast": {
+            "url": manifest["weekly_forecast"]["url"],
+            "html": read(manifest["weekly_forecast"]["html"]).decode("utf-8"),
+        },
+        "icon": {url: read(name) for url, name in manifest["icon"].items()},
+    }
+
+
+def record_fixture(config):
+    from webdriver import driver_session
+    import http_client
+
+    FIXTURE_PATH.mkdir(parents=True, exist_ok=True)
+    (FIXTURE_PATH / "icon").mkdir(exist_ok=True)
+
+    def write(name, data):
+        with open(FIXTURE_PATH / name, "wb") as file:
+            file.write(data)
+
+        return name
+
+    now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9), "JST"))
+    manifest = {"time": now.isoformat()}
+
+    panel_config = config["RAIN_CLOUD"]
+    hour_list = panel_config.get("HOUR_LIST", [0, 1])
+    sub_width = int(panel_config["WIDTH"] / len(hour_list))
+    with driver_session() as driver:
+        is_loaded = rain_cloud_panel.change_window_size(
+            driver, panel_config["URL"], sub_width, panel_config["HEIGHT"]
+        )
+        png_data_map = rain_cloud_panel.fetch_cloud_image(
+            driver,
+            panel_config["URL"],
+            sub_width,
+            panel_config["HEIGHT"],
+            hour_list,
+            is_loaded=is_loaded,
+        )
+    manifest["rain_cloud"] = {
+        "png": {
+            str(hour): write("rain_cloud_{hour}.png".format(hour=hour), png_data)
+            for hour, png_data in png_data_map.items()
+        }
+    }
+
+    url = config["WEEKLY_FORECAST"]["URL"]
+    html = weekly_forecast_panel.fetch_html(url)
+    manifest["weekly_forecast"] = {
+        "url": url,
+        "html": write("weekly_forecast.html", html.encode("utf-8")),
+    }
+
+    manifest["icon"] = {}
+    for forecast in weekly_forecast_panel.parse_weekly_forecast_list(html, url, now):
+        icon_url = forecast["weather"][1]
+        manifest["icon"][icon_url] = write(
+            "icon/{name}.png".format(
+                name=hashlib.sha256(icon_url.encode()).hexdigest()[:16]
+            ),
+            http_client.fetch(icon_url),
+        )
+
+    with open(FIXTURE_MANIFEST_PATH, "w") as file:
+        json.dump(manifest, file, indent=4)
+
+    logging.info("fixture is recorded to {path}".format(path=FIXTURE_PATH))
+
+
+def decode_icon(data):
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+
+
+@contextlib.contextmanager
+def replay_fixture(fixture, icon_cache_path):
+    # NOTE: サイトにアクセスする関数を，記録しておいた入力を返すものに差し替える
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(
+            unittest.mock.patch.object(
+                rain_cloud_panel, "driver_session", lambda: contextlib.nullcontext()
+            )
+        )
+        stack.enter_context(
+            unittest.mock.patch.object(
+                rain_cloud_panel, "change_window_size", lambda *args: None
+            )
+        )
+        stack.enter_context(
+            unittest.mock.patch.object(
+                rain_cloud_panel,
+                "fetch_cloud_image",
+                lambda *args: fixture["rain_cloud"],
+            )
+        )
+        stack.enter_context(
+            unittest.mock.patch.object(
+                rain_cloud_tile,
+                "fetch_cloud_image",
+                lambda *args: {
+                    hour: rain_cloud_panel.decode_cloud_image(png_data)
+                    for hour, png_data in fixture["rain_cloud"].items()
+                },
+            )
+        )
+        stack.enter_context(
+            unittest.mock.patch.object(
+                weekly_forecast_panel,
+                "fetch_html",
+                lambda url: fixture["weekly_forecast"]["html"],
+            )
+        )
+        stack.enter_context(
+            unittest.mock.patch.object(
+                weekly_forecast_panel,
+                "fetch_image",
+                lambda info: decode_icon(fixture["icon"][info["icon"]]),
+            )
+        )
+        stack.enter_context(
+            unittest.mock.patch.object(
+                weather_icon, "_icon_cache", weather_icon.IconCache(icon_cache_path)
+            )
+        )
+        yield
+
+
+def create_synthetic_fixture(config):
+    panel_config = config["RAIN_CLOUD"]
+    hour_list = panel_config.get("HOUR_LIST", [0, 1])
+
+    return {
+        "time": datetime.datetime.now(),
+        "rain_cloud": {
+            hour: create_cloud_png(
+                int(panel_config["WIDTH"] / len(hour_list)), panel_config["HEIGHT"]
+            )
+            for hour in hour_list
+        },
+        "weekly_forecast": None,
+        "icon": {},
+    }
+
+
+def create_panel_img(width, height):
+    # NOTE: 階調の変化と細かい模様の両方を含む画像
+    gradient = np.tile(np.linspace(0, 255, width, dtype=np.float32), (height, 1))
+    noise = np.random.default_rng(0).normal(0, 20, (height, width))
+
+    return PIL.Image.fromarray(np.clip(gradient + noise, 0, 255).astype(np.uint8), "L")
+
+
+def get_quantize_stage_list(config):
+    # NOTE: パネル全体の解像度で，減色とフレームバッファ形式への変換を測る
+    img = create_panel_img(
+        config["PANEL"]["DEVICE"]["WIDTH"], config["PANEL"]["DEVICE"]["HEIGHT"]
+    )
+
+    stage_list = []
+    for level, bpp in [(16, 4), (4, 2)]:
+        for method in dither.DITHER_METHOD_LIST:
+            stage_list.append(
+                {
+                    "name": "quantize ({method}, {level})".format(
+                        method=method, level=level
+                    ),
+                    "func": dither.quantize,
+                    "args": (img, level, method),
+                }
+            )
+
+        quantized_img = dither.quantize(img, level, "bayer")
+        stage_list += [
+            {
+                "name": "pack ({bpp} bpp)".format(bpp=bpp),
+                "func": fb_format.convert,
+                "args": (quantized_img, bpp),
+            },
+            {
+                "name": "palette png ({level})".format(level=level),
+                "func": lambda img, level: dither.save_png(img, io.BytesIO(), level),
+                "args": (quantized_img, level),
+            },
+        ]
+
+        png_data = io.BytesIO()
+        dither.save_png(quantized_img, png_data, level)
+        logging.info(
+            "{level} level: {png} bytes as palette PNG, {raw} bytes as {bpp} bpp".format(
+                level=level,
+                png=len(png_data.getvalue()),
+                raw=fb_format.convert(quantized_img, bpp).nbytes,
+                bpp=bpp,
+            )
+        )
+
+    return stage_list
+
+
+def get_stage_list(config, fixture):
+    # NOTE: 記録しておいた画像を実際の履歴に残さないようにする
+    rain_config = {
+        key: value for key, value in config["RAIN_CLOUD"].items() if key != "HISTORY"
+    }
+    weekly_config = dict(config["WEEKLY_FORECAST"], BACKEND="http")
+    config = dict(config, RAIN_CLOUD=rain_config, WEEKLY_FORECAST=weekly_config)
+    face_map = rain_cloud_panel.get_face_map(config["FONT"])
+    png_data = fixture["rain_cloud"][min(fixture["rain_cloud"].keys())]
+    cloud_img = rain_cloud_panel.retouch_cloud_image(png_data)
+
+    stage_list = [
+        {
+            "name": "retouch_cloud_image",
+            "func": rain_cloud_panel.retouch_cloud_image,
+            "args": (png_data,),
+        },
+        {
+            "name": "analyze_rain_area",
+            "func": rain_cloud_panel.analyze_rain_area,
+            "args": (rain_cloud_panel.decode_cloud_image(png_data),),
+        },
+        {
+            "name": "draw_equidistant_circle",
+            "func": lambda: rain_cloud_panel.draw_equidistant_circle(cloud_img.copy()),
+            "args": (),
+        },
+        {
+            "name": "draw_caption",
+            "func": lambda: rain_cloud_panel.draw_caption(
+                cloud_img.copy(), "現在(12:34)", face_map
+            ),
+            "args": (),
+        },
+        {
+            "name": "rain_cloud_panel",
+            "func": rain_cloud_panel.create,
+            "args": (rain_config, config["FONT"]),
+        },
+    ] + get_quantize_stage_list(config)
+
+    if fixture["weekly_forecast"] is None:
+        logging.warning("No recorded weekly forecast, skip related stages")
+        return stage_list
+
+    info_list = [
+        {"text": forecast["weather"][0], "icon": forecast["weather"][1]}
+        for forecast in weekly_forecast_panel.parse_weekly_forecast_list(
+            fixture["weekly_forecast"]["html"],
+            fixture["weekly_forecast"]["url"],
+            fixture["time"],
+        )
+    ]
+
+    def get_image_miss():
+        # NOTE: キャッシュが無い状態 (ダウンロードと超解像) を測る
+        with tempfile.TemporaryDirectory() as path:
+            with unittest.mock.patch.object(
+                weather_icon, "_icon_cache", weather_icon.IconCache(path)
+            ):
+                weekly_forecast_panel.get_image_list(info_list)
+
+    def create_image_full():
+        # NOTE: 前回の結果を使い回さずに，全パネルを生成して合成する
+        create_image._panel_cache.clear()
+        create_image.create_image(config)
+
+    stage_list += [
+        {"name": "get_image (miss)", "func": get_image_miss, "args": ()},
+        {
+            "name": "get_image (hit)",
+            "func": weekly_forecast_panel.get_image_list,
+            "args": (info_list,),
+        },
+        {
+            "name": "weekly_forecast_panel",
+            "func": weekly_forecast_panel.create,
+            "args": (weekly_config, config["FONT"]),
+        },
+        {"name": "create_image", "func": create_image_full, "args": ()},
+    ]
+
+    return stage_list
+
+
+def bench_stage(stage_list, repeat):
+    result = {}
+    for stage in stage_list:
+        elapsed = measure(stage["func"], *stage["args"], repeat=repeat)
+        peak = measure_peak(stage["func"], *stage["args"])
+        result[stage["name"]] = {
+            "min": elapsed["min"],
+            "avg": elapsed["avg"],
+            "peak": peak,
+        }
+        logging.info(
+            "{name}: min {min:.1f} ms, avg {avg:.1f} ms, peak {peak:.1f} MB".format(
+                name=stage["name"],
+                min=elapsed["min"] * 1000,
+                avg=elapsed["avg"] * 1000,
+                peak=peak / 1024 / 1024,
+            )
+        )
+
+    return result
+
+
+def load_baseline():
+    try:
+        with open(BASELINE_PATH, "r") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def store_baseline(result):
+    BASELINE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(BASELINE_PATH, "w") as file:
+        json.dump(result, file, indent=4)
+
+    logging.info("baseline is stored to {path}".format(path=BASELINE_PATH))
+
+
+def compare_baseline(result, baseline, tolerance=BASELINE_TOLERANCE):
+    is_ok = True
+    for name, current in result.items():
+        if name not in baseline:
+            continue
+        for key in ["min", "peak"]:
+            if baseline[name][key] == 0:
+                continue
+            ratio = current[key] / baseline[name][key]
+            status = "OK" if ratio <= 1 + tolerance else "NG"
+            if status == "NG":
+                is_ok = False
+            logging.log(
+                logging.INFO if status == "OK" else logging.ERROR,
+                "[{status}] {name} {key}: x{ratio:.2f} of baseline".format(
+                    status=status, name=name, key=key, ratio=ratio
+                ),
+            )
+
+    return is_ok
+
+
+def bench_retouch(png_data):
+    # NOTE: 現在の実装はグレースケールで返すので，変換の丸め誤差 (±1) は許容する
+    diff = np.abs(
+        np.asarray(retouch_cloud_image_reference(png_data).convert("L"), dtype=np.int16)
+        - np.asarray(rain_cloud_panel.retouch_cloud_image(png_data), dtype=np.int16)
+    ).max()
+    is_match = diff <= 1
+    logging.info(
+        "retouch result is {status} (max diff: {diff})".format(
+            status="OK" if is_match else "NG", diff=diff
+        )
+    )
+
+    reference = measure(retouch_cloud_image_reference, png_data)
+    current = measure(rain_cloud_panel.retouch_cloud_image, png_data)
+
+    logging.info(
+        "retouch: reference {reference:.1f} ms, current {current:.1f} ms (x{ratio:.2f})".format(
+            reference=reference["min"] * 1000,
+            current=current["min"] * 1000,
+            ratio=reference["min"] / current["min"],
+        )
+    )
+
+    return is_match
+
+
+if __name__ == "__main__":
+    import logger
+    from config import load_config, CONFIG_PATH
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", default=CONFIG_PATH)
+    parser.add_argument("-n", "--repeat", type=int, default=BENCH_REPEAT)
+    parser.add_argument("-t", "--tolerance", type=float, default=BASELINE_TOLERANCE)
+    parser.add_argument("--record", action="store_true")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("png", nargs="?")
+    args = parser.parse_args()
+
+    logger.init("test")
+    logging.info("Test")
+
+    config = load_config(args.config)
+
+    if args.record:
+        record_fixture(config)
+
+    fixture = load_fixture()
+    if fixture is None:
+        logging.warning("No recorded fixture, use synthetic radar image")
+        fixture = create_synthetic_fixture(config)
+    if args.png is not None:
+        # NOTE: 指定された画像を，表示する全ての時間の画像として使う
+        with open(args.png, "rb") as file:
+            png_data = file.read()
+        fixture["rain_cloud"] = {
+            hour: png_data for hour in config["RAIN_CLOUD"].get("HOUR_LIST", [0, 1])
+        }
+
+    if not bench_retouch(fixture["rain_cloud"][min(fixture["rain_cloud"].keys())]):
+        sys.exit(-1)
+
+    with tempfile.TemporaryDirectory() as icon_cache_path:
+        with replay_fixture(fixture, icon_cache_path):
+            result = bench_stage(get_stage_list(config, fixture), args.repeat)
+
+    if args.save_baseline:
+        store_baseline(result)
+    else:
+        baseline = load_baseline()
+        if baseline is None:
+            logging.warning("No baseline, save it with --save-baseline")
+        elif not compare_baseline(result, baseline, args.tolerance):
+            sys.exit(-1)
+
+    print("Finish.")
@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+# NOTE: 複数のモジュールで使う定数．ブラウザを使わないモジュールからも
+# 読み込むので，selenium などに依存するものは置かない．
+import os
+import pathlib
+
+DATA_PATH = pathlib.Path(os.path.dirname(__file__)).parent / "data"
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.80 Safari/537.36"
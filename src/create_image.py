@@ -2,7 +2,10 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import time
 import textwrap
+import threading
+import concurrent.futures
 import PIL.Image
 import logging
 
@@ -11,42 +14,183 @@ import logger
 import weekly_forecast_panel
 import rain_cloud_panel
 from pil_util import get_font, draw_text
+import dither
+import metrics
+from frame_diff import get_region_list
 
 from config import load_config
 
+# NOTE: パネル毎の生成時間の上限 [秒]
+PANEL_TIMEOUT = 120
+# NOTE: 更新タイミングの揺らぎで1周期遅れないように，この分だけ早めに更新する [秒]
+SCHEDULE_MARGIN = 5
+
+# NOTE: パネル毎の最後の生成結果．常駐している間は使い回す．
+_panel_cache = {}
+_panel_cache_lock = threading.Lock()
+_panel_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+
+class PanelStuckError(Exception):
+    # NOTE: 生成が終わらないパネルがあり，プロセスを作り直さないと回復しない
+    pass
+
+
+def get_panel_list(config):
+    return [
+        {
+            "name": "RAIN_CLOUD",
+            "create": rain_cloud_panel.create,
+            "offset": (0, 0),
+        },
+        {
+            "name": "WEEKLY_FORECAST",
+            "create": weekly_forecast_panel.create,
+            "offset": (0, config["RAIN_CLOUD"]["HEIGHT"]),
+        },
+    ]
+
+
+def get_panel_interval(config, panel):
+    return config[panel["name"]].get("INTERVAL", config["PANEL"]["UPDATE"]["INTERVAL"])
+
+
+def get_panel_ttl(config, panel):
+    # NOTE: 更新に失敗した場合に，前回の画像を使い続けてよい期間
+    return config[panel["name"]].get("TTL", get_panel_interval(config, panel) * 3)
+
+
+def is_panel_due(config, panel, now):
+    cache = _panel_cache.get(panel["name"])
+
+    if cache is None:
+        return True
+    # NOTE: 前回タイムアウトしたものがまだ動いている場合は，終わるのを待つ
+    if (cache["future"] is not None) and (not cache["future"].done()):
+        return False
+
+    return now - cache["time"] >= get_panel_interval(config, panel) - SCHEDULE_MARGIN
+
+
+def is_panel_stuck(config, panel, now):
+    cache = _panel_cache.get(panel["name"])
+
+    if (cache is None) or (cache["future"] is None) or cache["future"].done():
+        return False
+
+    return now - cache["start"] > get_panel_ttl(config, panel)
+
+
+def create_panel(config, panel):
+    with metrics.timer("panel_duration_seconds", panel=panel["name"]):
+        return panel["create"](config[panel["name"]], config["FONT"])
+
+
+def store_panel(panel, future):
+    # NOTE: タイムアウトした後に終わったものも，結果はキャッシュに入れる．
+    # 完了時のコールバックと待っていた側の両方から呼ばれるので，一度だけ処理する．
+    with _panel_cache_lock:
+        cache = _panel_cache[panel["name"]]
+        if cache["future"] is not future:
+            return
+        cache["future"] = None
+
+        try:
+            cache["img"] = future.result()
+            cache["time"] = cache["start"]
+            metrics.increment("panel_update_total", panel=panel["name"], result="ok")
+        except Exception as e:
+            cache["error"] = e
+            metrics.increment("panel_update_total", panel=panel["name"], result="error")
+
+
+def update_panel(config, panel_list):
+    # NOTE: 各パネルは独立しているので，並列に生成する
+    start = time.time()
+    future_list = []
+    for panel in panel_list:
+        with _panel_cache_lock:
+            cache = _panel_cache.setdefault(panel["name"], {"img": None, "time": 0})
+            cache["start"] = start
+            cache["future"] = _panel_executor.submit(create_panel, config, panel)
+        cache["future"].add_done_callback(
+            lambda future, panel=panel: store_panel(panel, future)
+        )
+        future_list.append(cache["future"])
+
+    for panel, future in zip(panel_list, future_list):
+        timeout = config[panel["name"]].get("TIMEOUT", PANEL_TIMEOUT)
+        try:
+            future.result(timeout=max(timeout - (time.time() - start), 0))
+        except concurrent.futures.TimeoutError:
+            # NOTE: タイムアウトしたパネルの終了は待たない
+            with _panel_cache_lock:
+                _panel_cache[panel["name"]]["error"] = TimeoutError(
+                    "Timeout while creating {name} panel ({timeout} sec)".format(
+                        name=panel["name"], timeout=timeout
+                    )
+                )
+            metrics.increment(
+                "panel_update_total", panel=panel["name"], result="timeout"
+            )
+            continue
+        except Exception:
+            pass
+        # NOTE: コールバックより先にここに来ることがあるので，ここでも格納する
+        store_panel(panel, future)
+
 
 def draw_panel(config, img):
-    rain_cloud_img = rain_cloud_panel.create(config["RAIN_CLOUD"], config["FONT"])
-    weekly_forecast_img = weekly_forecast_panel.create(
-        config["WEEKLY_FORECAST"], config["FONT"]
-    )
+    now = time.time()
+    panel_list = get_panel_list(config)
 
-    img.paste(rain_cloud_img, (0, 0))
-    img.paste(weekly_forecast_img, (0, config["RAIN_CLOUD"]["HEIGHT"]))
+    due_list = [panel for panel in panel_list if is_panel_due(config, panel, now)]
+    logging.info(
+        "update panel: {name_list}".format(
+            name_list=", ".join(panel["name"] for panel in due_list)
+        )
+    )
+    update_panel(config, due_list)
 
+    # NOTE: 更新しなかったパネルは，前回の画像を使って合成し直す
+    for panel in panel_list:
+        if is_panel_stuck(config, panel, now):
+            raise PanelStuckError(
+                "{name} panel is not finished in {ttl} sec".format(
+                    name=panel["name"], ttl=get_panel_ttl(config, panel)
+                )
+            )
 
-######################################################################
-logger.init("panel.e-ink.rain")
+        with _panel_cache_lock:
+            cache = dict(_panel_cache[panel["name"]])
+            error = _panel_cache[panel["name"]].pop("error", None)
+        if error is not None:
+            logging.warning(
+                "Failed to update {name} panel: {error}".format(
+                    name=panel["name"], error=error
+                )
+            )
 
-logging.info("start to create image")
+        if (cache["img"] is None) or (
+            now - cache["time"] > get_panel_ttl(config, panel)
+        ):
+            if error is not None:
+                raise error
+            raise RuntimeError(
+                "{name} panel is not available".format(name=panel["name"])
+            )
 
-config = load_config()
+        metrics.set_gauge("panel_age_seconds", now - cache["time"], panel=panel["name"])
+        img.paste(cache["img"], panel["offset"])
 
-img = PIL.Image.new(
-    "RGBA",
-    (config["PANEL"]["DEVICE"]["WIDTH"], config["PANEL"]["DEVICE"]["HEIGHT"]),
-    (255, 255, 255, 255),
-)
 
-try:
-    draw_panel(config, img)
-except:
+def draw_error(config, img):
     import traceback
 
     draw = PIL.ImageDraw.Draw(img)
     draw.rectangle(
         (0, 0, config["PANEL"]["DEVICE"]["WIDTH"], config["PANEL"]["DEVICE"]["HEIGHT"]),
-        fill=(255, 255, 255, 255),
+        fill=255,
     )
 
     draw_text(
@@ -63,10 +207,55 @@ except:
         "\n".join(textwrap.wrap(traceback.format_exc(), 95)),
         [20, 200],
         get_font(config["FONT"], "EN_MEDIUM", 30),
-        "left" "#333",
+        "left",
+        "#333",
     )
     print(traceback.format_exc(), file=sys.stderr)
 
-img.save(sys.stdout.buffer, "PNG")
 
-exit(0)
+def create_image(config):
+    logging.info("start to create image")
+
+    # NOTE: 表示するのはグレースケールなので，最初から 8bit のグレースケールで作る
+    img = PIL.Image.new(
+        "L",
+        (config["PANEL"]["DEVICE"]["WIDTH"], config["PANEL"]["DEVICE"]["HEIGHT"]),
+        255,
+    )
+
+    try:
+        with metrics.stage("draw_panel"):
+            draw_panel(config, img)
+    except PanelStuckError:
+        # NOTE: エラー画面を出し続けないように，呼び出し元でプロセスを作り直させる
+        metrics.increment("render_error_total")
+        raise
+    except:
+        metrics.increment("render_error_total")
+        draw_error(config, img)
+
+    # NOTE: パネルが表示できる階調数に減らしておく．誤差拡散の誤差が他の
+    # 領域に広がると，変化していない領域まで送り直すことになるので，差分を
+    # 調べる領域毎に行う．
+    quantize_config = config["PANEL"].get("QUANTIZE")
+    if quantize_config is not None:
+        img = dither.quantize(
+            img,
+            quantize_config.get("LEVEL", 16),
+            quantize_config.get("DITHER", "bayer"),
+            [region["box"] for region in get_region_list(config)],
+        )
+
+    return img
+
+
+if __name__ == "__main__":
+    logger.init("panel.e-ink.rain")
+
+    config = load_config()
+
+    img = create_image(config)
+
+    img.save(sys.stdout.buffer, "PNG")
+
+    exit(0)
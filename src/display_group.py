@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+# NOTE: 1回生成した画像を，複数の表示先に並列に送る．表示先毎にスレッドを
+# 持たせ，遅い表示先や繋がらない表示先があっても他を待たせない．
+import time
+import threading
+import logging
+
+import metrics
+
+
+class DisplayTarget:
+    def __init__(self, display, frame_diff):
+        self.display = display
+        self.frame_diff = frame_diff
+        self.cond = threading.Condition()
+        self.pending = None
+        self.done_seq = 0
+        self.result = None
+        self.is_stop = False
+
+        self.thread = threading.Thread(
+            target=self.run, name="display-" + display.hostname, daemon=True
+        )
+        self.thread.start()
+
+    def post(self, seq, img):
+        with self.cond:
+            # NOTE: 前の画像をまだ送れていない場合は，新しい画像で置き換える．
+            # 遅れている表示先に画像が溜まっていかないようにする．
+            if self.pending is not None:
+                logging.warning(
+                    "{hostname} is busy, skip previous image".format(
+                        hostname=self.display.hostname
+                    )
+                )
+                metrics.increment("push_skip_total", host=self.display.hostname)
+            self.pending = (seq, img)
+            self.cond.notify_all()
+
+    def push(self, img):
+        # NOTE: 表示側と接続し直す場合は，表示内容が不明なので全体を送る
+        if not self.display.is_connected():
+            self.frame_diff.reset()
+
+        rect_list = self.frame_diff.update(img)
+        metrics.increment(
+            "changed_region_total", len(rect_list), host=self.display.hostname
+        )
+        if len(rect_list) == 0:
+            logging.info(
+                "Image is not changed, skip to push to {hostname}.".format(
+                    hostname=self.display.hostname
+                )
+            )
+            return True
+
+        try:
+            self.display.show(img, rect_list)
+            return True
+        except:
+            logging.exception(
+                "Failed to push image to {hostname}".format(
+                    hostname=self.display.hostname
+                )
+            )
+            self.frame_diff.reset()
+            return False
+
+    def run(self):
+        while True:
+            with self.cond:
+                while (self.pending is None) and (not self.is_stop):
+                    self.cond.wait()
+                if self.is_stop:
+                    break
+                seq, img = self.pending
+                self.pending = None
+
+            result = self.push(img)
+
+            with self.cond:
+                self.done_seq = seq
+                self.result = result
+                self.cond.notify_all()
+
+        self.display.close()
+
+    def wait(self, seq, deadline):
+        # NOTE: 期限までに送り終わらなかった場合は None を返す
+        with self.cond:
+            while self.done_seq < seq:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+            return self.result
+
+    def stop(self, timeout):
+        with self.cond:
+            self.is_stop = True
+            self.cond.notify_all()
+        self.thread.join(timeout)
+
+
+class DisplayGroup:
+    def __init__(self, target_list):
+        self.target_list = target_list
+        self.seq = 0
+
+    def show(self, img):
+        self.seq += 1
+        for target in self.target_list:
+            target.post(self.seq, img)
+
+        return self.seq
+
+    def wait(self, seq, timeout):
+        deadline = time.time() + timeout
+        result_map = {}
+        for target in self.target_list:
+            result_map[target.display.hostname] = target.wait(seq, deadline)
+
+        for hostname, result in result_map.items():
+            if result is None:
+                logging.warning(
+                    "Push to {hostname} is not finished in {timeout} sec".format(
+                        hostname=hostname, timeout=timeout
+                    )
+                )
+
+        return result_map
+
+    def close(self, timeout=10):
+        for target in self.target_list:
+            target.stop(timeout)
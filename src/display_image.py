@@ -1,9 +1,7 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import paramiko
 import datetime
-import subprocess
 import time
 import sys
 import os
@@ -12,69 +10,149 @@ import pathlib
 
 import logger
 from config import load_config
-
-
-CREATE_IMAGE = os.path.dirname(os.path.abspath(__file__)) + "/create_image.py"
-
-
-def ssh_connect(hostname, key_filename):
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    ssh.connect(
+from render_worker import RenderWorker
+from remote_display import RemoteDisplay, PUSH_TIMEOUT, PUSH_RETRY
+from display_group import DisplayTarget, DisplayGroup
+from frame_diff import FrameDiff, get_region_list
+import metrics
+
+
+LOG_NAME = "panel.e-ink.rain"
+RENDER_RETRY = 1
+
+
+def render_image(render_worker, config):
+    # NOTE: ワーカーが異常終了した場合は，作り直してもう一度だけ試す
+    for i in range(RENDER_RETRY + 1):
+        try:
+            with metrics.stage("render"):
+                return render_worker.render(config)
+        except:
+            logging.exception("Failed to create image")
+
+    return None
+
+
+def get_hostname_list():
+    # NOTE: 複数の表示先は，カンマ区切りか複数の引数で指定する
+    if "RASP_HOSTNAME" in os.environ:
+        hostname_list = os.environ["RASP_HOSTNAME"].split(",")
+    else:
+        hostname_list = sys.argv[1:]
+
+    return [hostname.strip() for hostname in hostname_list if hostname.strip() != ""]
+
+
+def parse_hostname(hostname):
+    # NOTE: 表示先毎にポートを変える場合は「ホスト名:ポート」で指定する．
+    # IPv6 のアドレスにポートを付ける場合は「[アドレス]:ポート」にする．
+    default_port = int(os.environ.get("RASP_PORT", 22))
+
+    if hostname.startswith("["):
+        hostname, port = hostname[1:].split("]", 1)
+        if port.startswith(":"):
+            return (hostname, int(port[1:]))
+        elif port == "":
+            return (hostname, default_port)
+        else:
+            raise ValueError(
+                "Invalid hostname: [{hostname}]{port}".format(
+                    hostname=hostname, port=port
+                )
+            )
+    elif hostname.count(":") == 1:
+        hostname, port = hostname.split(":")
+        return (hostname, int(port))
+    else:
+        return (hostname, default_port)
+
+
+def create_display_target(hostname, key_file_path, config):
+    hostname, port = parse_hostname(hostname)
+    quantize_config = config["PANEL"].get("QUANTIZE")
+
+    # NOTE: SSH の接続は張ったままにして使い回す
+    display = RemoteDisplay(
         hostname,
-        username="ubuntu",
-        pkey=paramiko.RSAKey.from_private_key(open(key_filename)),
-        allow_agent=False,
-        look_for_keys=False,
+        key_file_path,
+        port=port,
+        username=os.environ.get("RASP_USER", "ubuntu"),
+        output=config["PANEL"].get("OUTPUT", "png"),
+        fb_device=config["PANEL"].get("FRAMEBUFFER", "/dev/fb0"),
+        png_level=(
+            quantize_config.get("LEVEL", 16) if quantize_config is not None else None
+        ),
+        timeout=config["PANEL"].get("PUSH_TIMEOUT", PUSH_TIMEOUT),
+        retry=config["PANEL"].get("PUSH_RETRY", PUSH_RETRY),
     )
-    return ssh
+
+    # NOTE: 表示先毎に表示内容が異なりうるので，差分も表示先毎に取る
+    return DisplayTarget(display, FrameDiff(get_region_list(config)))
 
 
-logger.init("panel.e-ink.rain")
+def main():
+    logger.init(LOG_NAME)
 
-rasp_hostname = os.environ.get(
-    "RASP_HOSTNAME", sys.argv[1] if len(sys.argv) != 1 else None
-)
-key_file_path = os.environ.get(
-    "SSH_KEY",
-    os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + "/key/panel.id_rsa",
-)
+    hostname_list = get_hostname_list()
+    if len(hostname_list) == 0:
+        logging.error(
+            "No display is specified (set RASP_HOSTNAME or give hostnames as arguments)"
+        )
+        sys.exit(-1)
 
-logging.info("Raspberry Pi hostname: %s" % (rasp_hostname))
+    key_file_path = os.environ.get(
+        "SSH_KEY",
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        + "/key/panel.id_rsa",
+    )
 
-config = load_config()
+    logging.info("Raspberry Pi hostname: %s" % (", ".join(hostname_list)))
 
-while True:
-    ssh = ssh_connect(rasp_hostname, key_file_path)
+    config = load_config()
 
-    ssh_stdin = ssh.exec_command(
-        "cat - > /dev/shm/display.png && sudo fbi -1 -T 1 -d /dev/fb0 --noverbose /dev/shm/display.png; echo $?"
-    )[0]
+    # NOTE: フォントやモデル，ブラウザなどを使い回せるように，画像の生成は
+    # 常駐するワーカープロセスで行う
+    render_worker = RenderWorker(LOG_NAME)
 
-    proc = subprocess.Popen(["python3", CREATE_IMAGE], stdout=subprocess.PIPE)
-    ssh_stdin.write(proc.communicate()[0])
-    proc.wait()
-    ssh_stdin.close()
+    # NOTE: 画像は1回だけ生成して，全ての表示先に並列に送る
+    display_group = DisplayGroup(
+        [
+            create_display_target(hostname, key_file_path, config)
+            for hostname in hostname_list
+        ]
+    )
 
-    if proc.returncode != 0:
-        logging.error(
-            "Failed to create image. (code: {code})".format(code=proc.returncode)
+    while True:
+        img = render_image(render_worker, config)
+        if img is None:
+            display_group.close()
+            render_worker.stop()
+            sys.exit(-1)
+
+        seq = display_group.show(img)
+        # NOTE: 遅れている表示先は待たずに次に進む．送信はスレッドで続く．
+        result_map = display_group.wait(
+            seq, config["PANEL"].get("PUSH_TIMEOUT", PUSH_TIMEOUT)
         )
-        sys.exit(proc.returncode)
 
-    logging.info("Finish.")
+        logging.info("Finish.")
+
+        if any(result_map.values()):
+            pathlib.Path(config["LIVENESS"]["FILE"]).touch()
+        # NOTE: 集計結果は liveness のファイルと同じ場所に書き出す
+        metrics.write(pathlib.Path(config["LIVENESS"]["FILE"]).parent)
 
-    pathlib.Path(config["LIVENESS"]["FILE"]).touch()
+        # 更新されていることが直感的に理解しやすくなるように，更新タイミングを 0 秒
+        # に合わせる
+        # (例えば，1分間隔更新だとして，1分40秒に更新されると，2分40秒まで更新されないので
+        # 2分45秒くらいに表示を見た人は本当に1分間隔で更新されているのか心配になる)
+        sleep_time = (
+            config["PANEL"]["UPDATE"]["INTERVAL"] - datetime.datetime.now().second
+        )
+        logging.info("sleep {sleep_time} sec...".format(sleep_time=sleep_time))
+        sys.stderr.flush()
+        time.sleep(sleep_time)
 
-    # 更新されていることが直感的に理解しやすくなるように，更新タイミングを 0 秒
-    # に合わせる
-    # (例えば，1分間隔更新だとして，1分40秒に更新されると，2分40秒まで更新されないので
-    # 2分45秒くらいに表示を見た人は本当に1分間隔で更新されているのか心配になる)
-    sleep_time = config["PANEL"]["UPDATE"]["INTERVAL"] - datetime.datetime.now().second
-    logging.info("sleep {sleep_time} sec...".format(sleep_time=sleep_time))
-    sys.stderr.flush()
-    time.sleep(sleep_time)
 
-    # NOTE: fbi コマンドのプロセスが残るので強制終了させる
-    ssh.exec_command("sudo killall -9 fbi")
-    ssh.close()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+# NOTE: 8bit のグレースケール画像を，パネルが表示できる階調数に減らす．
+# 組織的ディザ (Bayer) は変換表を引くだけで行い，誤差拡散は Pillow の
+# Floyd–Steinberg (C 実装) を使う．
+import functools
+import logging
+
+import numpy as np
+import PIL.Image
+
+import metrics
+
+DITHER_METHOD_LIST = ["none", "bayer", "diffusion"]
+
+# NOTE: Bayer 行列のサイズは 2^BAYER_ORDER
+BAYER_ORDER = 3
+QUANTIZE_CHUNK_ROWS = 256
+
+
+def get_step(level):
+    return 255 / (level - 1)
+
+
+def get_gray_list(level):
+    return [int(get_step(level) * i + 0.5) for i in range(level)]
+
+
+@functools.lru_cache(maxsize=None)
+def get_bayer_matrix(order=BAYER_ORDER):
+    matrix = np.zeros((1, 1), dtype=np.uint16)
+    for i in range(order):
+        matrix = np.block(
+            [[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]]
+        )
+
+    return matrix
+
+
+@functools.lru_cache(maxsize=None)
+def get_quantize_table(level, order=BAYER_ORDER):
+    # NOTE: 行は Bayer 行列の閾値，列は元の輝度．閾値が 0.5 の行は単純な
+    # 四捨五入になるので，ディザ無しの場合もこの表を使う．
+    count = 4**order
+    threshold = (np.arange(count, dtype=np.float32) + 0.5) / count
+    value = np.arange(256, dtype=np.float32) / np.float32(get_step(level))
+
+    index = np.clip(
+        np.floor(value[np.newaxis, :] + threshold[:, np.newaxis]), 0, level - 1
+    ).astype(np.uint8)
+    round_index = np.clip(np.floor(value + 0.5), 0, level - 1).astype(np.uint8)
+
+    gray_list = np.array(get_gray_list(level), dtype=np.uint8)
+
+    return {
+        "bayer": gray_list[index].reshape(-1),
+        "round": gray_list[round_index],
+    }
+
+
+@functools.lru_cache(maxsize=4)
+def get_bayer_offset(width, height, order=BAYER_ORDER):
+    # NOTE: 画素毎に，変換表の何行目を使うかのオフセットを持たせておく
+    matrix = get_bayer_matrix(order)
+    size = matrix.shape[0]
+
+    return (
+        np.tile(matrix * 256, (-(-height // size), -(-width // size)))[:height, :width]
+    ).astype(np.uint16)
+
+
+def quantize_bayer(gray, level):
+    table = get_quantize_table(level)["bayer"]
+    offset = get_bayer_offset(gray.shape[1], gray.shape[0])
+
+    # NOTE: 添字の配列が大きくならないように，何行かずつ処理する
+    quantized = np.empty_like(gray)
+    for y in range(0, gray.shape[0], QUANTIZE_CHUNK_ROWS):
+        np.take(
+            table,
+            offset[y : y + QUANTIZE_CHUNK_ROWS] + gray[y : y + QUANTIZE_CHUNK_ROWS],
+            out=quantized[y : y + QUANTIZE_CHUNK_ROWS],
+            mode="clip",
+        )
+
+    return quantized
+
+
+def quantize_round(img, level):
+    return img.point(get_quantize_table(level)["round"].tolist())
+
+
+@functools.lru_cache(maxsize=None)
+def get_palette_img(level):
+    gray_list = get_gray_list(level)
+    palette_img = PIL.Image.new("P", (1, 1))
+    # NOTE: 余ったエントリは最後の色で埋めて，余計な色が選ばれないようにする
+    palette_img.putpalette(
+        [
+            value
+            for gray in gray_list + [gray_list[-1]] * (256 - level)
+            for value in (gray, gray, gray)
+        ]
+    )
+
+    return palette_img
+
+
+def quantize_diffusion(img, level):
+    # NOTE: Pillow は L の画像をパレットに合わせて減色できないので，RGB にする
+    return (
+        img.convert("RGB")
+        .quantize(
+            palette=get_palette_img(level), dither=PIL.Image.Dither.FLOYDSTEINBERG
+        )
+        .convert("L")
+    )
+
+
+def quantize_diffusion_box(img, level, box_list):
+    # NOTE: 誤差が矩形の外に広がらないように，矩形毎に誤差拡散する．矩形に
+    # 含まれない部分はディザ無しにする．
+    quantized = quantize_round(img, level)
+    for box in box_list:
+        quantized.paste(quantize_diffusion(img.crop(box), level), box[:2])
+
+    return quantized
+
+
+def quantize(img, level=16, method="bayer", box_list=None):
+    # NOTE: 返すのは level 段階の輝度だけを含む 8bit のグレースケール画像．
+    # box_list は誤差拡散の際に，誤差を広げない範囲 (パネルの領域など) のリスト．
+    # Bayer とディザ無しは画素毎に決まるので，指定しても結果は変わらない．
+    if img.mode != "L":
+        img = img.convert("L")
+
+    with metrics.stage("quantize"):
+        if method == "diffusion":
+            if box_list is None:
+                return quantize_diffusion(img, level)
+            else:
+                return quantize_diffusion_box(img, level, box_list)
+
+        if method == "bayer":
+            return PIL.Image.fromarray(quantize_bayer(np.asarray(img), level), "L")
+        elif method == "none":
+            return quantize_round(img, level)
+        else:
+            raise ValueError("Unknown dither method: {method}".format(method=method))
+
+
+def to_palette(img, level):
+    # NOTE: quantize() した画像を，level 色のパレット画像にする．PNG にする際に
+    # 1画素あたりのビット数を減らせる．
+    index = np.clip(
+        np.floor(np.asarray(img, dtype=np.float32) / np.float32(get_step(level)) + 0.5),
+        0,
+        level - 1,
+    ).astype(np.uint8)
+
+    palette_img = PIL.Image.fromarray(index, "P")
+    palette_img.putpalette(
+        [value for gray in get_gray_list(level) for value in (gray, gray, gray)]
+    )
+
+    return palette_img
+
+
+def get_png_bits(level):
+    for bits in [1, 2, 4]:
+        if level <= 2**bits:
+            return bits
+
+    return 8
+
+
+def save_png(img, file, level=None):
+    if level is None:
+        img.save(file, "PNG")
+    else:
+        to_palette(img, level).save(file, "PNG", bits=get_png_bits(level))
+
+
+if __name__ == "__main__":
+    import sys
+    import logger
+
+    logger.init("test")
+    logging.info("Test")
+
+    img = PIL.Image.open(sys.argv[1])
+    level = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    for method in DITHER_METHOD_LIST:
+        save_png(
+            quantize(img, level, method),
+            "test_dither_{method}.png".format(method=method),
+            level,
+        )
+
+    print("Finish.")
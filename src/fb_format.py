@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import struct
+
+import numpy as np
+
+HEADER_FORMAT = "<4I"
+
+
+def align_box(box, bpp, size):
+    # NOTE: 1ピクセルが1バイトに満たない形式では，バイト境界に揃える．
+    # また，フレームバッファの範囲に収める．
+    pixel_per_byte = max(8 // bpp, 1)
+    left = max(box[0], 0) // pixel_per_byte * pixel_per_byte
+    right = -(-min(box[2], size[0]) // pixel_per_byte) * pixel_per_byte
+
+    return (left, max(box[1], 0), right, min(box[3], size[1]))
+
+
+def pack_gray(gray, bpp):
+    # NOTE: 8bit のグレースケールを bpp ビットに減らして，先頭のピクセルが
+    # 上位ビットに来るように詰める
+    pixel_per_byte = 8 // bpp
+    level = gray >> (8 - bpp)
+    if gray.shape[1] % pixel_per_byte != 0:
+        level = np.pad(
+            level, ((0, 0), (0, pixel_per_byte - gray.shape[1] % pixel_per_byte))
+        )
+    level = level.reshape(gray.shape[0], -1, pixel_per_byte)
+
+    packed = np.zeros(level.shape[:2], dtype=np.uint8)
+    for i in range(pixel_per_byte):
+        packed |= level[:, :, i] << (bpp * (pixel_per_byte - 1 - i))
+
+    return packed
+
+
+def convert(img, bpp):
+    if bpp <= 8:
+        gray = np.asarray(img.convert("L"))
+        if bpp == 8:
+            return gray
+        return pack_gray(gray, bpp)
+
+    rgb = np.asarray(img.convert("RGB"))
+    if bpp == 16:
+        # NOTE: RGB565 (リトルエンディアン)
+        rgb565 = (
+            ((rgb[:, :, 0].astype(np.uint16) >> 3) << 11)
+            | ((rgb[:, :, 1].astype(np.uint16) >> 2) << 5)
+            | (rgb[:, :, 2].astype(np.uint16) >> 3)
+        )
+        return rgb565.astype("<u2")
+    elif bpp == 24:
+        return np.ascontiguousarray(rgb[:, :, ::-1])
+    elif bpp == 32:
+        # NOTE: XRGB8888 (メモリ上は B, G, R, X の順)
+        bgrx = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+        bgrx[:, :, 0:3] = rgb[:, :, ::-1]
+        bgrx[:, :, 3] = 255
+        return bgrx
+    else:
+        raise ValueError("Unsupported bpp: {bpp}".format(bpp=bpp))
+
+
+def encode_rect(img, box, bpp):
+    # NOTE: 矩形の位置を表すヘッダと，フレームバッファ形式の画素を返す
+    data = convert(img.crop(box), bpp)
+
+    return (
+        struct.pack(HEADER_FORMAT, box[0], box[1], box[2] - box[0], box[3] - box[1]),
+        memoryview(np.ascontiguousarray(data)).cast("B"),
+    )
+
+
+def encode_end():
+    return struct.pack(HEADER_FORMAT, 0, 0, 0, 0)
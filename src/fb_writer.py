@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+# NOTE: 表示側 (Raspberry Pi) で動かすスクリプト．標準ライブラリだけを使う．
+#
+# 標準入力から下記の形式で画像を受け取り，フレームバッファに直接書き込む．
+#   ヘッダ: x, y, 幅, 高さ (ピクセル単位，リトルエンディアンの uint32 x 4)
+#   データ: フレームバッファと同じ形式の画素を，1行ずつ詰めたもの
+# 幅と高さが 0 のヘッダを受け取ると終了する．
+#
+# Usage: fb_writer.py DEVICE [WIDTH HEIGHT BPP]
+#   DEVICE がフレームバッファでない通常のファイルの場合は，サイズと色深度を
+#   指定する (試験用)．
+import os
+import sys
+import mmap
+import struct
+
+HEADER_FORMAT = "<4I"
+
+
+def read_sysfs(device, name):
+    with open(
+        "/sys/class/graphics/{fb}/{name}".format(fb=os.path.basename(device), name=name)
+    ) as file:
+        return file.read().strip()
+
+
+def get_geometry(device, argv):
+    if len(argv) >= 3:
+        width, height, bpp = map(int, argv[:3])
+        stride = (width * bpp + 7) // 8
+    else:
+        width, height = map(int, read_sysfs(device, "virtual_size").split(","))
+        bpp = int(read_sysfs(device, "bits_per_pixel"))
+        stride = int(read_sysfs(device, "stride"))
+
+    return (width, height, bpp, stride)
+
+
+def read_exact(stream, view):
+    pos = 0
+    while pos < len(view):
+        size = stream.readinto(view[pos:])
+        if not size:
+            raise EOFError()
+        pos += size
+
+
+def hide_cursor():
+    # NOTE: コンソールのカーソルが画像の上に描かれないようにする
+    try:
+        with open("/sys/class/graphics/fbcon/cursor_blink", "w") as file:
+            file.write("0")
+    except OSError:
+        pass
+
+
+def main(device, argv):
+    width, height, bpp, stride = get_geometry(device, argv)
+    size = stride * height
+
+    if not device.startswith("/dev/"):
+        with open(device, "ab") as file:
+            if file.tell() < size:
+                file.truncate(size)
+    else:
+        hide_cursor()
+
+    fd = os.open(device, os.O_RDWR)
+    mm = mmap.mmap(fd, size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+    fb = memoryview(mm)
+
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout
+
+    stdout.write("{} {} {} {}\n".format(width, height, bpp, stride))
+    stdout.flush()
+
+    header = bytearray(struct.calcsize(HEADER_FORMAT))
+    try:
+        while True:
+            read_exact(stdin, memoryview(header))
+            x, y, w, h = struct.unpack(HEADER_FORMAT, header)
+            if (w == 0) or (h == 0):
+                break
+
+            offset = y * stride + (x * bpp) // 8
+            row_size = (w * bpp) // 8
+
+            # NOTE: 受け取ったデータはコピーせずにフレームバッファに直接読み込む
+            if row_size == stride:
+                read_exact(stdin, fb[offset : offset + row_size * h])
+            else:
+                for i in range(h):
+                    row_offset = offset + stride * i
+                    read_exact(stdin, fb[row_offset : row_offset + row_size])
+
+            stdout.write("OK\n")
+            stdout.flush()
+    except EOFError:
+        pass
+    finally:
+        fb.release()
+        mm.close()
+        os.close(fd)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.stderr.write("Usage: fb_writer.py DEVICE [WIDTH HEIGHT BPP]\n")
+        sys.exit(1)
+
+    main(sys.argv[1], sys.argv[2:])
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import hashlib
+import time
+import logging
+
+# NOTE: 表示側の再起動などに備えて，この間隔で全体を送り直す [秒]
+FULL_REFRESH_INTERVAL = 3600
+
+
+def get_region_list(config):
+    device_width = config["PANEL"]["DEVICE"]["WIDTH"]
+    device_height = config["PANEL"]["DEVICE"]["HEIGHT"]
+    rain_cloud_height = config["RAIN_CLOUD"]["HEIGHT"]
+    weekly_forecast_height = config["WEEKLY_FORECAST"]["HEIGHT"]
+
+    # NOTE: 雨雲レーダーはサブパネル毎に分ける
+    hour_count = len(config["RAIN_CLOUD"].get("HOUR_LIST", [0, 1]))
+    sub_width = int(config["RAIN_CLOUD"]["WIDTH"] / hour_count)
+
+    region_list = []
+    for i in range(hour_count):
+        region_list.append(
+            {
+                "name": "RAIN_CLOUD_{index}".format(index=i),
+                "box": (
+                    sub_width * i,
+                    0,
+                    device_width if i == hour_count - 1 else sub_width * (i + 1),
+                    rain_cloud_height,
+                ),
+            }
+        )
+    region_list.append(
+        {
+            "name": "WEEKLY_FORECAST",
+            "box": (
+                0,
+                rain_cloud_height,
+                device_width,
+                rain_cloud_height + weekly_forecast_height,
+            ),
+        }
+    )
+    if rain_cloud_height + weekly_forecast_height < device_height:
+        region_list.append(
+            {
+                "name": "REST",
+                "box": (
+                    0,
+                    rain_cloud_height + weekly_forecast_height,
+                    device_width,
+                    device_height,
+                ),
+            }
+        )
+
+    return region_list
+
+
+class FrameDiff:
+    def __init__(self, region_list, full_refresh_interval=FULL_REFRESH_INTERVAL):
+        self.region_list = region_list
+        self.full_refresh_interval = full_refresh_interval
+        self.reset()
+
+    def reset(self):
+        self.hash_map = {}
+        self.last_full_time = 0
+
+    def calc_hash(self, img, box):
+        return hashlib.blake2b(img.crop(box).tobytes(), digest_size=16).digest()
+
+    def update(self, img):
+        # NOTE: 前回から変化した領域の矩形のリストを返す．全く変化していなければ
+        # 空のリストになる．
+        hash_map = {
+            region["name"]: self.calc_hash(img, region["box"])
+            for region in self.region_list
+        }
+        hash_map["_"] = (img.mode, img.size)
+
+        now = time.time()
+        if (now - self.last_full_time > self.full_refresh_interval) or (
+            self.hash_map.get("_") != hash_map["_"]
+        ):
+            changed_list = [(0, 0, img.size[0], img.size[1])]
+            self.last_full_time = now
+        else:
+            changed_list = [
+                region["box"]
+                for region in self.region_list
+                if self.hash_map.get(region["name"]) != hash_map[region["name"]]
+            ]
+
+        logging.info(
+            "changed region: {count} / {total}".format(
+                count=len(changed_list), total=len(self.region_list)
+            )
+        )
+
+        self.hash_map = hash_map
+
+        return changed_list
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+# NOTE: 補正済みの雨雲レーダー画像を，ファイルに mmap した固定サイズの
+# リングバッファに時刻と共に保存しておく．再起動後も残り，ディスクと
+# メモリの使用量は容量で決まる量を超えない．
+import os
+import pathlib
+import threading
+import logging
+
+import numpy as np
+import PIL.Image
+
+from constants import DATA_PATH
+
+FRAME_HISTORY_PATH = DATA_PATH / "frame_history.bin"
+FRAME_HISTORY_SIZE = 12
+
+FRAME_HISTORY_MAGIC = b"FRMHIST1"
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("width", "<u4"),
+        ("height", "<u4"),
+        ("capacity", "<u4"),
+        ("head", "<u4"),
+        ("count", "<u4"),
+        ("reserved", "<u4"),
+    ]
+)
+
+_frame_history_map = {}
+_frame_history_lock = threading.Lock()
+
+
+class FrameHistory:
+    def __init__(self, path, width, height, capacity=FRAME_HISTORY_SIZE):
+        self.path = pathlib.Path(path)
+        self.width = width
+        self.height = height
+        self.capacity = capacity
+        self.lock = threading.Lock()
+
+        # NOTE: ヘッダ，時刻の配列，画像の配列の順に並べる
+        self.time_offset = HEADER_DTYPE.itemsize
+        self.frame_offset = self.time_offset + 8 * capacity
+        self.file_size = self.frame_offset + capacity * height * width
+
+        self.open()
+
+    def is_compatible(self):
+        try:
+            if self.path.stat().st_size != self.file_size:
+                return False
+            header = np.fromfile(self.path, dtype=HEADER_DTYPE, count=1)[0]
+        except (OSError, IndexError):
+            return False
+
+        return (
+            (header["magic"] == FRAME_HISTORY_MAGIC)
+            and (header["width"] == self.width)
+            and (header["height"] == self.height)
+            and (header["capacity"] == self.capacity)
+        )
+
+    def create(self):
+        logging.info("Create frame history: {path}".format(path=self.path))
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as file:
+            header = np.zeros(1, dtype=HEADER_DTYPE)
+            header["magic"] = FRAME_HISTORY_MAGIC
+            header["width"] = self.width
+            header["height"] = self.height
+            header["capacity"] = self.capacity
+            file.write(header.tobytes())
+            # NOTE: 残りは疎なファイルにしておく
+            file.truncate(self.file_size)
+        os.replace(tmp_path, self.path)
+
+    def open(self):
+        # NOTE: サイズや容量が変わった場合は作り直す
+        if not self.is_compatible():
+            self.create()
+
+        self.header = np.memmap(
+            self.path, dtype=HEADER_DTYPE, mode="r+", offset=0, shape=(1,)
+        )
+        self.time_list = np.memmap(
+            self.path,
+            dtype="<f8",
+            mode="r+",
+            offset=self.time_offset,
+            shape=(self.capacity,),
+        )
+        self.frame_list = np.memmap(
+            self.path,
+            dtype=np.uint8,
+            mode="r+",
+            offset=self.frame_offset,
+            shape=(self.capacity, self.height, self.width),
+        )
+
+    def __len__(self):
+        return int(self.header["count"][0])
+
+    def get_index(self, i):
+        # NOTE: 0 が最新
+        return (int(self.header["head"][0]) - 1 - i) % self.capacity
+
+    def append(self, img, timestamp):
+        frame = np.asarray(img.convert("L") if img.mode != "L" else img)
+        if frame.shape != (self.height, self.width):
+            raise ValueError(
+                "Frame size mismatch: {size} (expected: {width} x {height})".format(
+                    size=img.size, width=self.width, height=self.height
+                )
+            )
+
+        with self.lock:
+            # NOTE: レーダー画像は数分毎にしか更新されないので，前回と同じなら
+            # 保存しない
+            if (len(self) != 0) and np.array_equal(
+                self.frame_list[self.get_index(0)], frame
+            ):
+                return False
+
+            head = int(self.header["head"][0])
+            self.frame_list[head] = frame
+            self.time_list[head] = timestamp
+            # NOTE: ヘッダは画像を書いた後に更新する．途中で落ちても，
+            # 書きかけの画像が読まれないようにするため．
+            self.header["head"] = (head + 1) % self.capacity
+            self.header["count"] = min(len(self) + 1, self.capacity)
+
+        return True
+
+    def get(self, i):
+        # NOTE: コピーせずに，ファイルに mmap された配列をそのまま返す
+        if (i < 0) or (i >= len(self)):
+            raise IndexError("Frame history index out of range: {i}".format(i=i))
+        index = self.get_index(i)
+
+        frame = self.frame_list[index]
+        frame.flags.writeable = False
+
+        return (float(self.time_list[index]), frame)
+
+    def get_latest(self, count=None):
+        # NOTE: 古いものから順に返す
+        if count is None:
+            count = len(self)
+
+        return [self.get(i) for i in reversed(range(min(count, len(self))))]
+
+    def flush(self):
+        self.frame_list.flush()
+        self.time_list.flush()
+        self.header.flush()
+
+
+def get_frame_history(width, height, capacity=FRAME_HISTORY_SIZE, path=None):
+    if path is None:
+        path = FRAME_HISTORY_PATH
+
+    with _frame_history_lock:
+        key = (str(path), width, height, capacity)
+        if key not in _frame_history_map:
+            _frame_history_map[key] = FrameHistory(path, width, height, capacity)
+
+        return _frame_history_map[key]
+
+
+if __name__ == "__main__":
+    import sys
+    import datetime
+    import logger
+
+    logger.init("test")
+    logging.info("Test")
+
+    # NOTE: 保存されている画像をアニメーション GIF にする
+    path = pathlib.Path(sys.argv[1]) if len(sys.argv) > 1 else FRAME_HISTORY_PATH
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+    history = FrameHistory(
+        path, int(header["width"]), int(header["height"]), int(header["capacity"])
+    )
+
+    frame_list = history.get_latest()
+    for timestamp, frame in frame_list:
+        logging.info(datetime.datetime.fromtimestamp(timestamp))
+
+    if len(frame_list) != 0:
+        img_list = [PIL.Image.fromarray(frame, "L") for timestamp, frame in frame_list]
+        img_list[0].save(
+            "test_frame_history.gif",
+            save_all=True,
+            append_images=img_list[1:],
+            duration=500,
+            loop=0,
+        )
+
+    print("Finish.")
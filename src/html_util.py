@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import re
+import html.parser
+from urllib.parse import urljoin
+
+# NOTE: 閉じタグを持たない要素
+VOID_TAG_SET = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "track",
+    "wbr",
+}
+
+# NOTE: 値を絶対 URL として返す属性
+URL_ATTR_SET = {"src", "href"}
+
+
+class HtmlElement:
+    def __init__(self, tag, attrs, base_url):
+        self.tag = tag
+        self.attrs = dict(attrs)
+        self.base_url = base_url
+        self.child_list = []
+
+    def get_attribute(self, name):
+        value = self.attrs.get(name)
+        # NOTE: Selenium と同じく，URL は絶対 URL にして返す
+        if (value is not None) and (name in URL_ATTR_SET):
+            value = urljoin(self.base_url, value)
+
+        return value
+
+    def iter_text(self):
+        for child in self.child_list:
+            if isinstance(child, str):
+                yield child
+            elif child.tag == "br":
+                yield "\n"
+            elif child.tag not in ("script", "style"):
+                yield from child.iter_text()
+
+    @property
+    def text(self):
+        # NOTE: Selenium の WebElement.text と同じく，改行毎に空白を詰めて，
+        # 空行は除く
+        line_list = [
+            re.sub(r"\s+", " ", line).strip()
+            for line in "".join(self.iter_text()).split("\n")
+        ]
+
+        return "\n".join(line for line in line_list if line != "")
+
+    def find_children(self, tag):
+        return [
+            child
+            for child in self.child_list
+            if isinstance(child, HtmlElement) and child.tag == tag
+        ]
+
+    def find_child(self, tag):
+        child_list = self.find_children(tag)
+
+        return child_list[0] if len(child_list) != 0 else None
+
+    def find_all(self, tag):
+        elem_list = []
+        for child in self.child_list:
+            if not isinstance(child, HtmlElement):
+                continue
+            if child.tag == tag:
+                elem_list.append(child)
+            elem_list.extend(child.find_all(tag))
+
+        return elem_list
+
+    def find(self, tag):
+        elem_list = self.find_all(tag)
+
+        return elem_list[0] if len(elem_list) != 0 else None
+
+
+class HtmlSubtreeParser(html.parser.HTMLParser):
+    def __init__(self, root_id, base_url):
+        super().__init__(convert_charrefs=True)
+        self.root_id = root_id
+        self.base_url = base_url
+        self.root = None
+        self.stack = []
+
+    def handle_starttag(self, tag, attrs):
+        if len(self.stack) == 0:
+            # NOTE: 軽量化のため，指定された id の要素以下だけを木にする
+            if (self.root is not None) or (dict(attrs).get("id") != self.root_id):
+                return
+            self.root = HtmlElement(tag, attrs, self.base_url)
+            if tag not in VOID_TAG_SET:
+                self.stack.append(self.root)
+            return
+
+        elem = HtmlElement(tag, attrs, self.base_url)
+        self.stack[-1].child_list.append(elem)
+        if tag not in VOID_TAG_SET:
+            self.stack.append(elem)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if (len(self.stack) != 0) and (self.stack[-1].tag == tag):
+            self.stack.pop()
+
+    def handle_endtag(self, tag):
+        # NOTE: 閉じ忘れがあっても，対応する開始タグまで戻る
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                break
+
+    def handle_data(self, data):
+        if len(self.stack) != 0:
+            self.stack[-1].child_list.append(data)
+
+
+def parse_subtree(html_text, root_id, base_url=""):
+    parser = HtmlSubtreeParser(root_id, base_url)
+    parser.feed(html_text)
+    parser.close()
+
+    if parser.root is None:
+        raise ValueError("Element is not found (id: {id})".format(id=root_id))
+
+    return parser.root
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+# NOTE: 外部への HTTP(S) アクセスをまとめて扱う．接続はホスト毎にプールして
+# 使い回し，タイムアウト，バックオフ付きの再試行，応答サイズの上限を設ける．
+# 複数スレッドから同時に呼び出して良い．
+import time
+import threading
+import http.client
+import urllib.parse
+import logging
+
+from constants import USER_AGENT
+import metrics
+
+# NOTE: ホスト毎の同時接続数の上限
+MAX_CONNECTION_PER_HOST = 8
+# NOTE: これより長く使っていない接続は，サーバー側で切られている可能性が高い [秒]
+IDLE_TIMEOUT = 30
+
+FETCH_TIMEOUT = 10
+FETCH_MAX_SIZE = 8 * 1024 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+
+RETRY_COUNT = 2
+RETRY_WAIT = 0.5
+RETRY_WAIT_MAX = 10
+RETRY_STATUS_LIST = [429, 500, 502, 503, 504]
+
+REDIRECT_STATUS_LIST = [301, 302, 303, 307, 308]
+REDIRECT_MAX = 5
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+
+class HTTPError(Exception):
+    def __init__(self, url, code, headers):
+        super().__init__("HTTP Error {code}: {url}".format(code=code, url=url))
+        self.url = url
+        self.code = code
+        self.headers = headers
+
+
+class HTTPClient:
+    def __init__(
+        self,
+        max_connection=MAX_CONNECTION_PER_HOST,
+        timeout=FETCH_TIMEOUT,
+        max_size=FETCH_MAX_SIZE,
+        retry=RETRY_COUNT,
+    ):
+        self.max_connection = max_connection
+        self.timeout = timeout
+        self.max_size = max_size
+        self.retry = retry
+        self.lock = threading.Lock()
+        # NOTE: (scheme, host, port) 毎の，使っていない接続と同時接続数の制限
+        self.idle_map = {}
+        self.semaphore_map = {}
+
+    def get_semaphore(self, key):
+        with self.lock:
+            if key not in self.semaphore_map:
+                self.semaphore_map[key] = threading.BoundedSemaphore(
+                    self.max_connection
+                )
+
+            return self.semaphore_map[key]
+
+    def acquire(self, key, timeout):
+        # NOTE: 再利用できる接続があればそれを使う．2つ目の戻り値は再利用かどうか
+        with self.lock:
+            idle_list = self.idle_map.get(key, [])
+            while len(idle_list) != 0:
+                conn, last_used = idle_list.pop()
+                if time.monotonic() - last_used < IDLE_TIMEOUT:
+                    conn.timeout = timeout
+                    if conn.sock is not None:
+                        conn.sock.settimeout(timeout)
+                    return (conn, True)
+                conn.close()
+
+        scheme, host, port = key
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(host, port, timeout=timeout)
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=timeout)
+        metrics.increment("http_connection_total", host=host)
+
+        return (conn, False)
+
+    def release(self, key, conn):
+        with self.lock:
+            self.idle_map.setdefault(key, []).append((conn, time.monotonic()))
+
+    def read_body(self, res, url, max_size):
+        length = res.getheader("Content-Length")
+        if (length is not None) and length.isdigit() and (int(length) > max_size):
+            raise ValueError(
+                "Response is too large: {url} ({length} bytes)".format(
+                    url=url, length=length
+                )
+            )
+
+        chunk_list = []
+        size = 0
+        while True:
+            chunk = res.read(READ_CHUNK_SIZE)
+            if len(chunk) == 0:
+                break
+            size += len(chunk)
+            if size > max_size:
+                raise ValueError(
+                    "Response is too large: {url} (> {max_size} bytes)".format(
+                        url=url, max_size=max_size
+                    )
+                )
+            chunk_list.append(chunk)
+
+        return b"".join(chunk_list)
+
+    def request_once(self, url, header_map, timeout, max_size):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ["http", "https"]:
+            raise ValueError("Unsupported URL: {url}".format(url=url))
+
+        key = (
+            parsed.scheme,
+            parsed.hostname,
+            parsed.port or (443 if parsed.scheme == "https" else 80),
+        )
+        path = parsed.path or "/"
+        if parsed.query != "":
+            path += "?" + parsed.query
+
+        with self.get_semaphore(key):
+            # NOTE: 使い回した接続がサーバー側で切られていた場合は，新しい接続で
+            # もう一度だけ送る
+            for i in range(2):
+                conn, is_reused = self.acquire(key, timeout)
+                try:
+                    conn.request("GET", path, headers=header_map)
+                    res = conn.getresponse()
+                    data = self.read_body(res, url, max_size)
+                except (
+                    http.client.RemoteDisconnected,
+                    ConnectionResetError,
+                    BrokenPipeError,
+                ):
+                    conn.close()
+                    if is_reused and (i == 0):
+                        continue
+                    raise
+                except:
+                    conn.close()
+                    raise
+
+                if res.will_close:
+                    conn.close()
+                else:
+                    self.release(key, conn)
+
+                return {
+                    "url": url,
+                    "status": res.status,
+                    "headers": res.headers,
+                    "data": data,
+                }
+
+    def get_retry_wait(self, res, i):
+        wait = RETRY_WAIT * (2**i)
+        if res is not None:
+            retry_after = res["headers"].get("Retry-After")
+            if (retry_after is not None) and retry_after.isdigit():
+                wait = max(wait, int(retry_after))
+
+        return min(wait, RETRY_WAIT_MAX)
+
+    def request(self, url, headers=None, timeout=None, max_size=None, retry=None):
+        # NOTE: 応答は状態コードに関わらず返す．リダイレクトは辿る．
+        timeout = self.timeout if timeout is None else timeout
+        max_size = self.max_size if max_size is None else max_size
+        retry = self.retry if retry is None else retry
+
+        header_map = {"User-Agent": USER_AGENT}
+        if headers is not None:
+            header_map.update(headers)
+
+        for redirect in range(REDIRECT_MAX + 1):
+            host = urllib.parse.urlsplit(url).hostname
+            for i in range(retry + 1):
+                res = None
+                try:
+                    with metrics.timer("http_request_duration_seconds", host=host):
+                        res = self.request_once(url, header_map, timeout, max_size)
+                    if (res["status"] not in RETRY_STATUS_LIST) or (i == retry):
+                        break
+                    logging.warning(
+                        "Retry to fetch {url} (status: {status})".format(
+                            url=url, status=res["status"]
+                        )
+                    )
+                except (OSError, http.client.HTTPException) as e:
+                    metrics.increment("http_error_total", host=host)
+                    if i == retry:
+                        raise
+                    logging.warning(
+                        "Retry to fetch {url} ({error})".format(url=url, error=repr(e))
+                    )
+                metrics.increment("http_retry_total", host=host)
+                time.sleep(self.get_retry_wait(res, i))
+
+            metrics.increment(
+                "http_request_total", host=host, status=str(res["status"])
+            )
+
+            location = res["headers"].get("Location")
+            if (res["status"] not in REDIRECT_STATUS_LIST) or (location is None):
+                return res
+            url = urllib.parse.urljoin(url, location)
+
+        raise ValueError("Too many redirects: {url}".format(url=url))
+
+    def get(self, url, headers=None, timeout=None, max_size=None, retry=None):
+        # NOTE: 4xx や 5xx の場合は例外にする
+        res = self.request(url, headers, timeout, max_size, retry)
+        if res["status"] >= 400:
+            raise HTTPError(res["url"], res["status"], res["headers"])
+
+        return res
+
+    def close(self):
+        with self.lock:
+            for idle_list in self.idle_map.values():
+                for conn, last_used in idle_list:
+                    conn.close()
+            self.idle_map.clear()
+
+
+def get_http_client():
+    global _http_client
+
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HTTPClient()
+
+        return _http_client
+
+
+def fetch(url, headers=None, timeout=None, max_size=None):
+    return get_http_client().get(url, headers, timeout, max_size)["data"]
+
+
+if __name__ == "__main__":
+    import sys
+    import logger
+
+    logger.init("test")
+    logging.info("Test")
+
+    client = get_http_client()
+    for url in sys.argv[1:]:
+        start = time.perf_counter()
+        res = client.request(url)
+        logging.info(
+            "{url}: {status}, {size} bytes, {time:.1f} ms".format(
+                url=res["url"],
+                status=res["status"],
+                size=len(res["data"]),
+                time=(time.perf_counter() - start) * 1000,
+            )
+        )
+
+    print("Finish.")
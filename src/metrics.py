@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+# NOTE: 処理段階毎の所要時間やキャッシュのヒット数などを集計し，JSON と
+# Prometheus のテキスト形式 (node_exporter の textfile collector 向け) で書き出す．
+import os
+import time
+import json
+import copy
+import pathlib
+import threading
+import contextlib
+import logging
+
+METRICS_PREFIX = "panel_"
+METRICS_JSON_NAME = "metrics.json"
+METRICS_PROM_NAME = "metrics.prom"
+
+# NOTE: 所要時間のヒストグラムの区切り [秒]
+BUCKET_LIST = [0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+_lock = threading.Lock()
+_metrics = {"histogram": {}, "counter": {}, "gauge": {}}
+# NOTE: 別プロセス (描画ワーカー) から受け取った集計結果
+_source_map = {}
+
+
+def get_key(name, labels):
+    return json.dumps([name, sorted(labels.items())], ensure_ascii=False)
+
+
+def observe(name, value, **labels):
+    key = get_key(name, labels)
+    with _lock:
+        histogram = _metrics["histogram"].get(key)
+        if histogram is None:
+            histogram = {
+                "name": name,
+                "labels": labels,
+                "count": 0,
+                "sum": 0.0,
+                "bucket": [0] * len(BUCKET_LIST),
+            }
+            _metrics["histogram"][key] = histogram
+
+        histogram["count"] += 1
+        histogram["sum"] += value
+        histogram["last"] = value
+        for i, le in enumerate(BUCKET_LIST):
+            if value <= le:
+                histogram["bucket"][i] += 1
+
+
+def increment(name, value=1, **labels):
+    key = get_key(name, labels)
+    with _lock:
+        counter = _metrics["counter"].setdefault(
+            key, {"name": name, "labels": labels, "value": 0}
+        )
+        counter["value"] += value
+
+
+def set_gauge(name, value, **labels):
+    key = get_key(name, labels)
+    with _lock:
+        _metrics["gauge"][key] = {"name": name, "labels": labels, "value": value}
+
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def stage(stage_name):
+    return timer("stage_duration_seconds", stage=stage_name)
+
+
+def count_cache(cache_name, is_hit):
+    increment("cache_total", cache=cache_name, result="hit" if is_hit else "miss")
+
+
+def get_snapshot():
+    with _lock:
+        return copy.deepcopy(_metrics)
+
+
+def set_source(source, snapshot):
+    # NOTE: 別プロセスの集計結果は累積値なので，合算せずに置き換える
+    with _lock:
+        _source_map[source] = snapshot
+
+
+def get_all():
+    with _lock:
+        all_metrics = copy.deepcopy(_metrics)
+        for source, snapshot in _source_map.items():
+            for kind, metrics_map in snapshot.items():
+                for key, metric in metrics_map.items():
+                    metric = copy.deepcopy(metric)
+                    metric["labels"] = dict(metric["labels"], source=source)
+                    all_metrics[kind][source + ":" + key] = metric
+
+    return all_metrics
+
+
+def format_labels(labels, extra=None):
+    item_list = sorted(labels.items())
+    if extra is not None:
+        item_list.append(extra)
+    if len(item_list) == 0:
+        return ""
+
+    return (
+        "{"
+        + ",".join(
+            '{key}="{value}"'.format(
+                key=key,
+                value=str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for key, value in item_list
+        )
+        + "}"
+    )
+
+
+def format_prometheus(all_metrics):
+    line_list = []
+    type_map = {}
+
+    def add_type(name, kind):
+        if name not in type_map:
+            type_map[name] = kind
+            line_list.append("# TYPE {name} {kind}".format(name=name, kind=kind))
+
+    for metric in sorted(
+        all_metrics["histogram"].values(), key=lambda metric: metric["name"]
+    ):
+        name = METRICS_PREFIX + metric["name"]
+        add_type(name, "histogram")
+        for le, count in zip(BUCKET_LIST, metric["bucket"]):
+            line_list.append(
+                "{name}_bucket{labels} {count}".format(
+                    name=name,
+                    labels=format_labels(metric["labels"], ("le", le)),
+                    count=count,
+                )
+            )
+        line_list.append(
+            "{name}_bucket{labels} {count}".format(
+                name=name,
+                labels=format_labels(metric["labels"], ("le", "+Inf")),
+                count=metric["count"],
+            )
+        )
+        line_list.append(
+            "{name}_sum{labels} {value}".format(
+                name=name, labels=format_labels(metric["labels"]), value=metric["sum"]
+            )
+        )
+        line_list.append(
+            "{name}_count{labels} {value}".format(
+                name=name,
+                labels=format_labels(metric["labels"]),
+                value=metric["count"],
+            )
+        )
+
+    for kind in ["counter", "gauge"]:
+        for metric in sorted(
+            all_metrics[kind].values(), key=lambda metric: metric["name"]
+        ):
+            name = METRICS_PREFIX + metric["name"]
+            add_type(name, kind)
+            line_list.append(
+                "{name}{labels} {value}".format(
+                    name=name,
+                    labels=format_labels(metric["labels"]),
+                    value=metric["value"],
+                )
+            )
+
+    return "\n".join(line_list) + "\n"
+
+
+def write_file(path, text):
+    # NOTE: 読み込み途中のファイルを見せないように，書いてからリネームする
+    tmp_path = str(path) + ".tmp"
+    with open(tmp_path, "w") as file:
+        file.write(text)
+    os.replace(tmp_path, str(path))
+
+
+def write(dir_path):
+    all_metrics = get_all()
+    dir_path = pathlib.Path(dir_path)
+
+    try:
+        write_file(
+            dir_path / METRICS_JSON_NAME,
+            json.dumps(
+                {
+                    "time": time.time(),
+                    "histogram": list(all_metrics["histogram"].values()),
+                    "counter": list(all_metrics["counter"].values()),
+                    "gauge": list(all_metrics["gauge"].values()),
+                },
+                ensure_ascii=False,
+                indent=4,
+            ),
+        )
+        write_file(dir_path / METRICS_PROM_NAME, format_prometheus(all_metrics))
+    except:
+        logging.warning("Failed to write metrics")
+
+
+def get_process_memory(pid):
+    # NOTE: /proc から常駐メモリ量 [byte] を取得する
+    try:
+        with open("/proc/{pid}/status".format(pid=pid)) as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return 0
+
+
+def get_child_pid_list(pid):
+    child_map = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{pid}/stat".format(pid=entry)) as file:
+                stat = file.read()
+        except OSError:
+            continue
+        # NOTE: プロセス名に空白や括弧が含まれていても良いように，最後の ")" 以降を使う
+        ppid = int(stat[stat.rfind(")") + 2 :].split()[1])
+        child_map.setdefault(ppid, []).append(int(entry))
+
+    pid_list = []
+    pending_list = [pid]
+    while len(pending_list) != 0:
+        child_list = child_map.get(pending_list.pop(), [])
+        pid_list.extend(child_list)
+        pending_list.extend(child_list)
+
+    return pid_list
+
+
+def get_process_tree_memory(pid):
+    return sum(get_process_memory(target) for target in [pid] + get_child_pid_list(pid))
+
+
+if __name__ == "__main__":
+    import sys
+
+    with stage("test"):
+        time.sleep(0.01)
+    count_cache("test", True)
+    count_cache("test", False)
+    set_gauge("process_memory_bytes", get_process_tree_memory(os.getpid()))
+
+    sys.stdout.write(format_prometheus(get_all()))
@@ -1,12 +1,30 @@
 #!/usr/bin/env python3
 # - coding: utf-8 --
 import os
+import math
 import pathlib
+import functools
+import threading
+import PIL.Image
 import PIL.ImageDraw
+import PIL.ImageFont
+import PIL.ImageColor
+
+FONT_CACHE_SIZE = 32
+TEXT_SIZE_CACHE_SIZE = 1024
+TEXT_MASK_CACHE_SIZE = 256
+
+# NOTE: FreeType のフォントは複数スレッドから同時に使えないので排他する
+_font_lock = threading.RLock()
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(path, size):
+    return PIL.ImageFont.truetype(path, size)
 
 
 def get_font(config, font_type, size):
-    return PIL.ImageFont.truetype(
+    return load_font(
         str(
             pathlib.Path(
                 os.path.dirname(__file__), config["PATH"], config["MAP"][font_type]
@@ -16,14 +34,70 @@ def get_font(config, font_type, size):
     )
 
 
-def draw_text(img, text, pos, font, align="left", color="#000"):
-    draw = PIL.ImageDraw.Draw(img)
+@functools.lru_cache(maxsize=TEXT_SIZE_CACHE_SIZE)
+def get_text_size(font, text):
+    with _font_lock:
+        left, top, right, bottom = font.getbbox(text)
+
+    # NOTE: Pillow 9 の getsize() は (right, bottom) ではなく，左にはみ出す分
+    # (left が負の場合) も幅に含めていた．レイアウトを変えないようにそれに合わせる．
+    # 例: DejaVuSans 80pt の "j" は getbbox() が (-2, 14, 22, 92)，getsize() が (24, 92)
+    return (right - min(left, 0), bottom)
+
+
+@functools.lru_cache(maxsize=TEXT_MASK_CACHE_SIZE)
+def get_text_mask(font, text, start):
+    # NOTE: 描画位置の小数部分によって描画結果が変わるので，それも含めて
+    # キャッシュする．はみ出す部分があっても良いように余白を付ける．
+    with _font_lock:
+        left, top, right, bottom = font.getbbox(text)
+        margin = (max(-left, 0) + 1, max(-top, 0) + 1)
+        mask = PIL.Image.new("L", (right + margin[0] + 2, bottom + margin[1] + 2), 0)
+        PIL.ImageDraw.Draw(mask).text(
+            (margin[0] + start[0], margin[1] + start[1]), text, 255, font
+        )
 
+    return (mask, margin)
+
+
+def get_text_pos(text, pos, font, align):
     if align == "center":
-        pos = (pos[0] - font.getsize(text)[0] / 2, pos[1])
+        return (pos[0] - get_text_size(font, text)[0] / 2, pos[1])
     elif align == "right":
-        pos = (pos[0] - font.getsize(text)[0], pos[1])
+        return (pos[0] - get_text_size(font, text)[0], pos[1])
+    else:
+        return (pos[0], pos[1])
+
+
+def prerender_text(font, text_list, align="left"):
+    # NOTE: 整数の位置に描画される前提で，よく使う文字列を描画しておく
+    for text in text_list:
+        pos = get_text_pos(text, (0, 0), font, align)
+        get_text_mask(font, text, (pos[0] - math.floor(pos[0]), 0))
+
+
+def draw_text(img, text, pos, font, align="left", color="#000"):
+    pos = get_text_pos(text, pos, font, align)
+    size = get_text_size(font, text)
 
-    draw.text(pos, text, color, font, None, font.getsize(text)[1] * 0.4)
+    if "\n" in text:
+        draw = PIL.ImageDraw.Draw(img)
+        with _font_lock:
+            draw.text(pos, text, color, font, None, size[1] * 0.4)
+    else:
+        # NOTE: 描画済みの文字列をマスクとして使い，色を塗る
+        x = math.floor(pos[0])
+        y = math.floor(pos[1])
+        mask, margin = get_text_mask(font, text, (pos[0] - x, pos[1] - y))
+        img.paste(
+            PIL.ImageColor.getcolor(color, img.mode),
+            (
+                x - margin[0],
+                y - margin[1],
+                x - margin[0] + mask.size[0],
+                y - margin[1] + mask.size[1],
+            ),
+            mask,
+        )
 
-    return font.getsize(text)[0]
+    return size[0]
@@ -3,20 +3,120 @@
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.wait import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 
 import PIL.Image
 import PIL.ImageDraw
 
 import datetime
+import functools
+import math
 import cv2
 import numpy as np
-import time
+import json
+import os
 import logging
 
-from webdriver import create_driver
-from pil_util import get_font, draw_text
+from webdriver import driver_session
+from constants import DATA_PATH
+import rain_cloud_tile
+import frame_history
+import metrics
+from pil_util import get_font, draw_text, get_text_size
 
 CLOUD_IMAGE_XPATH = '//div[contains(@id, "jmatile_map_")]'
+WINDOW_SIZE_CACHE_PATH = DATA_PATH / "window_size.json"
+
+# NOTE: 地図のタイルの読み込みを待つ時間の上限 [秒]
+TILE_READY_TIMEOUT = 10
+# NOTE: Leaflet のフェードイン (0.2秒) が終わるまで待つ [秒]
+TILE_QUIET_PERIOD = 0.25
+
+# NOTE: 地図の要素の変化やタイルの読み込みを監視し，最後に変化した時刻を記録する
+TILE_WATCH_SCRIPT = """
+var root = arguments[0];
+if (!root.__tileWatch) {
+    var watch = { last: 0 };
+    var touch = function () { watch.last = performance.now(); };
+    new MutationObserver(touch).observe(root, {
+        subtree: true,
+        childList: true,
+        attributes: true,
+        attributeFilter: ["src", "class"],
+    });
+    root.addEventListener("load", touch, true);
+    root.addEventListener("error", touch, true);
+    root.__tileWatch = watch;
+}
+root.__tileWatch.last = performance.now();
+"""
+
+# NOTE: 全てのタイルの読み込みが終わり，一定時間変化が無ければ，タイルの
+# URL の一覧を返す．一覧が前回と同じ場合は，まだ切り替わっていないとみなす．
+TILE_READY_SCRIPT = """
+var root = arguments[0];
+var quiet = arguments[1];
+var prev = arguments[2];
+var tiles = root.querySelectorAll("img.leaflet-tile");
+if (tiles.length == 0) {
+    return null;
+}
+var src_list = [];
+for (var i = 0; i < tiles.length; i++) {
+    // NOTE: 読み込みに失敗したものも complete になるので，待ち続けることはない
+    if (!tiles[i].complete) {
+        return null;
+    }
+    src_list.push(tiles[i].src);
+}
+var signature = src_list.sort().join("\\n");
+if ((signature === prev) || (performance.now() - root.__tileWatch.last < quiet)) {
+    return null;
+}
+return signature;
+"""
+
+# NOTE: rainfall は降水強度の下限 [mm/h]，name は気象庁の雨の強さの表現
+RAINFALL_INTENSITY_LEVEL = [
+    # NOTE: 白
+    {
+        "func": lambda h, s: (160 < h) & (h < 180) & (s < 20),
+        "rainfall": 0,
+        "name": "弱い雨",
+    },
+    # NOTE: 薄水色
+    {
+        "func": lambda h, s: (140 < h) & (h < 150) & (90 < s) & (s < 100),
+        "rainfall": 1,
+        "name": "弱い雨",
+    },
+    # NOTE: 水色
+    {
+        "func": lambda h, s: (145 < h) & (h < 155) & (210 < s) & (s < 230),
+        "rainfall": 5,
+        "name": "雨",
+    },
+    # NOTE: 青色
+    {
+        "func": lambda h, s: (155 < h) & (h < 165) & (230 < s),
+        "rainfall": 10,
+        "name": "やや強い雨",
+    },
+    # NOTE: 黄色
+    {"func": lambda h, s: (35 < h) & (h < 45), "rainfall": 20, "name": "強い雨"},
+    # NOTE: 橙色
+    {"func": lambda h, s: (20 < h) & (h < 30), "rainfall": 30, "name": "激しい雨"},
+    # NOTE: 赤色
+    {"func": lambda h, s: (0 < h) & (h < 8), "rainfall": 50, "name": "非常に激しい雨"},
+    # NOTE: 紫色
+    {
+        "func": lambda h, s: (225 < h) & (h < 235) & (240 < s),
+        "rainfall": 80,
+        "name": "猛烈な雨",
+    },
+]
+
+_retouch_table = None
 
 
 def get_face_map(font_config):
@@ -25,7 +125,7 @@ def get_face_map(font_config):
     }
 
 
-def shape_cloud_display(driver, parts_list, width, height, is_future):
+def shape_cloud_display(driver, parts_list, width, height):
     SCRIPT_CHANGE_DISPAY = """
 var elements = document.getElementsByClassName("{class_name}")
     for (i = 0; i < elements.length; i++) {{
@@ -48,28 +148,36 @@ var elements = document.getElementsByClassName("{class_name}")
             )
         )
 
-    if is_future:
-        driver.find_element(
-            By.XPATH,
-            '//div[@class="jmatile-control"]//div[contains(text(), " +1時間 ")]',
-        ).click()
 
+def select_forecast_hour(driver, hour):
+    driver.find_element(
+        By.XPATH,
+        '//div[@class="jmatile-control"]//div[contains(text(), " +{hour}時間 ")]'.format(
+            hour=hour
+        ),
+    ).click()
 
-def change_window_size(driver, url, width, height):
-    wait = WebDriverWait(driver, 5)
 
-    # NOTE: 雨雲画像がこのサイズになるように，ウィンドウサイズを調整する
-    logging.info("target: {width} x {height}".format(width=width, height=height))
+def wait_tile_ready(driver, timeout=TILE_READY_TIMEOUT, prev_signature=None):
+    root = driver.find_element(By.XPATH, CLOUD_IMAGE_XPATH)
+    driver.execute_script(TILE_WATCH_SCRIPT, root)
 
-    driver.get(url)
-    wait.until(EC.presence_of_element_located((By.XPATH, CLOUD_IMAGE_XPATH)))
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=0.05).until(
+            lambda driver: driver.execute_script(
+                TILE_READY_SCRIPT, root, TILE_QUIET_PERIOD * 1000, prev_signature
+            )
+        )
+    except TimeoutException:
+        # NOTE: 読み込みが終わらない場合でも，その時点の画像を使う
+        logging.warning(
+            "Map tiles are not ready in {timeout} sec".format(timeout=timeout)
+        )
+        metrics.increment("tile_ready_timeout_total")
+        return prev_signature
 
-    # NOTE: まずはサイズを大きめにしておく
-    driver.set_window_size(int(height * 2), int(height * 1.5))
-    driver.refresh()
-    wait.until(EC.presence_of_element_located((By.XPATH, CLOUD_IMAGE_XPATH)))
 
-    # NOTE: 最初に横サイズを調整
+def get_current_size(driver):
     window_size = driver.get_window_size()
     element_size = driver.find_element(By.XPATH, CLOUD_IMAGE_XPATH).size
     logging.info(
@@ -80,6 +188,23 @@ def change_window_size(driver, url, width, height):
             element_height=element_size["height"],
         )
     )
+
+    return (window_size, element_size)
+
+
+def calibrate_window_size(driver, url, width, height):
+    wait = WebDriverWait(driver, 5)
+
+    driver.get(url)
+    wait.until(EC.presence_of_element_located((By.XPATH, CLOUD_IMAGE_XPATH)))
+
+    # NOTE: まずはサイズを大きめにしておく
+    driver.set_window_size(int(height * 2), int(height * 1.5))
+    driver.refresh()
+    wait.until(EC.presence_of_element_located((By.XPATH, CLOUD_IMAGE_XPATH)))
+
+    # NOTE: 最初に横サイズを調整
+    window_size, element_size = get_current_size(driver)
     if element_size["width"] != width:
         target_window_width = window_size["width"] + (width - element_size["width"])
         logging.info(
@@ -93,16 +218,7 @@ def change_window_size(driver, url, width, height):
     wait.until(EC.presence_of_element_located((By.XPATH, CLOUD_IMAGE_XPATH)))
 
     # NOTE: 次に縦サイズを調整
-    window_size = driver.get_window_size()
-    element_size = driver.find_element(By.XPATH, CLOUD_IMAGE_XPATH).size
-    logging.info(
-        "[current] window: {window_width} x {window_height}, element: {element_width} x {element_height}".format(
-            window_width=window_size["width"],
-            window_height=window_size["height"],
-            element_width=element_size["width"],
-            element_height=element_size["height"],
-        )
-    )
+    window_size, element_size = get_current_size(driver)
     if element_size["height"] != height:
         target_window_height = window_size["height"] + (height - element_size["height"])
         logging.info(
@@ -117,28 +233,98 @@ def change_window_size(driver, url, width, height):
         )
     driver.refresh()
     wait.until(EC.presence_of_element_located((By.XPATH, CLOUD_IMAGE_XPATH)))
-    time.sleep(0.5)
+    wait_tile_ready(driver)
 
-    window_size = driver.get_window_size()
-    element_size = driver.find_element(By.XPATH, CLOUD_IMAGE_XPATH).size
-    logging.info(
-        "[current] window: {window_width} x {window_height}, element: {element_width} x {element_height}".format(
-            window_width=window_size["width"],
-            window_height=window_size["height"],
-            element_width=element_size["width"],
-            element_height=element_size["height"],
-        )
-    )
-    logging.info(
-        "size is {status}".format(
-            status="OK"
-            if (element_size["width"], element_size["height"]) == (width, height)
-            else "NG"
-        )
+    window_size, element_size = get_current_size(driver)
+    is_ok = (element_size["width"], element_size["height"]) == (width, height)
+    logging.info("size is {status}".format(status="OK" if is_ok else "NG"))
+
+    return window_size if is_ok else None
+
+
+def get_window_size_cache_key(driver, url, width, height):
+    return "{url}|{width}x{height}|{version}".format(
+        url=url,
+        width=width,
+        height=height,
+        version=driver.capabilities.get(
+            "browserVersion", driver.capabilities.get("version", "unknown")
+        ),
     )
 
 
-def fetch_cloud_image(driver, url, width, height, is_future=False):
+def load_window_size_cache():
+    try:
+        with open(WINDOW_SIZE_CACHE_PATH, "r") as file:
+            return json.load(file)
+    except:
+        return {}
+
+
+def store_window_size_cache(window_size_cache):
+    try:
+        WINDOW_SIZE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = WINDOW_SIZE_CACHE_PATH.with_suffix(".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(window_size_cache, file, indent=4)
+        os.replace(tmp_path, WINDOW_SIZE_CACHE_PATH)
+    except:
+        logging.warning("Failed to store window size cache")
+
+
+def check_window_size(driver, url, width, height, window_size):
+    # NOTE: 確認のために読み込んだページは，そのまま画像の取得に使う
+    wait = WebDriverWait(driver, 5)
+
+    driver.set_window_size(window_size["width"], window_size["height"])
+    driver.get(url)
+    wait.until(EC.presence_of_element_located((By.XPATH, CLOUD_IMAGE_XPATH)))
+
+    element_size = get_current_size(driver)[1]
+
+    return (element_size["width"], element_size["height"]) == (width, height)
+
+
+def change_window_size(driver, url, width, height):
+    # NOTE: 雨雲画像がこのサイズになるように，ウィンドウサイズを調整する
+    logging.info("target: {width} x {height}".format(width=width, height=height))
+
+    # NOTE: 調整結果はブラウザのバージョンとサイズが同じなら変わらないので，
+    # キャッシュしておいたものを使う．ずれていた場合だけ調整し直す．
+    # どちらの場合も，終了時には url のページが読み込まれた状態になるので，
+    # True を返す．
+    cache_key = get_window_size_cache_key(driver, url, width, height)
+    window_size_cache = load_window_size_cache()
+
+    if cache_key in window_size_cache:
+        if check_window_size(driver, url, width, height, window_size_cache[cache_key]):
+            logging.info("size is OK (cached)")
+            metrics.count_cache("window_size", True)
+            return True
+        logging.warning("Cached window size is not suitable, calibrate again")
+    metrics.count_cache("window_size", False)
+
+    window_size = calibrate_window_size(driver, url, width, height)
+
+    if window_size is not None:
+        window_size_cache[cache_key] = {
+            "width": window_size["width"],
+            "height": window_size["height"],
+        }
+        store_window_size_cache(window_size_cache)
+
+    return True
+
+
+def fetch_cloud_image(
+    driver,
+    url,
+    width,
+    height,
+    hour_list=(0,),
+    tile_timeout=TILE_READY_TIMEOUT,
+    is_loaded=False,
+):
     PARTS_LIST = [
         {"class": "jmatile-map-title", "mode": "none"},
         {"class": "leaflet-bar", "mode": "none"},
@@ -148,128 +334,385 @@ def fetch_cloud_image(driver, url, width, height, is_future=False):
 
     wait = WebDriverWait(driver, 5)
 
-    driver.get(url)
+    with metrics.stage("page_load"):
+        # NOTE: ウィンドウサイズの調整で読み込み済みの場合は，読み込み直さない
+        if not is_loaded:
+            driver.get(url)
 
-    wait.until(EC.presence_of_element_located((By.XPATH, CLOUD_IMAGE_XPATH)))
-    for parts in PARTS_LIST:
-        wait.until(EC.presence_of_element_located((By.CLASS_NAME, parts["class"])))
+        wait.until(EC.presence_of_element_located((By.XPATH, CLOUD_IMAGE_XPATH)))
+        for parts in PARTS_LIST:
+            wait.until(EC.presence_of_element_located((By.CLASS_NAME, parts["class"])))
+
+        shape_cloud_display(driver, PARTS_LIST, width, height)
+
+    # NOTE: ページの読み込みと表示の調整は一度だけにして，時間を進めながら
+    # 各時刻の画像を取得する
+    png_data_map = {}
+    signature = None
+    for hour in sorted(hour_list):
+        if hour != 0:
+            select_forecast_hour(driver, hour)
+
+        # NOTE: 決まった時間待つのではなく，タイルが揃うまで待つ
+        with metrics.stage("tile_wait"):
+            signature = wait_tile_ready(driver, tile_timeout, signature)
+
+        with metrics.stage("screenshot"):
+            png_data_map[hour] = driver.find_element(
+                By.XPATH, CLOUD_IMAGE_XPATH
+            ).screenshot_as_png
 
-    shape_cloud_display(driver, PARTS_LIST, width, height, is_future)
+    return png_data_map
 
-    wait.until(
-        lambda driver: driver.execute_script("return document.readyState") == "complete"
+
+def build_retouch_table():
+    h, s = np.meshgrid(
+        np.arange(256, dtype=np.float32),
+        np.arange(256, dtype=np.float32),
+        indexing="ij",
     )
-    time.sleep(0.5)
 
-    png_data = driver.find_element(By.XPATH, CLOUD_IMAGE_XPATH).screenshot_as_png
-    driver.refresh()
+    # NOTE: (H, S) の組み合わせ毎に，該当する降雨強度を求めておく．
+    # 該当しないものは len(RAINFALL_INTENSITY_LEVEL) にする．
+    level = np.full((256, 256), len(RAINFALL_INTENSITY_LEVEL), dtype=np.uint16)
+    for i, intensity in enumerate(RAINFALL_INTENSITY_LEVEL):
+        level[intensity["func"](h, s)] = i
+    is_rain = level != len(RAINFALL_INTENSITY_LEVEL)
+
+    # NOTE: 降雨強度の色はグレースケール用に変換
+    hs_table = np.empty((256 * 256, 2), dtype=np.uint8)
+    hs_table[:, 0] = np.where(is_rain, 0, h).reshape(-1)
+    hs_table[:, 1] = np.where(is_rain, 80, s).reshape(-1)
+
+    # NOTE: V の変換表．行は (降雨強度, S < 30 か) で決める．
+    level_value = np.array(
+        [256 / 16 * (16 - i * 2) for i in range(len(RAINFALL_INTENSITY_LEVEL))],
+        dtype=np.float32,
+    ).astype(np.uint8)
+    # NOTE: 白地図の色をやや明るめにする
+    map_value = np.clip(
+        pow(np.arange(256, dtype=np.float32), 1.35) * 0.3, 0, 255
+    ).astype(np.uint8)
 
-    return png_data
+    v_table = np.empty((len(RAINFALL_INTENSITY_LEVEL) + 1, 2, 256), dtype=np.uint8)
+    v_table[:-1, 0, :] = level_value[:, np.newaxis]
+    v_table[-1, 0, :] = np.arange(256, dtype=np.uint8)
+    v_table[:, 1, :] = map_value
 
+    # NOTE: V の変換表の何行目を使うかは H と S だけで決まるので，オフセットを
+    # 持たせておき，加算だけで参照できるようにする
+    v_offset_table = ((level * 2 + (s < 30)) * 256).astype(np.uint16).reshape(-1)
 
-def retouch_cloud_image(png_data):
-    RAINFALL_INTENSITY_LEVEL = [
-        # NOTE: 白
-        {"func": lambda h, s: (160 < h) & (h < 180) & (s < 20)},
-        # NOTE: 薄水色
-        {"func": lambda h, s: (140 < h) & (h < 150) & (90 < s) & (s < 100)},
-        # NOTE: 水色
-        {"func": lambda h, s: (145 < h) & (h < 155) & (210 < s) & (s < 230)},
-        # NOTE: 青色
-        {"func": lambda h, s: (155 < h) & (h < 165) & (230 < s)},
-        # NOTE: 黄色
-        {"func": lambda h, s: (35 < h) & (h < 45)},
-        # NOTE: 橙色
-        {"func": lambda h, s: (20 < h) & (h < 30)},
-        # NOTE: 赤色
-        {"func": lambda h, s: (0 < h) & (h < 8)},
-        # NOTE: 紫色
-        {"func": lambda h, s: (225 < h) & (h < 235) & (240 < s)},
-    ]
+    return {
+        "hs": hs_table,
+        "v": v_table.reshape(-1),
+        "v_offset": v_offset_table,
+        "level": level.astype(np.uint8).reshape(-1),
+    }
+
+
+def get_retouch_table():
+    global _retouch_table
+
+    if _retouch_table is None:
+        _retouch_table = build_retouch_table()
+
+    return _retouch_table
 
-    img_rgb = cv2.imdecode(
+
+def decode_cloud_image(png_data):
+    return cv2.imdecode(
         np.asarray(bytearray(png_data), dtype=np.uint8), cv2.IMREAD_COLOR
     )
 
-    img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2HSV_FULL).astype(np.float32)
-    h, s, v = cv2.split(img_hsv)
 
-    # NOTE: 降雨強度の色をグレースケール用に変換
-    for i, level in enumerate(RAINFALL_INTENSITY_LEVEL):
-        img_hsv[level["func"](h, s), 0] = 0
-        img_hsv[level["func"](h, s), 1] = 80
-        img_hsv[level["func"](h, s), 2] = 256 / 16 * (16 - i * 2)
+def retouch_cloud_image(png_data):
+    return retouch_cloud_array(decode_cloud_image(png_data))
 
-    # NOTE: 白地図の色をやや明るめにする
-    img_hsv[s < 30, 2] = np.clip(pow(v[(s < 30)], 1.35) * 0.3, 0, 255)
 
+def retouch_cloud_array(img_rgb):
+    # NOTE: img_rgb は OpenCV でデコードしたものと同じ BGR の配列
+    table = get_retouch_table()
+
+    img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2HSV_FULL)
+    h, s, v = cv2.split(img_hsv)
+
+    # NOTE: 変換表を引くだけで，降雨強度の色の変換と白地図の補正を一度に行う
+    hs_index = (h.astype(np.uint16) << 8) | s
+    img_hsv[:, :, 0:2] = np.take(table["hs"], hs_index, axis=0)
+    img_hsv[:, :, 2] = np.take(table["v"], np.take(table["v_offset"], hs_index) + v)
+
+    # NOTE: 以降の処理は全てグレースケールで行う
     return PIL.Image.fromarray(
         cv2.cvtColor(
-            cv2.cvtColor(img_hsv.astype(np.uint8), cv2.COLOR_HSV2RGB_FULL),
-            cv2.COLOR_RGB2RGBA,
+            cv2.cvtColor(img_hsv, cv2.COLOR_HSV2RGB_FULL),
+            cv2.COLOR_RGB2GRAY,
+        ),
+        "L",
+    )
+
+
+# NOTE: ブラウザで表示した地図では，5km の円の直径が 327 ピクセルなので，
+# 1km あたりのピクセル数．タイルから合成する場合は，ズームレベルと緯度で決まる．
+BROWSER_PIXEL_PER_KM = 327 / 2 / 5
+# NOTE: 集計する円の半径 [km] と，方角の分割数 (北を中心に時計回り)
+RAIN_AREA_RING_LIST = (1, 2.5, 5, 10)
+RAIN_AREA_SECTOR_COUNT = 8
+# NOTE: キャプションに表示する範囲の半径 [km]
+RAIN_AREA_CAPTION_RADIUS = 5
+
+
+def classify_cloud_array(img_rgb):
+    # NOTE: 画素毎の降雨強度を返す．該当しない画素は len(RAINFALL_INTENSITY_LEVEL)
+    table = get_retouch_table()
+
+    img_hsv = cv2.cvtColor(img_rgb, cv2.COLOR_BGR2HSV_FULL)
+    hs_index = (img_hsv[:, :, 0].astype(np.uint16) << 8) | img_hsv[:, :, 1]
+
+    return np.take(table["level"], hs_index)
+
+
+def get_pixel_per_km(panel_config):
+    if panel_config.get("BACKEND", "browser") == "tile":
+        return rain_cloud_tile.get_pixel_per_km(
+            panel_config["TILE"]["LAT"], rain_cloud_tile.get_zoom(panel_config["TILE"])
         )
+    else:
+        return BROWSER_PIXEL_PER_KM
+
+
+@functools.lru_cache(maxsize=8)
+def get_radial_index(width, height, ring_list, sector_count, pixel_per_km):
+    # NOTE: 中心からの距離と方角は画像サイズと縮尺だけで決まるので，
+    # (円, 方角) の組み合わせの番号を画素毎に一度だけ求めておく．一番外側の
+    # 円の外は最後の番号にする．計算するのは外側の円を囲む範囲だけ．
+    cx = width / 2
+    cy = height / 2
+    radius = ring_list[-1] * pixel_per_km
+    box = (
+        max(int(cx - radius), 0),
+        max(int(cy - radius), 0),
+        min(int(math.ceil(cx + radius)) + 1, width),
+        min(int(math.ceil(cy + radius)) + 1, height),
+    )
+
+    y, x = np.ogrid[box[1] : box[3], box[0] : box[2]]
+    dx = x + 0.5 - cx
+    dy = y + 0.5 - cy
+
+    ring = np.searchsorted(
+        np.array(ring_list, dtype=np.float64),
+        np.hypot(dx, dy) / pixel_per_km,
+        side="right",
+    )
+    sector_angle = 360 / sector_count
+    sector = (
+        ((np.degrees(np.arctan2(dx, -dy)) + sector_angle / 2) % 360) // sector_angle
+    ).astype(np.intp) % sector_count
+
+    bin_count = len(ring_list) * sector_count + 1
+    index = np.where(ring < len(ring_list), ring * sector_count + sector, bin_count - 1)
+
+    # NOTE: 降雨強度と組み合わせて1回の bincount で集計できるよう，
+    # 降雨強度の種類数を掛けておく
+    level_count = len(RAINFALL_INTENSITY_LEVEL) + 1
+
+    return {
+        "box": box,
+        "index": (index * level_count).astype(np.uint16),
+        "bin_count": bin_count,
+    }
+
+
+def summarize_rain_hist(hist):
+    # NOTE: hist は降雨強度毎の画素数
+    rain_hist = hist[: len(RAINFALL_INTENSITY_LEVEL)]
+    total = int(hist.sum())
+    level_list = np.flatnonzero(rain_hist)
+
+    return {
+        "coverage": (float(rain_hist.sum()) / total) if total != 0 else 0.0,
+        "level": int(level_list[-1]) if len(level_list) != 0 else None,
+    }
+
+
+def analyze_rain_area(
+    img_rgb,
+    ring_list=RAIN_AREA_RING_LIST,
+    sector_count=RAIN_AREA_SECTOR_COUNT,
+    pixel_per_km=BROWSER_PIXEL_PER_KM,
+):
+    # NOTE: 中心 (自宅) の周りの，円毎・方角毎の雨の範囲と最大の降雨強度を求める．
+    # 円は内側から順に並んでいる必要があるので，設定の順番によらず並べ替える．
+    ring_list = tuple(sorted(ring_list))
+    radial_index = get_radial_index(
+        img_rgb.shape[1], img_rgb.shape[0], ring_list, sector_count, pixel_per_km
+    )
+    box = radial_index["box"]
+    level_count = len(RAINFALL_INTENSITY_LEVEL) + 1
+
+    level = classify_cloud_array(img_rgb[box[1] : box[3], box[0] : box[2]])
+    hist = np.bincount(
+        (radial_index["index"] + level).reshape(-1),
+        minlength=radial_index["bin_count"] * level_count,
+    )[: (radial_index["bin_count"] - 1) * level_count].reshape(
+        len(ring_list), sector_count, level_count
     )
 
+    ring_hist = hist.sum(axis=1)
+    within_hist = np.cumsum(ring_hist, axis=0)
+
+    return {
+        "hist": hist,
+        "ring": [
+            dict(summarize_rain_hist(ring_hist[i]), radius=radius)
+            for i, radius in enumerate(ring_list)
+        ],
+        "within": [
+            dict(summarize_rain_hist(within_hist[i]), radius=radius)
+            for i, radius in enumerate(ring_list)
+        ],
+        "sector": [summarize_rain_hist(sector) for sector in hist.sum(axis=0)],
+    }
 
-def draw_equidistant_circle(img):
-    draw = PIL.ImageDraw.Draw(img)
-    x = img.size[0] / 2
-    y = img.size[1] / 2
 
+def get_rain_area_text(area, radius=RAIN_AREA_CAPTION_RADIUS):
+    for within in area["within"]:
+        if within["radius"] != radius:
+            continue
+        if within["level"] is None:
+            status = "雨なし"
+        else:
+            status = RAINFALL_INTENSITY_LEVEL[within["level"]]["name"]
+
+        return "{radius:g}km圏内: {status}".format(radius=radius, status=status)
+
+    return None
+
+
+def update_rain_area_metrics(area, hour):
+    for within in area["within"]:
+        labels = {"hour": str(hour), "radius": "{radius:g}".format(**within)}
+        metrics.set_gauge("rain_coverage_ratio", within["coverage"], **labels)
+        metrics.set_gauge(
+            "rainfall_max_mm",
+            (
+                RAINFALL_INTENSITY_LEVEL[within["level"]]["rainfall"]
+                if within["level"] is not None
+                else 0
+            ),
+            **labels
+        )
+
+
+# NOTE: 距離の円の半径 [km]
+CIRCLE_RADIUS = 5
+# NOTE: 円の外接矩形に対する，線幅の分の余白
+CIRCLE_OVERLAY_MARGIN = 13
+CAPTION_PADDING = 12
+CAPTION_RADIUS = 20
+CAPTION_ALPHA = 200
+
+
+def draw_equidistant_circle_at(draw, x, y, pixel_per_km, light=255, dark=60):
     size = 20
     draw.ellipse(
         (x - size / 2, y - size / 2, x + size / 2, y + size / 2),
-        fill=(255, 255, 255),
-        outline=(60, 60, 60),
+        fill=light,
+        outline=dark,
         width=5,
     )
     # 5km
-    size = 327
+    size = CIRCLE_RADIUS * 2 * pixel_per_km
     draw.ellipse(
         (x - size / 2, y - size / 2, x + size / 2, y + size / 2),
-        outline=(255, 255, 255),
+        outline=light,
         width=8,
     )
-    size = 322
+    size -= 5
     draw.ellipse(
         (x - size / 2, y - size / 2, x + size / 2, y + size / 2),
-        outline=(60, 60, 60),
+        outline=dark,
         width=3,
     )
 
-    return img
 
+@functools.lru_cache(maxsize=8)
+def get_circle_overlay(width, height, pixel_per_km):
+    # NOTE: 円は画像サイズと縮尺だけで決まるので，一度だけ描画しておく．描画
+    # 位置の小数部分が変わらないように，整数だけずらした座標系で描く．
+    overlay_size = (
+        int(math.ceil(CIRCLE_RADIUS * 2 * pixel_per_km)) + CIRCLE_OVERLAY_MARGIN
+    )
+    origin = (
+        int(width / 2) - overlay_size // 2,
+        int(height / 2) - overlay_size // 2,
+    )
 
-def draw_caption(img, title, face):
-    size = face["title"].getsize(title)
-    x = 10
-    y = 10
-    padding = 12
-    radius = 20
-    alpha = 200
+    img = PIL.Image.new("L", (overlay_size, overlay_size), 0)
+    mask = PIL.Image.new("L", (overlay_size, overlay_size), 0)
+    x = width / 2 - origin[0]
+    y = height / 2 - origin[1]
+    draw_equidistant_circle_at(PIL.ImageDraw.Draw(img), x, y, pixel_per_km)
+    # NOTE: 描画した部分だけを貼り付けられるように，同じ図形をマスクにも描く
+    draw_equidistant_circle_at(PIL.ImageDraw.Draw(mask), x, y, pixel_per_km, 255, 255)
 
-    overlay = PIL.Image.new("RGBA", img.size, (255, 255, 255, 0))
-    draw = PIL.ImageDraw.Draw(overlay)
-    draw.rectangle(
+    return (img, mask, origin)
+
+
+def draw_equidistant_circle(img, pixel_per_km=BROWSER_PIXEL_PER_KM):
+    overlay, mask, origin = get_circle_overlay(img.size[0], img.size[1], pixel_per_km)
+    img.paste(
+        overlay,
         (
-            x - padding,
-            y - padding,
-            x + size[0] + padding - radius,
-            y + size[1] + padding,
+            origin[0],
+            origin[1],
+            origin[0] + overlay.size[0],
+            origin[1] + overlay.size[1],
         ),
-        fill=(255, 255, 255, alpha),
+        mask,
     )
+
+    return img
+
+
+@functools.lru_cache(maxsize=32)
+def get_caption_mask(width, height):
+    # NOTE: 背景の形は文字列の大きさだけで決まるので，大きさ毎に一度だけ描く
+    mask = PIL.Image.new("L", (width, height), 0)
+    draw = PIL.ImageDraw.Draw(mask)
     draw.rectangle(
-        (x - padding, y - padding, x + size[0] + padding, y + padding),
-        fill=(255, 255, 255, alpha),
+        (0, 0, mask.size[0] - 1 - CAPTION_RADIUS, mask.size[1] - 1),
+        fill=CAPTION_ALPHA,
+    )
+    draw.rectangle(
+        (0, 0, mask.size[0] - 1, 2 * CAPTION_PADDING),
+        fill=CAPTION_ALPHA,
     )
-
     draw.rounded_rectangle(
-        (x - padding, y - padding, x + size[0] + padding, y + size[1] + padding),
-        fill=(255, 255, 255, alpha),
-        radius=radius,
+        (0, 0, mask.size[0] - 1, mask.size[1] - 1),
+        fill=CAPTION_ALPHA,
+        radius=CAPTION_RADIUS,
     )
-    img = PIL.Image.alpha_composite(img, overlay)
+
+    return mask
+
+
+def draw_caption(img, title, face):
+    size = get_text_size(face["title"], title)
+    x = 10
+    y = 10
+
+    # NOTE: 半透明の背景は，画像全体ではなく背景の範囲だけで合成する
+    box = (
+        x - CAPTION_PADDING,
+        y - CAPTION_PADDING,
+        x + size[0] + CAPTION_PADDING,
+        y + size[1] + CAPTION_PADDING,
+    )
+    mask = get_caption_mask(box[2] - box[0] + 1, box[3] - box[1] + 1)
+    img.paste(255, (box[0], box[1], box[0] + mask.size[0], box[1] + mask.size[1]), mask)
+
     draw_text(
         img,
         title,
@@ -287,48 +730,92 @@ def create(panel_config, font_config):
 
     now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9), "JST"))
 
-    SUB_PANEL_CONFIG_LIST = [
-        {"is_future": False, "title": now.strftime("現在(%H:%M)"), "offset_x": 0},
-        {
-            "is_future": True,
-            "title": "１時間後",
-            "offset_x": int(panel_config["WIDTH"] / 2),
-        },
-    ]
-    driver = create_driver()
-
-    change_window_size(
-        driver,
-        panel_config["URL"],
-        int(panel_config["WIDTH"] / 2),
-        panel_config["HEIGHT"],
-    )
+    # NOTE: 0 が現在で，それ以外は何時間後の予報を表示するか
+    hour_list = panel_config.get("HOUR_LIST", [0, 1])
+    sub_width = int(panel_config["WIDTH"] / len(hour_list))
+
+    sub_panel_config_list = []
+    for i, hour in enumerate(hour_list):
+        if hour == 0:
+            title = now.strftime("現在(%H:%M)")
+        else:
+            title = "{hour}時間後".format(
+                hour=str(hour).translate(str.maketrans("0123456789", "０１２３４５６７８９"))
+            )
+        sub_panel_config_list.append(
+            {"hour": hour, "title": title, "offset_x": sub_width * i}
+        )
 
-    img = PIL.Image.new(
-        "RGBA",
-        (panel_config["WIDTH"], panel_config["HEIGHT"]),
-        (255, 255, 255, 255),
-    )
+    img = PIL.Image.new("L", (panel_config["WIDTH"], panel_config["HEIGHT"]), 255)
     face_map = get_face_map(font_config)
-
-    for sub_panel_config in SUB_PANEL_CONFIG_LIST:
-        sub_img = retouch_cloud_image(
-            fetch_cloud_image(
+    pixel_per_km = get_pixel_per_km(panel_config)
+    # NOTE: 値の無い HISTORY (null) は，指定が無いものとして扱う
+    history_config = panel_config.get("HISTORY")
+
+    if panel_config.get("BACKEND", "browser") == "tile":
+        # NOTE: ブラウザを使わずに，タイル画像を直接取得して合成する
+        img_rgb_map = rain_cloud_tile.fetch_cloud_image(
+            panel_config["TILE"], sub_width, panel_config["HEIGHT"], hour_list
+        )
+    else:
+        with driver_session() as driver:
+            with metrics.stage("window_calibration"):
+                is_loaded = change_window_size(
+                    driver,
+                    panel_config["URL"],
+                    sub_width,
+                    panel_config["HEIGHT"],
+                )
+
+            png_data_map = fetch_cloud_image(
                 driver,
                 panel_config["URL"],
-                int(panel_config["WIDTH"] / 2),
+                sub_width,
                 panel_config["HEIGHT"],
-                sub_panel_config["is_future"],
+                hour_list,
+                panel_config.get("TILE_TIMEOUT", TILE_READY_TIMEOUT),
+                is_loaded,
             )
-        )
-        time.sleep(1)
-        sub_img = draw_equidistant_circle(sub_img)
-        sub_img = draw_caption(sub_img, sub_panel_config["title"], face_map)
+        img_rgb_map = {
+            hour: decode_cloud_image(png_data)
+            for hour, png_data in png_data_map.items()
+        }
+
+    for sub_panel_config in sub_panel_config_list:
+        title = sub_panel_config["title"]
+        with metrics.stage("rain_area"):
+            area = analyze_rain_area(
+                img_rgb_map[sub_panel_config["hour"]],
+                panel_config.get("AREA_RING_LIST", RAIN_AREA_RING_LIST),
+                panel_config.get("AREA_SECTOR_COUNT", RAIN_AREA_SECTOR_COUNT),
+                pixel_per_km,
+            )
+        update_rain_area_metrics(area, sub_panel_config["hour"])
+        if panel_config.get("AREA_CAPTION", False):
+            area_text = get_rain_area_text(
+                area, panel_config.get("AREA_CAPTION_RADIUS", RAIN_AREA_CAPTION_RADIUS)
+            )
+            if area_text is not None:
+                title += " " + area_text
+
+        with metrics.stage("retouch"):
+            sub_img = retouch_cloud_array(img_rgb_map[sub_panel_config["hour"]])
+        if (sub_panel_config["hour"] == 0) and (history_config is not None):
+            # NOTE: 現在の画像は，後で推移を表示できるように履歴に残しておく
+            try:
+                frame_history.get_frame_history(
+                    sub_width,
+                    panel_config["HEIGHT"],
+                    history_config.get("SIZE", frame_history.FRAME_HISTORY_SIZE),
+                ).append(sub_img, now.timestamp())
+            except:
+                logging.warning("Failed to store frame history", exc_info=True)
+        with metrics.stage("text_draw"):
+            sub_img = draw_equidistant_circle(sub_img, pixel_per_km)
+            sub_img = draw_caption(sub_img, title, face_map)
         img.paste(sub_img, (sub_panel_config["offset_x"], 0))
 
-    driver.quit()
-
-    return img.convert("L")
+    return img
 
 
 if __name__ == "__main__":
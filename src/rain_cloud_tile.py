@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+# NOTE: ブラウザを使わずに，気象庁のナウキャストのタイル画像と背景地図の
+# タイル画像を取得して，雨雲レーダーの画像を合成する．
+#
+# 設定 (RAIN_CLOUD.TILE)
+#   LAT, LON: 中心 (自宅) の緯度と経度
+#   ZOOM:     ズームレベル (省略時は TILE_ZOOM)．1ピクセルあたりの距離が
+#             変わるので，距離の円や雨の範囲の集計もこれに合わせた縮尺になる．
+import os
+import math
+import json
+import time
+import pathlib
+import hashlib
+import datetime
+import threading
+import concurrent.futures
+import logging
+
+import cv2
+import numpy as np
+
+from constants import DATA_PATH
+import http_client
+import metrics
+
+TILE_SIZE = 256
+# NOTE: Web メルカトルで使う赤道の長さ [m]
+EARTH_CIRCUMFERENCE = 2 * math.pi * 6378137
+
+TIME_LIST_URL = "https://www.jma.go.jp/bosai/jmatile/data/nowc/targetTimes_{kind}.json"
+RAIN_TILE_URL = (
+    "https://www.jma.go.jp/bosai/jmatile/data/nowc/"
+    + "{basetime}/none/{validtime}/surf/hrpns/{z}/{x}/{y}.png"
+)
+BASE_TILE_URL = "https://cyberjapandata.gsi.go.jp/xyz/pale/{z}/{x}/{y}.png"
+
+# NOTE: 北緯 35 度付近で，ブラウザで表示した地図 (5km が 163.5 ピクセル) と
+# ほぼ同じ縮尺になるズームレベル
+TILE_ZOOM = 12
+
+# NOTE: これより拡大する場合は，このズームレベルのタイルを引き伸ばす
+RAIN_TILE_MAX_ZOOM = 10
+BASE_TILE_MAX_ZOOM = 18
+
+# NOTE: 背景地図はほとんど変わらないので，長期間キャッシュを使う [秒]
+BASE_TILE_MAX_AGE = 30 * 24 * 60 * 60
+
+TILE_CACHE_PATH = DATA_PATH / "tile"
+TILE_CACHE_MAX_SIZE = 64 * 1024 * 1024
+TILE_FETCH_TIMEOUT = 10
+TILE_FETCH_WORKERS = 8
+
+_tile_cache = None
+_tile_cache_lock = threading.Lock()
+_tile_executor = concurrent.futures.ThreadPoolExecutor(max_workers=TILE_FETCH_WORKERS)
+
+
+class TileCache:
+    def __init__(self, path=TILE_CACHE_PATH, max_size=TILE_CACHE_MAX_SIZE):
+        self.path = pathlib.Path(path)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def get_file_path(self, url):
+        return self.path / (hashlib.sha256(url.encode()).hexdigest()[:32] + ".png")
+
+    def get(self, url, max_age=None):
+        file_path = self.get_file_path(url)
+        try:
+            # NOTE: 更新日時は取得した日時として使い，最終アクセス日時を LRU の
+            # 管理に使う
+            stat = file_path.stat()
+            if (max_age is not None) and (time.time() - stat.st_mtime > max_age):
+                return None
+            with open(file_path, "rb") as file:
+                data = file.read()
+            os.utime(file_path, (time.time(), stat.st_mtime))
+            return data
+        except OSError:
+            return None
+
+    def put(self, url, data):
+        file_path = self.get_file_path(url)
+        tmp_path = file_path.with_suffix(".tmp")
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, file_path)
+        except OSError:
+            logging.warning("Failed to store tile cache: {url}".format(url=url))
+
+    def evict(self):
+        with self.lock:
+            stat_list = []
+            for file_path in self.path.glob("*.png"):
+                try:
+                    stat_list.append((file_path, file_path.stat()))
+                except FileNotFoundError:
+                    pass
+
+            total_size = sum(stat.st_size for file_path, stat in stat_list)
+            for file_path, stat in sorted(stat_list, key=lambda item: item[1].st_atime):
+                if total_size <= self.max_size:
+                    break
+                file_path.unlink(missing_ok=True)
+                total_size -= stat.st_size
+
+
+def get_tile_cache():
+    global _tile_cache
+
+    with _tile_cache_lock:
+        if _tile_cache is None:
+            _tile_cache = TileCache()
+
+        return _tile_cache
+
+
+def fetch_url(url):
+    return http_client.fetch(url, timeout=TILE_FETCH_TIMEOUT)
+
+
+def fetch_tile(url, max_age=None):
+    cache = get_tile_cache()
+
+    data = cache.get(url, max_age)
+    metrics.count_cache("tile", data is not None)
+    if data is not None:
+        # NOTE: 存在しないタイルは空のファイルとしてキャッシュしている
+        return data if len(data) != 0 else None
+
+    try:
+        data = fetch_url(url)
+    except Exception as e:
+        # NOTE: 範囲外のタイルは存在しないので，透明として扱う
+        if isinstance(e, http_client.HTTPError) and (e.code == 404):
+            cache.put(url, b"")
+            return None
+
+        # NOTE: 取得できない場合は，期限切れでもキャッシュにあるものを使う
+        data = cache.get(url) if max_age is not None else None
+        if data is None:
+            raise
+        logging.warning(
+            "Failed to fetch tile, use cached one: {url} ({error})".format(
+                url=url, error=repr(e)
+            )
+        )
+        metrics.increment("tile_fallback_total")
+
+        return data if len(data) != 0 else None
+
+    cache.put(url, data)
+
+    return data
+
+
+def decode_tile(data):
+    if data is None:
+        return None
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
+    elif img.shape[2] == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+
+    return img
+
+
+def get_pixel_pos(lat, lon, zoom):
+    # NOTE: Web メルカトルでの，ズームレベル zoom における全体のピクセル座標
+    scale = TILE_SIZE * (2**zoom)
+    sin_lat = math.sin(math.radians(lat))
+
+    return (
+        (lon + 180) / 360 * scale,
+        (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale,
+    )
+
+
+def get_zoom(tile_config):
+    zoom = tile_config.get("ZOOM", TILE_ZOOM)
+    if (not isinstance(zoom, int)) or (zoom < 0) or (zoom > BASE_TILE_MAX_ZOOM):
+        raise ValueError(
+            "Invalid zoom level: {zoom} (0 - {max_zoom})".format(
+                zoom=zoom, max_zoom=BASE_TILE_MAX_ZOOM
+            )
+        )
+
+    return zoom
+
+
+def get_pixel_per_km(lat, zoom):
+    # NOTE: Web メルカトルでは，1ピクセルあたりの距離は緯度とズームレベルで決まる
+    meter_per_pixel = (
+        EARTH_CIRCUMFERENCE * math.cos(math.radians(lat)) / (TILE_SIZE * (2**zoom))
+    )
+
+    return 1000 / meter_per_pixel
+
+
+def get_tile_range(center, width, height):
+    # NOTE: center を中心とした width x height の範囲を覆うタイルの範囲と，
+    # その左上からの切り出し位置を返す
+    left = int(round(center[0] - width / 2))
+    top = int(round(center[1] - height / 2))
+
+    return {
+        "x": range(left // TILE_SIZE, (left + width - 1) // TILE_SIZE + 1),
+        "y": range(top // TILE_SIZE, (top + height - 1) // TILE_SIZE + 1),
+        "offset": (left % TILE_SIZE, top % TILE_SIZE),
+    }
+
+
+def compose_layer(url_format, pos, zoom, max_zoom, width, height, max_age=None):
+    # NOTE: タイルが無いズームレベルでは，その上限のタイルを引き伸ばす
+    native_zoom = min(zoom, max_zoom)
+    scale = 2 ** (zoom - native_zoom)
+    native_width = int(math.ceil(width / scale))
+    native_height = int(math.ceil(height / scale))
+
+    tile_range = get_tile_range(
+        (pos[0] / scale, pos[1] / scale), native_width, native_height
+    )
+    tile_count = 2**native_zoom
+
+    # NOTE: タイルの取得は並列に行う
+    future_map = {}
+    for y in tile_range["y"]:
+        for x in tile_range["x"]:
+            if (y < 0) or (y >= tile_count):
+                continue
+            future_map[(x, y)] = _tile_executor.submit(
+                fetch_tile,
+                url_format.format(z=native_zoom, x=x % tile_count, y=y),
+                max_age,
+            )
+
+    canvas = np.zeros(
+        (len(tile_range["y"]) * TILE_SIZE, len(tile_range["x"]) * TILE_SIZE, 4),
+        dtype=np.uint8,
+    )
+    for (x, y), future in future_map.items():
+        tile = decode_tile(future.result())
+        if tile is None:
+            continue
+        offset_x = (x - tile_range["x"].start) * TILE_SIZE
+        offset_y = (y - tile_range["y"].start) * TILE_SIZE
+        canvas[
+            offset_y : offset_y + tile.shape[0], offset_x : offset_x + tile.shape[1]
+        ] = tile[:TILE_SIZE, :TILE_SIZE]
+
+    offset_x, offset_y = tile_range["offset"]
+    layer = canvas[
+        offset_y : offset_y + native_height, offset_x : offset_x + native_width
+    ]
+    if scale != 1:
+        # NOTE: 降水強度の色が混ざらないように，補間はしない
+        layer = cv2.resize(
+            layer,
+            (native_width * scale, native_height * scale),
+            interpolation=cv2.INTER_NEAREST,
+        )
+
+    return layer[:height, :width]
+
+
+def blend_layer(base, overlay):
+    # NOTE: 背景の透明部分は白にして，その上に雨雲を重ねる
+    base_alpha = base[:, :, 3:4].astype(np.uint16)
+    img = (base[:, :, :3] * base_alpha + 255 * (255 - base_alpha)) // 255
+
+    alpha = overlay[:, :, 3:4].astype(np.uint16)
+    img = (overlay[:, :, :3] * alpha + img * (255 - alpha)) // 255
+
+    return img.astype(np.uint8)
+
+
+def parse_time(time_str):
+    return datetime.datetime.strptime(time_str, "%Y%m%d%H%M%S")
+
+
+def get_target_time_list(time_list_url):
+    time_list = []
+    for kind in ["N1", "N2"]:
+        time_list.extend(json.loads(fetch_url(time_list_url.format(kind=kind))))
+
+    return time_list
+
+
+def select_target_time(time_list, hour):
+    # NOTE: 最新の観測時刻を基準に，hour 時間後の予報を選ぶ
+    basetime = max(target["basetime"] for target in time_list)
+    validtime = (parse_time(basetime) + datetime.timedelta(hours=hour)).strftime(
+        "%Y%m%d%H%M%S"
+    )
+
+    for target in time_list:
+        if (target["basetime"] == basetime) and (target["validtime"] == validtime):
+            return target
+
+    raise ValueError(
+        "No rain cloud data for {hour} hour(s) later (base: {basetime})".format(
+            hour=hour, basetime=basetime
+        )
+    )
+
+
+def fetch_cloud_image(tile_config, width, height, hour_list=(0,)):
+    # NOTE: 返すのはスクリーンショットをデコードしたものと同じ BGR の配列
+    zoom = get_zoom(tile_config)
+    pos = get_pixel_pos(tile_config["LAT"], tile_config["LON"], zoom)
+
+    with metrics.stage("tile_fetch"):
+        time_list = get_target_time_list(tile_config.get("TIME_URL", TIME_LIST_URL))
+
+        base = compose_layer(
+            tile_config.get("BASE_URL", BASE_TILE_URL),
+            pos,
+            zoom,
+            tile_config.get("BASE_MAX_ZOOM", BASE_TILE_MAX_ZOOM),
+            width,
+            height,
+            BASE_TILE_MAX_AGE,
+        )
+
+        img_map = {}
+        for hour in hour_list:
+            target = select_target_time(time_list, hour)
+            rain = compose_layer(
+                tile_config.get("RAIN_URL", RAIN_TILE_URL).format(
+                    basetime=target["basetime"],
+                    validtime=target["validtime"],
+                    z="{z}",
+                    x="{x}",
+                    y="{y}",
+                ),
+                pos,
+                zoom,
+                tile_config.get("RAIN_MAX_ZOOM", RAIN_TILE_MAX_ZOOM),
+                width,
+                height,
+            )
+            img_map[hour] = blend_layer(base, rain)
+
+    get_tile_cache().evict()
+
+    return img_map
+
+
+if __name__ == "__main__":
+    import sys
+    import logger
+    from config import load_config
+
+    logger.init("test")
+    logging.info("Test")
+
+    config = load_config()
+
+    img_map = fetch_cloud_image(
+        config["RAIN_CLOUD"]["TILE"],
+        config["RAIN_CLOUD"]["WIDTH"],
+        config["RAIN_CLOUD"]["HEIGHT"],
+        [int(hour) for hour in sys.argv[1:]] or [0],
+    )
+    for hour, img in img_map.items():
+        cv2.imwrite("test_rain_cloud_tile_{hour}.png".format(hour=hour), img)
+
+    print("Finish.")
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import os
+import io
+import hashlib
+import logging
+
+import paramiko
+
+import fb_format
+import dither
+import metrics
+
+DISPLAY_PATH = "/dev/shm/display.png"
+DISPLAY_COMMAND = (
+    "sudo killall -q -9 fbi; "
+    + "sudo fbi -1 -T 1 -d /dev/fb0 --noverbose {path}".format(path=DISPLAY_PATH)
+)
+
+FB_WRITER_LOCAL_PATH = os.path.join(os.path.dirname(__file__), "fb_writer.py")
+# NOTE: root 権限で実行するので，root 以外は書き換えられない場所に置く．
+# 送る際は，ログインユーザーのホームディレクトリを経由する．
+FB_WRITER_PATH = "/usr/local/lib/e-ink_rain-cloud_panel/fb_writer.py"
+FB_WRITER_UPLOAD_PATH = "fb_writer.py"
+FB_WRITER_CHECK_COMMAND = "echo '{digest}  {path}' | sha256sum --check --status"
+FB_WRITER_INSTALL_COMMAND = (
+    "sudo install -D -o root -g root -m 644 {upload_path} {path}"
+    + " && rm -f {upload_path} && "
+    + FB_WRITER_CHECK_COMMAND
+)
+FB_WRITER_COMMAND = "sudo killall -q -9 fbi; sudo python3 {path} {device}"
+FB_WRITER_TIMEOUT = 30
+
+# NOTE: 無通信で接続が切られないように，定期的に keepalive を送る [秒]
+KEEPALIVE_INTERVAL = 30
+# NOTE: 接続や送信が止まった場合に，諦めるまでの時間 [秒]
+PUSH_TIMEOUT = 30
+PUSH_RETRY = 1
+
+
+class RemoteDisplay:
+    def __init__(
+        self,
+        hostname,
+        key_file_path,
+        port=22,
+        username="ubuntu",
+        output="png",
+        fb_device="/dev/fb0",
+        png_level=None,
+        timeout=PUSH_TIMEOUT,
+        retry=PUSH_RETRY,
+    ):
+        self.hostname = hostname
+        self.timeout = timeout
+        self.retry = retry
+        self.port = port
+        self.username = username
+        self.output = output
+        self.fb_device = fb_device
+        # NOTE: 階調数を減らしてある場合は，パレット形式の PNG にして送る
+        self.png_level = png_level
+        # NOTE: 鍵の読み込みは一度だけにする
+        with open(key_file_path) as file:
+            self.pkey = paramiko.RSAKey.from_private_key(file)
+        self.ssh = None
+        self.sftp = None
+        self.display_channel = None
+        self.fb_channel = None
+        self.fb_stdout = None
+        self.fb_geometry = None
+
+    def is_connected(self):
+        if self.ssh is None:
+            return False
+        transport = self.ssh.get_transport()
+
+        return (transport is not None) and transport.is_active()
+
+    def connect(self):
+        logging.info(
+            "Connect to {hostname}:{port}".format(
+                hostname=self.hostname, port=self.port
+            )
+        )
+
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        ssh.connect(
+            self.hostname,
+            port=self.port,
+            username=self.username,
+            pkey=self.pkey,
+            allow_agent=False,
+            look_for_keys=False,
+            timeout=self.timeout,
+            banner_timeout=self.timeout,
+            auth_timeout=self.timeout,
+        )
+        ssh.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+
+        self.ssh = ssh
+        self.sftp = ssh.open_sftp()
+        self.sftp.get_channel().settimeout(self.timeout)
+
+    def close(self):
+        if self.display_channel is not None:
+            self.display_channel.close()
+        self.display_channel = None
+
+        if self.fb_channel is not None:
+            try:
+                self.fb_channel.sendall(fb_format.encode_end())
+            except:
+                pass
+            self.fb_channel.close()
+        self.fb_channel = None
+        self.fb_stdout = None
+
+        if self.sftp is not None:
+            self.sftp.close()
+        if self.ssh is not None:
+            self.ssh.close()
+        self.sftp = None
+        self.ssh = None
+
+    def ensure_connected(self):
+        if not self.is_connected():
+            self.close()
+            self.connect()
+
+    def upload(self, data, path):
+        # NOTE: 書き込み途中のファイルが表示されないように，一時ファイルに
+        # 書いてからリネームする
+        tmp_path = path + ".tmp"
+        with self.sftp.open(tmp_path, "wb") as file:
+            file.set_pipelined(True)
+            file.write(data)
+        self.sftp.posix_rename(tmp_path, path)
+
+    def exec_command(self, command):
+        channel = self.ssh.get_transport().open_session()
+        channel.exec_command(command)
+
+        return channel
+
+    def push(self, func, *args):
+        for i in range(self.retry + 1):
+            try:
+                self.ensure_connected()
+                with metrics.stage("push"):
+                    func(*args)
+                return
+            except Exception:
+                logging.warning(
+                    "Failed to push image to {hostname}".format(hostname=self.hostname),
+                    exc_info=True,
+                )
+                metrics.increment("push_failure_total", host=self.hostname)
+                self.close()
+                if i == self.retry:
+                    raise
+
+    def send_png(self, png_data):
+        self.upload(png_data, DISPLAY_PATH)
+        # NOTE: fbi は表示中の画像を読み直せないので，前回のものを終了させて
+        # 起動し直す．終了は待たないが，チャンネルが溜まっていかないように
+        # 前回のものはここで閉じる．
+        if self.display_channel is not None:
+            self.display_channel.close()
+        self.display_channel = self.exec_command(DISPLAY_COMMAND)
+
+    def show_png(self, png_data):
+        self.push(self.send_png, png_data)
+
+    def run_command(self, command):
+        channel = self.exec_command(command)
+        channel.settimeout(self.timeout)
+        try:
+            return channel.recv_exit_status()
+        finally:
+            channel.close()
+
+    def install_fb_writer(self):
+        with open(FB_WRITER_LOCAL_PATH, "rb") as file:
+            script = file.read()
+        digest = hashlib.sha256(script).hexdigest()
+
+        # NOTE: 設置済みのものが同じ内容なら，そのまま使う
+        check_command = FB_WRITER_CHECK_COMMAND.format(
+            digest=digest, path=FB_WRITER_PATH
+        )
+        if self.run_command(check_command) == 0:
+            return
+
+        logging.info(
+            "Install framebuffer writer to {hostname}:{path}".format(
+                hostname=self.hostname, path=FB_WRITER_PATH
+            )
+        )
+        self.upload(script, FB_WRITER_UPLOAD_PATH)
+        # NOTE: root の所有にした後で内容を確認するので，確認後に書き換えられる
+        # ことはない
+        status = self.run_command(
+            FB_WRITER_INSTALL_COMMAND.format(
+                upload_path=FB_WRITER_UPLOAD_PATH, path=FB_WRITER_PATH, digest=digest
+            )
+        )
+        if status != 0:
+            raise RuntimeError(
+                "Failed to install framebuffer writer (status: {status})".format(
+                    status=status
+                )
+            )
+
+    def start_fb_writer(self):
+        self.install_fb_writer()
+
+        channel = self.exec_command(
+            FB_WRITER_COMMAND.format(path=FB_WRITER_PATH, device=self.fb_device)
+        )
+        channel.settimeout(FB_WRITER_TIMEOUT)
+        self.fb_channel = channel
+        self.fb_stdout = channel.makefile("r")
+
+        # NOTE: 起動すると，フレームバッファのサイズと形式を返してくる
+        line = self.fb_stdout.readline()
+        if line == "":
+            raise RuntimeError(
+                "Failed to start framebuffer writer: {error}".format(
+                    error=channel.makefile_stderr("r").read().strip()
+                )
+            )
+        width, height, bpp, stride = map(int, line.split())
+        self.fb_geometry = {"size": (width, height), "bpp": bpp, "stride": stride}
+
+        logging.info(
+            "framebuffer: {width} x {height}, {bpp} bpp".format(
+                width=width, height=height, bpp=bpp
+            )
+        )
+
+    def send_framebuffer(self, img, rect_list):
+        if (self.fb_channel is None) or self.fb_channel.exit_status_ready():
+            self.start_fb_writer()
+
+        bpp = self.fb_geometry["bpp"]
+        count = 0
+        for rect in rect_list:
+            box = fb_format.align_box(rect, bpp, self.fb_geometry["size"])
+            if (box[0] >= box[2]) or (box[1] >= box[3]):
+                continue
+
+            with metrics.stage("fb_encode"):
+                header, data = fb_format.encode_rect(img, box, bpp)
+            self.fb_channel.sendall(header)
+            self.fb_channel.sendall(data)
+            count += 1
+
+        for i in range(count):
+            ack = self.fb_stdout.readline().strip()
+            if ack != "OK":
+                raise RuntimeError(
+                    "Unexpected response from framebuffer writer: {ack}".format(ack=ack)
+                )
+
+    def show(self, img, rect_list=None):
+        if rect_list is None:
+            rect_list = [(0, 0, img.size[0], img.size[1])]
+
+        if self.output == "framebuffer":
+            # NOTE: 変化した矩形だけを，フレームバッファの形式にして直接書き込む
+            self.push(self.send_framebuffer, img, rect_list)
+        else:
+            # NOTE: PNG と fbi による表示では部分的な書き換えはできないので，
+            # rect_list に関わらず全体を送る
+            png_data = io.BytesIO()
+            with metrics.stage("png_encode"):
+                dither.save_png(img, png_data, self.png_level)
+
+            self.show_png(png_data.getvalue())
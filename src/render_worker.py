@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import multiprocessing
+import logging
+
+import PIL.Image
+
+import metrics
+
+# NOTE: 1回の画像生成にかかる時間の上限 [秒]
+RENDER_TIMEOUT = 300
+
+
+def worker_main(conn, log_name):
+    # NOTE: 重いモジュールはワーカープロセス側でだけ読み込む
+    import logger
+    import create_image
+
+    logger.init(log_name)
+    logging.info("Start render worker")
+
+    while True:
+        try:
+            config = conn.recv()
+        except EOFError:
+            break
+
+        if config is None:
+            break
+
+        try:
+            img = create_image.create_image(config)
+        except:
+            # NOTE: 生成が終わらないパネルがある場合など，作り直さないと回復
+            # しない場合は終了する．親プロセスが検出して起動し直す．
+            logging.exception("Failed to create image, stop render worker")
+            break
+
+        # NOTE: ワーカー側で集計したものも，画像と一緒に返す
+        conn.send((img.mode, img.size, metrics.get_snapshot()))
+        conn.send_bytes(img.tobytes())
+
+    logging.info("Stop render worker")
+
+
+class RenderWorker:
+    def __init__(self, log_name, timeout=RENDER_TIMEOUT):
+        self.log_name = log_name
+        self.timeout = timeout
+        # NOTE: SSH の接続などを引き継がないように，fork ではなく spawn を使う
+        self.context = multiprocessing.get_context("spawn")
+        self.process = None
+        self.conn = None
+
+    def is_alive(self):
+        return (self.process is not None) and self.process.is_alive()
+
+    def start(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=worker_main, args=(child_conn, self.log_name), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def stop(self):
+        if self.process is None:
+            return
+
+        try:
+            self.conn.send(None)
+        except:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def render(self, config):
+        if not self.is_alive():
+            self.stop()
+            self.start()
+
+        try:
+            self.conn.send(config)
+            if not self.conn.poll(self.timeout):
+                raise TimeoutError(
+                    "Render worker did not respond in {timeout} sec".format(
+                        timeout=self.timeout
+                    )
+                )
+            mode, size, snapshot = self.conn.recv()
+            metrics.set_source("worker", snapshot)
+
+            return PIL.Image.frombytes(mode, size, self.conn.recv_bytes())
+        except:
+            # NOTE: ワーカーが落ちたり固まったりした場合は，次回作り直す
+            logging.error(
+                "Render worker failed (exitcode: {code})".format(
+                    code=self.process.exitcode
+                )
+            )
+            metrics.increment("render_worker_failure_total")
+            self.process.kill()
+            self.stop()
+            raise
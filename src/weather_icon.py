@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import os
+import io
+import pathlib
+import hashlib
+import threading
+import concurrent.futures
+import logging
+
+import cv2
+from cv2 import dnn_superres
+import numpy as np
+import PIL.Image
+
+import metrics
+from constants import DATA_PATH
+
+MODEL_PATH = str(pathlib.Path(os.path.dirname(__file__), "data", "ESPCN_x4.pb"))
+MODEL_NAME = "espcn"
+MODEL_SCALE = 4
+
+ICON_TONE = 32
+ICON_GAMMA = 0.24
+ICON_SCALE = 1.6
+
+ICON_CACHE_PATH = DATA_PATH / "icon"
+ICON_CACHE_MAX_SIZE = 16 * 1024 * 1024
+# NOTE: 週間予報のアイコンは 6 個なので，全て同時にダウンロードする
+ICON_FETCH_WORKERS = 6
+
+_icon_engine = None
+_icon_cache = None
+_icon_engine_lock = threading.Lock()
+_icon_fetch_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=ICON_FETCH_WORKERS
+)
+
+
+def get_param_key(tone=ICON_TONE, gamma=ICON_GAMMA, scale=ICON_SCALE):
+    return "{model}_x{model_scale}|{tone}|{gamma}|{scale}".format(
+        model=os.path.basename(MODEL_PATH),
+        model_scale=MODEL_SCALE,
+        tone=tone,
+        gamma=gamma,
+        scale=scale,
+    )
+
+
+class IconEngine:
+    def __init__(self, tone=ICON_TONE, gamma=ICON_GAMMA, scale=ICON_SCALE):
+        logging.info("Load super resolution model")
+
+        self.sr = dnn_superres.DnnSuperResImpl_create()
+        self.sr.readModel(MODEL_PATH)
+        self.sr.setModel(MODEL_NAME, MODEL_SCALE)
+        # NOTE: モデルは複数スレッドから同時に使えないので排他する
+        self.lock = threading.Lock()
+
+        self.scale = scale
+        self.param_key = get_param_key(tone, gamma, scale)
+
+        # NOTE: 階調の削減とガンマ補正は続けて行うので，一つの変換表にまとめておく
+        index = np.arange(256)
+        tone_table = np.minimum(np.ceil(index / tone) * tone, 255).astype(np.uint8)
+        gamma_table = (255 * (index / 255) ** (1.0 / gamma)).astype(np.uint8)
+        self.lut = gamma_table[tone_table]
+
+    def process(self, img):
+        # NOTE: 透過部分を白で塗りつぶす
+        img = img.copy()
+        img[img[..., -1] == 0] = [255, 255, 255, 0]
+        img = img[:, :, :3]
+
+        h, w = img.shape[:2]
+
+        # NOTE: 一旦4倍の解像度に増やす
+        with self.lock:
+            img = self.sr.upsample(img)
+
+        # NOTE: 階調を削減してガンマ補正
+        img = cv2.LUT(img, self.lut)
+
+        # NOTE: 最終的に欲しい解像度にする
+        img = cv2.resize(
+            img,
+            (int(w * self.scale), int(h * self.scale)),
+            interpolation=cv2.INTER_CUBIC,
+        )
+
+        # NOTE: 白色を透明にする
+        img = cv2.cvtColor(img, cv2.COLOR_RGB2RGBA)
+        img[:, :, 3] = np.where(np.all(img == 255, axis=-1), 0, 255)
+
+        return PIL.Image.fromarray(img).convert("LA")
+
+    def process_list(self, img_list):
+        return [self.process(img) for img in img_list]
+
+
+class IconCache:
+    def __init__(self, path=ICON_CACHE_PATH, max_size=ICON_CACHE_MAX_SIZE):
+        self.path = pathlib.Path(path)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+    def get_url_hash(self, url):
+        return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+    def get_file_path(self, url, param_key):
+        # NOTE: ファイル名は URL と処理パラメータのハッシュにする．URL 部分を
+        # 前に置くことで，パラメータ違いのものも探せるようにする．
+        return self.path / "{url_hash}_{param_hash}.png".format(
+            url_hash=self.get_url_hash(url),
+            param_hash=hashlib.sha256(param_key.encode()).hexdigest()[:16],
+        )
+
+    def read(self, file_path):
+        try:
+            with open(file_path, "rb") as file:
+                img = PIL.Image.open(io.BytesIO(file.read()))
+                img.load()
+            # NOTE: 最近使ったものを残せるように，更新日時を LRU の管理に使う
+            os.utime(file_path)
+            return img
+        except:
+            return None
+
+    def get(self, url, param_key):
+        return self.read(self.get_file_path(url, param_key))
+
+    def get_fallback(self, url):
+        path_list = sorted(
+            self.path.glob(self.get_url_hash(url) + "_*.png"),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True,
+        )
+        for file_path in path_list:
+            img = self.read(file_path)
+            if img is not None:
+                return img
+
+        return None
+
+    def put(self, url, param_key, img):
+        file_path = self.get_file_path(url, param_key)
+        tmp_path = file_path.with_suffix(".tmp")
+        try:
+            self.path.mkdir(parents=True, exist_ok=True)
+            img.save(tmp_path, "PNG")
+            os.replace(tmp_path, file_path)
+        except:
+            logging.warning("Failed to store icon cache: {url}".format(url=url))
+            return
+
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            stat_list = []
+            for file_path in self.path.glob("*.png"):
+                try:
+                    stat_list.append((file_path, file_path.stat()))
+                except FileNotFoundError:
+                    pass
+
+            total_size = sum(stat.st_size for file_path, stat in stat_list)
+            for file_path, stat in sorted(stat_list, key=lambda item: item[1].st_mtime):
+                if total_size <= self.max_size:
+                    break
+                logging.info("Evict icon cache: {path}".format(path=file_path.name))
+                file_path.unlink(missing_ok=True)
+                total_size -= stat.st_size
+
+
+def load_icon_list(info_list, fetch_func):
+    cache = get_icon_cache()
+    param_key = get_param_key()
+
+    icon_list = [cache.get(info["icon"], param_key) for info in info_list]
+
+    def fetch(info):
+        with metrics.stage("icon_download"):
+            return fetch_func(info)
+
+    # NOTE: キャッシュに無いものは並列にダウンロードする
+    future_map = {}
+    for i, info in enumerate(info_list):
+        metrics.count_cache("icon", icon_list[i] is not None)
+        if icon_list[i] is None:
+            future_map[i] = _icon_fetch_executor.submit(fetch, info)
+
+    miss_list = []
+    for i, future in future_map.items():
+        info = info_list[i]
+        try:
+            miss_list.append((i, future.result()))
+        except:
+            # NOTE: ダウンロードできない場合は，パラメータが異なっていても
+            # 以前の結果があればそれを使う
+            logging.warning("Failed to fetch icon: {url}".format(url=info["icon"]))
+            icon_list[i] = cache.get_fallback(info["icon"])
+            if icon_list[i] is None:
+                raise
+
+    logging.info(
+        "icon cache: {hit} hit, {miss} miss".format(
+            hit=len(info_list) - len(miss_list), miss=len(miss_list)
+        )
+    )
+
+    if len(miss_list) == 0:
+        return icon_list
+
+    # NOTE: モデルの読み込みはキャッシュに無いものがあった時だけ行う
+    with metrics.stage("model_load"):
+        engine = get_icon_engine()
+    with metrics.stage("super_resolution"):
+        processed_list = engine.process_list([img for i, img in miss_list])
+    for (i, img), icon in zip(miss_list, processed_list):
+        cache.put(info_list[i]["icon"], engine.param_key, icon)
+        icon_list[i] = icon
+
+    return icon_list
+
+
+def get_icon_engine():
+    global _icon_engine
+
+    with _icon_engine_lock:
+        if _icon_engine is None:
+            _icon_engine = IconEngine()
+
+        return _icon_engine
+
+
+def get_icon_cache():
+    global _icon_cache
+
+    with _icon_engine_lock:
+        if _icon_cache is None:
+            _icon_cache = IconCache()
+
+        return _icon_cache
+
+
+if __name__ == "__main__":
+    import sys
+    import logger
+
+    logger.init("test")
+    logging.info("Test")
+
+    img = cv2.imread(sys.argv[1], cv2.IMREAD_UNCHANGED)
+
+    get_icon_engine().process(img).save("test_weather_icon.png", "PNG")
+
+    print("Finish.")
@@ -2,8 +2,11 @@
 # - coding: utf-8 --
 
 import os
-import pathlib
 import shutil
+import threading
+import contextlib
+import atexit
+import logging
 
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
@@ -12,7 +15,9 @@ from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from webdriver_manager.core.utils import ChromeType
 
-DATA_PATH = pathlib.Path(os.path.dirname(__file__)).parent / "data"
+import metrics
+from constants import DATA_PATH, USER_AGENT
+
 LOG_PATH = DATA_PATH / "log"
 
 CHROME_DATA_PATH = str(DATA_PATH / "chrome")
@@ -20,8 +25,41 @@ DUMP_PATH = str(DATA_PATH / "deubg")
 
 DRIVER_LOG_PATH = str(LOG_PATH / "webdriver.log")
 
+# NOTE: この回数だけ使ったら，メモリリーク対策でブラウザを起動し直す
+DRIVER_MAX_USE = 30
+
+_driver_path = None
+_driver_pool = None
+_driver_pool_lock = threading.Lock()
+
+
+def get_chrome_type():
+    if shutil.which("google-chrome") is not None:
+        return ChromeType.GOOGLE
+    else:
+        return ChromeType.CHROMIUM
+
+
+def get_driver_path():
+    global _driver_path
+
+    # NOTE: ChromeDriverManager はバージョン確認で時間がかかるので，結果を使い回す
+    if _driver_path is None:
+        _driver_path = ChromeDriverManager(chrome_type=get_chrome_type()).install()
+
+    return _driver_path
+
 
-def create_driver():
+def get_chrome_data_path(profile_index=0):
+    # NOTE: 同じプロファイルを複数の Chrome で同時に使うことはできないので，
+    # 2つ目以降はディレクトリを分ける
+    if profile_index == 0:
+        return CHROME_DATA_PATH
+    else:
+        return "{path}_{index}".format(path=CHROME_DATA_PATH, index=profile_index)
+
+
+def create_driver(profile_index=0):
     options = Options()
     options.add_argument("--headless")
     options.add_argument("--no-sandbox")  # for Docker
@@ -30,42 +68,178 @@ def create_driver():
     options.add_argument("--lang=ja-JP")
     options.add_argument("--window-size=1920,1080")
 
-    options.add_argument(
-        '--user-agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/98.0.4758.80 Safari/537.36"'
-    )
-    options.add_argument("--user-data-dir=" + CHROME_DATA_PATH)
+    options.add_argument('--user-agent="{user_agent}"'.format(user_agent=USER_AGENT))
+    options.add_argument("--user-data-dir=" + get_chrome_data_path(profile_index))
 
     # NOTE: 下記がないと，snap で入れた chromium が「LC_ALL: cannot change locale (ja_JP.UTF-8)」
     # と出力し，その結果 ChromeDriverManager がバージョンを正しく取得できなくなる
     os.environ["LC_ALL"] = "C"
 
-    if shutil.which("google-chrome") is not None:
-        chrome_type = ChromeType.GOOGLE
-    else:
-        chrome_type = ChromeType.CHROMIUM
-
-    driver = webdriver.Chrome(
-        service=Service(
-            ChromeDriverManager(chrome_type=chrome_type).install(),
-            log_path=DRIVER_LOG_PATH,
-            service_args=["--verbose"],
-        ),
-        options=options,
-    )
+    with metrics.stage("driver_start"):
+        driver = webdriver.Chrome(
+            service=Service(
+                get_driver_path(),
+                log_path=DRIVER_LOG_PATH,
+                service_args=["--verbose"],
+            ),
+            options=options,
+        )
 
     return driver
 
 
+def get_driver_memory(driver):
+    # NOTE: chromedriver とそこから起動された Chrome のプロセス全体の常駐メモリ量
+    try:
+        return metrics.get_process_tree_memory(driver.service.process.pid)
+    except:
+        return 0
+
+
+def is_driver_alive(driver):
+    try:
+        return driver.execute_script("return 1") == 1
+    except:
+        return False
+
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except:
+        logging.warning("Failed to quit driver")
+
+
+class DriverPool:
+    def __init__(self, max_use=DRIVER_MAX_USE):
+        self.lock = threading.Lock()
+        self.max_use = max_use
+        self.idle_list = []
+        self.profile_index_set = set()
+        self.is_closed = False
+
+    def alloc_profile_index(self):
+        index = 0
+        while index in self.profile_index_set:
+            index += 1
+        self.profile_index_set.add(index)
+
+        return index
+
+    def discard(self, entry):
+        quit_driver(entry["driver"])
+        with self.lock:
+            self.profile_index_set.discard(entry["profile_index"])
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if self.is_closed:
+                    raise RuntimeError("Driver pool is already closed")
+
+                if len(self.idle_list) == 0:
+                    profile_index = self.alloc_profile_index()
+                    break
+                entry = self.idle_list.pop()
+
+            if is_driver_alive(entry["driver"]):
+                return entry
+
+            logging.warning(
+                "Driver is not responding, discard it (profile: {index})".format(
+                    index=entry["profile_index"]
+                )
+            )
+            self.discard(entry)
+
+        logging.info("Start browser (profile: {index})".format(index=profile_index))
+        metrics.increment("browser_start_total")
+        try:
+            driver = create_driver(profile_index)
+        except:
+            with self.lock:
+                self.profile_index_set.discard(profile_index)
+            raise
+
+        return {"driver": driver, "profile_index": profile_index, "use": 0}
+
+    def release(self, entry, is_broken=False):
+        entry["use"] += 1
+        metrics.set_gauge(
+            "browser_memory_bytes",
+            get_driver_memory(entry["driver"]),
+            profile=entry["profile_index"],
+        )
+
+        with self.lock:
+            if not is_broken and not self.is_closed and entry["use"] < self.max_use:
+                self.idle_list.append(entry)
+                return
+
+        logging.info(
+            "Quit browser (profile: {index}, use: {use})".format(
+                index=entry["profile_index"], use=entry["use"]
+            )
+        )
+        self.discard(entry)
+
+    def close(self):
+        with self.lock:
+            self.is_closed = True
+            idle_list = self.idle_list
+            self.idle_list = []
+
+        for entry in idle_list:
+            self.discard(entry)
+
+
+def get_driver_pool():
+    global _driver_pool
+
+    with _driver_pool_lock:
+        if _driver_pool is None:
+            _driver_pool = DriverPool()
+            atexit.register(close_driver_pool)
+
+        return _driver_pool
+
+
+def close_driver_pool():
+    global _driver_pool
+
+    with _driver_pool_lock:
+        pool = _driver_pool
+        _driver_pool = None
+
+    if pool is not None:
+        pool.close()
+
+
+@contextlib.contextmanager
+def driver_session():
+    pool = get_driver_pool()
+    entry = pool.acquire()
+    try:
+        yield entry["driver"]
+    except:
+        # NOTE: ページの状態が不明なので，エラーが起きたブラウザは使い回さない
+        pool.release(entry, is_broken=True)
+        raise
+    else:
+        pool.release(entry)
+
+
 if __name__ == "__main__":
     import logger
     from config import load_config
 
-    import logging
-
     logger.init("test")
     logging.info("Test")
 
-    driver = create_driver()
-    driver.quit()
+    with driver_session() as driver:
+        driver.get("about:blank")
+    with driver_session() as driver:
+        driver.get("about:blank")
+    close_driver_pool()
 
     print("Finish.")
@@ -7,24 +7,29 @@ from selenium.webdriver.support import expected_conditions as EC
 import PIL.Image
 import PIL.ImageDraw
 
-from urllib import request
 from urllib.parse import urlparse
-import math
+import json
 import pathlib
 import os
 import io
 import cv2
-from cv2 import dnn_superres
 import numpy as np
 import time
 import locale
 import logging
 
-from webdriver import create_driver
-from pil_util import get_font, draw_text
+from webdriver import driver_session
+from constants import DATA_PATH
+from html_util import parse_subtree
+from pil_util import get_font, draw_text, prerender_text
+from weather_icon import load_icon_list
+import http_client
+import metrics
 import datetime
 
 WEEKLY_FORECAST_XPATH = '//table[@class="yjw_table"]'
+ICON_DUMP_PATH = pathlib.Path(os.path.dirname(__file__), "img")
+WEEKLY_FORECAST_CACHE_PATH = DATA_PATH / "weekly_forecast.json"
 
 
 def get_face_map(font_config):
@@ -36,73 +41,49 @@ def get_face_map(font_config):
     }
 
 
-def get_image(info):
-    tone = 32
-    gamma = 0.24
-
-    file_bytes = np.asarray(
-        bytearray(request.urlopen(info["icon"]).read()), dtype=np.uint8
+def prerender_face(face):
+    # NOTE: 毎回描画する日付と曜日は，あらかじめ描画してキャッシュしておく
+    prerender_text(
+        face["date"], ["{day:02d}".format(day=day) for day in range(1, 32)], "center"
     )
-    img = cv2.imdecode(file_bytes, cv2.IMREAD_UNCHANGED)
-
-    # NOTE: 透過部分を白で塗りつぶす
-    img[img[..., -1] == 0] = [255, 255, 255, 0]
-    img = img[:, :, :3]
-
-    dump_path = str(
-        pathlib.Path(
-            os.path.dirname(__file__),
-            "img",
-            info["text"] + "_" + os.path.basename(urlparse(info["icon"]).path),
-        )
+    prerender_text(
+        face["wday"],
+        [
+            (datetime.date(2001, 1, 1) + datetime.timedelta(days=i)).strftime("(%a)")
+            for i in range(7)
+        ],
+        "center",
     )
 
-    PIL.Image.fromarray(img).save(dump_path)
-
-    h, w = img.shape[:2]
-
-    # NOTE: 一旦4倍の解像度に増やす
-    sr = dnn_superres.DnnSuperResImpl_create()
-
-    model_path = str(pathlib.Path(os.path.dirname(__file__), "data", "ESPCN_x4.pb"))
-
-    sr.readModel(model_path)
-    sr.setModel("espcn", 4)
-    img = sr.upsample(img)
-
-    # NOTE: 階調を削減
-    tone_table = np.zeros((256, 1), dtype=np.uint8)
-    for i in range(256):
-        tone_table[i][0] = min(math.ceil(i / tone) * tone, 255)
-    img = cv2.LUT(img, tone_table)
 
-    # NOTE: ガンマ補正
-    gamma_table = np.zeros((256, 1), dtype=np.uint8)
-    for i in range(256):
-        gamma_table[i][0] = 255 * (float(i) / 255) ** (1.0 / gamma)
-    img = cv2.LUT(img, gamma_table)
-
-    # NOTE: 最終的に欲しい解像度にする
-    img = cv2.resize(img, (int(w * 1.6), int(h * 1.6)), interpolation=cv2.INTER_CUBIC)
+def fetch_image(info):
+    file_bytes = np.frombuffer(http_client.fetch(info["icon"]), dtype=np.uint8)
+    img = cv2.imdecode(file_bytes, cv2.IMREAD_UNCHANGED)
 
-    # NOTE: 白色を透明にする
-    img = cv2.cvtColor(img, cv2.COLOR_RGB2RGBA)
-    img[:, :, 3] = np.where(np.all(img == 255, axis=-1), 0, 255)
+    # NOTE: デバッグ用に，ディレクトリがある場合だけ元画像を保存する
+    if ICON_DUMP_PATH.is_dir():
+        dump_img = img.copy()
+        dump_img[dump_img[..., -1] == 0] = [255, 255, 255, 0]
+        PIL.Image.fromarray(dump_img[:, :, :3]).save(
+            str(
+                ICON_DUMP_PATH
+                / (info["text"] + "_" + os.path.basename(urlparse(info["icon"]).path))
+            )
+        )
 
-    return PIL.Image.fromarray(img).convert("LA")
+    return img
 
 
-def get_weekly_forecast_list(panel_config):
-    driver = create_driver()
-    wait = WebDriverWait(driver, 5)
+def get_image(info):
+    return get_image_list([info])[0]
 
-    now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9), "JST"))
 
-    driver.get(panel_config["URL"])
+def get_image_list(info_list):
+    return load_icon_list(info_list, fetch_image)
 
-    wait.until(EC.presence_of_element_located((By.XPATH, WEEKLY_FORECAST_XPATH)))
 
-    TABLE_DEF = [
+def get_table_def(now):
+    return [
         {
             "name": "date",
             "xpath": "",
@@ -126,119 +107,245 @@ def get_weekly_forecast_list(panel_config):
         {"name": "prec", "xpath": "", "trans": lambda elem: int(elem.text)},
     ]
 
+
+def load_html_cache():
+    try:
+        with open(WEEKLY_FORECAST_CACHE_PATH, "r") as file:
+            return json.load(file)
+    except:
+        return None
+
+
+def store_html_cache(html_cache):
+    try:
+        WEEKLY_FORECAST_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = WEEKLY_FORECAST_CACHE_PATH.with_suffix(".tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(html_cache, file, ensure_ascii=False)
+        os.replace(tmp_path, WEEKLY_FORECAST_CACHE_PATH)
+    except:
+        logging.warning("Failed to store weekly forecast cache")
+
+
+def fetch_html(url):
+    header_map = {}
+
+    # NOTE: 前回取得したものがあれば，更新されている場合だけ取得する
+    html_cache = load_html_cache()
+    if (html_cache is not None) and (html_cache["url"] == url):
+        if html_cache["etag"] is not None:
+            header_map["If-None-Match"] = html_cache["etag"]
+        if html_cache["last_modified"] is not None:
+            header_map["If-Modified-Since"] = html_cache["last_modified"]
+    else:
+        html_cache = None
+
+    res = http_client.get_http_client().request(url, header_map)
+    if (res["status"] == 304) and (html_cache is not None):
+        logging.info("weekly forecast is not modified")
+        metrics.count_cache("weekly_forecast", True)
+        return html_cache["html"]
+    elif res["status"] != 200:
+        raise http_client.HTTPError(res["url"], res["status"], res["headers"])
+
+    html = res["data"].decode(res["headers"].get_content_charset() or "utf-8")
+    etag = res["headers"].get("ETag")
+    last_modified = res["headers"].get("Last-Modified")
+
+    metrics.count_cache("weekly_forecast", False)
+
+    if (etag is not None) or (last_modified is not None):
+        store_html_cache(
+            {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "html": html,
+            }
+        )
+
+    return html
+
+
+def parse_weekly_forecast_list(html, url, now):
+    TABLE_DEF = get_table_def(now)
+
+    # NOTE: Selenium 版の XPath と同じ要素を辿る
+    table = parse_subtree(html, "yjw_week", url).find_child("table")
+    row_list = table.find_all("tr")
+
     forecast_list = []
     for col in range(2, 8):
         forecast = {}
         for row in range(1, 5):
-            forecast[TABLE_DEF[row - 1]["name"]] = TABLE_DEF[row - 1]["trans"](
-                driver.find_element(
-                    By.XPATH,
-                    (
-                        '//div[@id="yjw_week"]/table//tr[{row}]/td[{col}]'
-                        + TABLE_DEF[row - 1]["xpath"]
-                    ).format(row=row, col=col),
-                )
-            )
+            elem = row_list[row - 1].find_children("td")[col - 1]
+            if TABLE_DEF[row - 1]["xpath"] != "":
+                elem = elem.find_child(TABLE_DEF[row - 1]["xpath"].lstrip("/"))
+            forecast[TABLE_DEF[row - 1]["name"]] = TABLE_DEF[row - 1]["trans"](elem)
         forecast_list.append(forecast)
+
+    return forecast_list
+
+
+def get_weekly_forecast_list_by_http(panel_config, now):
+    with metrics.stage("html_fetch"):
+        html = fetch_html(panel_config["URL"])
+
+    return parse_weekly_forecast_list(html, panel_config["URL"], now)
+
+
+def get_weekly_forecast_list_by_browser(panel_config, now):
+    TABLE_DEF = get_table_def(now)
+
+    forecast_list = []
+    with driver_session() as driver:
+        wait = WebDriverWait(driver, 5)
+
+        with metrics.stage("page_load"):
+            driver.get(panel_config["URL"])
+
+            wait.until(
+                EC.presence_of_element_located((By.XPATH, WEEKLY_FORECAST_XPATH))
+            )
+
+        for col in range(2, 8):
+            forecast = {}
+            for row in range(1, 5):
+                forecast[TABLE_DEF[row - 1]["name"]] = TABLE_DEF[row - 1]["trans"](
+                    driver.find_element(
+                        By.XPATH,
+                        (
+                            '//div[@id="yjw_week"]/table//tr[{row}]/td[{col}]'
+                            + TABLE_DEF[row - 1]["xpath"]
+                        ).format(row=row, col=col),
+                    )
+                )
+            forecast_list.append(forecast)
+
     return forecast_list
 
 
+def get_weekly_forecast_list(panel_config):
+    now = datetime.datetime.now(datetime.timezone(datetime.timedelta(hours=9), "JST"))
+
+    if panel_config.get("BACKEND", "http") == "http":
+        try:
+            return get_weekly_forecast_list_by_http(panel_config, now)
+        except:
+            # NOTE: ページの構造が変わった場合などは，ブラウザで取得する
+            logging.warning(
+                "Failed to get weekly forecast by HTTP, fallback to browser",
+                exc_info=True,
+            )
+
+    return get_weekly_forecast_list_by_browser(panel_config, now)
+
+
 def create(panel_config, font_config):
     logging.info("create weekly forecast panel")
 
     forecast_list = get_weekly_forecast_list(panel_config)
 
-    img = PIL.Image.new(
-        "RGB",
-        (panel_config["WIDTH"], panel_config["HEIGHT"]),
-        (255, 255, 255),
-    )
+    img = PIL.Image.new("L", (panel_config["WIDTH"], panel_config["HEIGHT"]), 255)
     step_x = panel_config["WIDTH"] / len(forecast_list)
 
     face = get_face_map(font_config)
     locale.setlocale(locale.LC_TIME, "ja_JP.UTF-8")
+    prerender_face(face)
 
-    for i, forecast in enumerate(forecast_list):
-        icon_img = get_image(
+    icon_list = get_image_list(
+        [
             {"text": forecast["weather"][0], "icon": forecast["weather"][1]}
-        )
+            for forecast in forecast_list
+        ]
+    )
 
-        draw_text(
-            img,
-            forecast["date"].strftime("%d"),
-            [int(step_x * (i + 0.5)), 10],
-            face["date"],
-            "center",
-            color="#000",
-        )
-        draw_text(
-            img,
-            forecast["date"].strftime("(%a)"),
-            [int(step_x * (i + 0.5)), 80],
-            face["wday"],
-            "center",
-            color="#333",
-        )
-        img.paste(icon_img, (int((step_x * (i + 0.5)) - (icon_img.size[0] / 2)), 130))
-        draw_text(
-            img,
-            forecast["weather"][0],
-            [int(step_x * (i + 0.5)), 260],
-            face["weather"],
-            "center",
-            color="#000",
-        )
-        draw_text(
-            img,
-            str(forecast["temp"][0]),
-            [int(step_x * (i + 0.5)), 335],
-            face["temp"],
-            "center",
-            color="#000",
-        )
-        draw_text(
-            img,
-            str(forecast["temp"][1]),
-            [int(step_x * (i + 0.5)), 420],
-            face["temp"],
-            "center",
-            color="#000",
-        )
+    with metrics.stage("text_draw"):
+        for i, forecast in enumerate(forecast_list):
+            icon_img = icon_list[i]
+
+            draw_text(
+                img,
+                forecast["date"].strftime("%d"),
+                [int(step_x * (i + 0.5)), 10],
+                face["date"],
+                "center",
+                color="#000",
+            )
+            draw_text(
+                img,
+                forecast["date"].strftime("(%a)"),
+                [int(step_x * (i + 0.5)), 80],
+                face["wday"],
+                "center",
+                color="#333",
+            )
+            # NOTE: 透明部分は白になっているので，輝度だけを貼り付ける
+            img.paste(
+                icon_img.getchannel("L"),
+                (int((step_x * (i + 0.5)) - (icon_img.size[0] / 2)), 130),
+            )
+            draw_text(
+                img,
+                forecast["weather"][0],
+                [int(step_x * (i + 0.5)), 260],
+                face["weather"],
+                "center",
+                color="#000",
+            )
+            draw_text(
+                img,
+                str(forecast["temp"][0]),
+                [int(step_x * (i + 0.5)), 335],
+                face["temp"],
+                "center",
+                color="#000",
+            )
+            draw_text(
+                img,
+                str(forecast["temp"][1]),
+                [int(step_x * (i + 0.5)), 420],
+                face["temp"],
+                "center",
+                color="#000",
+            )
 
     return img
 
 
 def create2(panel_config, font_config):
-    driver = create_driver()
-    wait = WebDriverWait(driver, 5)
+    img = PIL.Image.new(
+        "RGBA",
+        (panel_config["WIDTH"], panel_config["HEIGHT"]),
+        (255, 255, 255, 255),
+    )
 
-    driver.get(panel_config["URL"])
+    with driver_session() as driver:
+        wait = WebDriverWait(driver, 5)
 
-    wait.until(EC.presence_of_element_located((By.XPATH, WEEKLY_FORECAST_XPATH)))
-    driver.execute_script(
-        "return arguments[0].scrollIntoView(true)",
-        driver.find_element(By.XPATH, WEEKLY_FORECAST_XPATH),
-    )
-    driver.execute_script(
-        """
+        driver.get(panel_config["URL"])
+
+        wait.until(EC.presence_of_element_located((By.XPATH, WEEKLY_FORECAST_XPATH)))
+        driver.execute_script(
+            "return arguments[0].scrollIntoView(true)",
+            driver.find_element(By.XPATH, WEEKLY_FORECAST_XPATH),
+        )
+        driver.execute_script(
+            """
 document.body.style.fontFamily = "A-OTF UD新ゴ Pr6N";
 document.body.style.fontWeight = 500;
 """
-    )
-    wait.until(
-        lambda driver: driver.execute_script("return document.readyState") == "complete"
-    )
+        )
+        wait.until(
+            lambda driver: driver.execute_script("return document.readyState")
+            == "complete"
+        )
 
-    img = PIL.Image.new(
-        "RGBA",
-        (panel_config["WIDTH"], panel_config["HEIGHT"]),
-        (255, 255, 255, 255),
-    )
-    table_img = PIL.Image.open(
-        io.BytesIO(
-            driver.find_element(By.XPATH, WEEKLY_FORECAST_XPATH).screenshot_as_png
+        table_img = PIL.Image.open(
+            io.BytesIO(
+                driver.find_element(By.XPATH, WEEKLY_FORECAST_XPATH).screenshot_as_png
+            )
         )
-    )
 
     img.paste(
         table_img,
@@ -252,6 +359,7 @@ document.body.style.fontWeight = 500;
 
 
 if __name__ == "__main__":
+    import sys
     import logger
     from config import load_config
 
@@ -260,8 +368,18 @@ if __name__ == "__main__":
 
     config = load_config()
 
-    img = create(config["WEEKLY_FORECAST"], config["FONT"])
-
-    img.save("test_weekly_forecast_panel.png", "PNG")
+    if len(sys.argv) > 1:
+        # NOTE: 保存しておいた HTML を解析する
+        with open(sys.argv[1], "r") as file:
+            for forecast in parse_weekly_forecast_list(
+                file.read(),
+                config["WEEKLY_FORECAST"]["URL"],
+                datetime.datetime.now(),
+            ):
+                logging.info(forecast)
+    else:
+        img = create(config["WEEKLY_FORECAST"], config["FONT"])
+
+        img.save("test_weekly_forecast_panel.png", "PNG")
 
     print("Finish.")
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import sys
+import pathlib
+import threading
+import collections
+import http.server
+import socketserver
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+
+DATA_PATH = pathlib.Path(__file__).parent / "data"
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.stand_in.connection_count += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, header_map=None, body=b""):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (header_map or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        stand_in = self.server.stand_in
+        stand_in.hit_map[self.path] += 1
+        stand_in.request_list.append((self.path, dict(self.headers)))
+
+        route = stand_in.get_route(self.path)
+        if route is None:
+            self.send(404, body=b"not found")
+            return
+
+        # NOTE: route は (状態コード, ヘッダ, 本文) を返すか，自分で応答して None を返す
+        res = route(self)
+        if res is not None:
+            self.send(*res)
+
+
+class StandInServer:
+    # NOTE: 外部のサーバーの代わりに，ローカルで応答を返す HTTP サーバー
+    def __init__(self):
+        self.route_map = {}
+        self.hit_map = collections.Counter()
+        self.request_list = []
+        self.connection_count = 0
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # NOTE: タイムアウトの試験などでクライアントが先に切断した場合
+                pass
+
+        self.server = Server(("127.0.0.1", 0), StandInHandler)
+        self.server.stand_in = self
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, args=(0.05,), daemon=True
+        )
+        self.thread.start()
+
+    def url(self, path):
+        return "http://127.0.0.1:{port}{path}".format(
+            port=self.server.server_address[1], path=path
+        )
+
+    def get_route(self, path):
+        # NOTE: 末尾が * のものは，前方一致で探す
+        if path in self.route_map:
+            return self.route_map[path]
+        for key, route in self.route_map.items():
+            if key.endswith("*") and path.startswith(key[:-1]):
+                return route
+
+        return None
+
+    def add(self, path, status=200, header_map=None, body=b""):
+        self.route_map[path] = lambda handler: (status, header_map, body)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stand_in_server():
+    server = StandInServer()
+    yield server
+    server.stop()
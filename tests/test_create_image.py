@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import time
+import threading
+
+import PIL.Image
+import pytest
+
+import create_image
+import frame_diff
+
+
+def get_config(panel_config):
+    return {
+        "PANEL": {
+            "UPDATE": {"INTERVAL": 60},
+            "DEVICE": {"WIDTH": 20, "HEIGHT": 10},
+        },
+        "FONT": {},
+        "TEST": panel_config,
+    }
+
+
+@pytest.fixture
+def panel(monkeypatch):
+    # NOTE: 生成を止めたり，遅らせたりできるパネル
+    panel = {
+        "name": "TEST",
+        "offset": (0, 0),
+        "release": threading.Event(),
+        "count": 0,
+    }
+
+    def create(panel_config, font_config):
+        panel["count"] += 1
+        panel["release"].wait(10)
+        return PIL.Image.new("L", (20, 10), panel["count"])
+
+    panel["create"] = create
+
+    monkeypatch.setattr(create_image, "_panel_cache", {})
+    monkeypatch.setattr(create_image, "get_panel_list", lambda config: [panel])
+    yield panel
+    panel["release"].set()
+
+
+def wait_idle(name):
+    for i in range(100):
+        if create_image._panel_cache[name]["future"] is None:
+            return
+        time.sleep(0.01)
+
+
+def test_draw_panel(panel):
+    config = get_config({})
+    panel["release"].set()
+
+    img = PIL.Image.new("L", (20, 10), 255)
+    create_image.draw_panel(config, img)
+    assert img.getpixel((0, 0)) == 1
+
+    # NOTE: 更新間隔が経つまでは，前回の画像を使う
+    create_image.draw_panel(config, img)
+    assert panel["count"] == 1
+
+
+def test_late_result_is_stored(panel):
+    config = get_config({"TIMEOUT": 0.05})
+    img = PIL.Image.new("L", (20, 10), 255)
+
+    with pytest.raises(TimeoutError):
+        create_image.draw_panel(config, img)
+
+    # NOTE: タイムアウトした後に終わったものも使う
+    panel["release"].set()
+    wait_idle("TEST")
+    cache = create_image._panel_cache["TEST"]
+    assert cache["img"].getpixel((0, 0)) == 1
+
+    create_image.draw_panel(config, img)
+    assert img.getpixel((0, 0)) == 1
+    assert panel["count"] == 1
+
+
+def test_stuck_panel(panel):
+    config = get_config({"TIMEOUT": 0.05, "TTL": 0.2})
+    img = PIL.Image.new("L", (20, 10), 255)
+
+    with pytest.raises(TimeoutError):
+        create_image.draw_panel(config, img)
+
+    # NOTE: TTL までは終わるのを待ち，新たには生成しない
+    with pytest.raises(RuntimeError):
+        create_image.draw_panel(config, img)
+    assert panel["count"] == 1
+
+    # NOTE: TTL を過ぎても終わらない場合は，エラー画面にせずに呼び出し元に伝える
+    time.sleep(0.25)
+    with pytest.raises(create_image.PanelStuckError):
+        create_image.create_image(config)
+    assert panel["count"] == 1
+
+
+def test_quantize_by_region(monkeypatch):
+    # NOTE: 誤差拡散しても，変化した領域以外は変わらない
+    config = {
+        "PANEL": {
+            "UPDATE": {"INTERVAL": 0},
+            "DEVICE": {"WIDTH": 64, "HEIGHT": 48},
+            "QUANTIZE": {"LEVEL": 4, "DITHER": "diffusion"},
+        },
+        "FONT": {},
+        "RAIN_CLOUD": {"WIDTH": 64, "HEIGHT": 24, "HOUR_LIST": [0, 1]},
+        "WEEKLY_FORECAST": {"HEIGHT": 24},
+        "TEST": {},
+    }
+    panel_img = PIL.Image.linear_gradient("L").resize((64, 48))
+
+    def create(panel_config, font_config):
+        return panel_img
+
+    monkeypatch.setattr(create_image, "_panel_cache", {})
+    monkeypatch.setattr(
+        create_image,
+        "get_panel_list",
+        lambda config: [{"name": "TEST", "create": create, "offset": (0, 0)}],
+    )
+    diff = frame_diff.FrameDiff(frame_diff.get_region_list(config))
+
+    diff.update(create_image.create_image(config))
+    panel_img = panel_img.copy()
+    panel_img.paste(0, (10, 10, 20, 20))
+
+    assert diff.update(create_image.create_image(config)) == [(0, 0, 32, 24)]
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import time
+import threading
+
+import PIL.Image
+import pytest
+
+import display_group
+import frame_diff
+
+REGION_LIST = [{"name": "ALL", "box": (0, 0, 20, 10)}]
+
+
+class FakeDisplay:
+    def __init__(self, hostname, delay=0, error=None):
+        self.hostname = hostname
+        self.delay = delay
+        self.error = error
+        self.release = threading.Event()
+        self.shown_list = []
+        self.is_closed = False
+
+    def is_connected(self):
+        return True
+
+    def show(self, img, rect_list):
+        # NOTE: delay が None の場合は，release されるまで止まる
+        if self.delay is None:
+            self.release.wait(10)
+        else:
+            time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        self.shown_list.append((img.getpixel((0, 0)), rect_list))
+
+    def close(self):
+        self.is_closed = True
+
+
+def create_img(value):
+    return PIL.Image.new("L", (20, 10), value)
+
+
+def create_group(display_list):
+    return display_group.DisplayGroup(
+        [
+            display_group.DisplayTarget(display, frame_diff.FrameDiff(REGION_LIST))
+            for display in display_list
+        ]
+    )
+
+
+@pytest.fixture
+def group_list():
+    group_list = []
+    yield group_list
+    for group, display_list in group_list:
+        for display in display_list:
+            display.release.set()
+        group.close(1)
+
+
+def test_show(group_list):
+    display_list = [FakeDisplay("a"), FakeDisplay("b")]
+    group = create_group(display_list)
+    group_list.append((group, display_list))
+
+    seq = group.show(create_img(0))
+    assert group.wait(seq, 5) == {"a": True, "b": True}
+
+    # NOTE: 変化が無ければ送らない
+    seq = group.show(create_img(0))
+    assert group.wait(seq, 5) == {"a": True, "b": True}
+    for display in display_list:
+        assert display.shown_list == [(0, [(0, 0, 20, 10)])]
+
+
+def test_slow_display(group_list):
+    fast = FakeDisplay("fast")
+    slow = FakeDisplay("slow", delay=None)
+    group = create_group([slow, fast])
+    group_list.append((group, [slow, fast]))
+
+    # NOTE: 遅い表示先があっても，他の表示先と期限は影響を受けない
+    start = time.time()
+    seq = group.show(create_img(0))
+    assert group.wait(seq, 0.3) == {"slow": None, "fast": True}
+    elapsed = time.time() - start
+    assert 0.3 <= elapsed < 1
+    assert fast.shown_list == [(0, [(0, 0, 20, 10)])]
+    assert slow.shown_list == []
+
+    # NOTE: 送れていない画像は溜めずに，最新のものに置き換える
+    fast_target = group.target_list[1]
+    for value in [1, 2]:
+        seq = group.show(create_img(value))
+        assert fast_target.wait(seq, time.time() + 5) is True
+    assert [shown[0] for shown in fast.shown_list] == [0, 1, 2]
+
+    slow.release.set()
+    assert group.wait(seq, 5) == {"slow": True, "fast": True}
+    assert [shown[0] for shown in slow.shown_list] == [0, 2]
+
+
+def test_failed_display(group_list):
+    display = FakeDisplay("broken", error=OSError("No route to host"))
+    group = create_group([display])
+    group_list.append((group, [display]))
+
+    seq = group.show(create_img(0))
+    assert group.wait(seq, 5) == {"broken": False}
+
+    # NOTE: 失敗した場合は，次は全体を送り直す
+    display.error = None
+    seq = group.show(create_img(0))
+    assert group.wait(seq, 5) == {"broken": True}
+    assert display.shown_list == [(0, [(0, 0, 20, 10)])]
+
+
+def test_close(group_list):
+    display = FakeDisplay("a")
+    group = create_group([display])
+
+    group.close(1)
+
+    assert display.is_closed
+    assert not group.target_list[0].thread.is_alive()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import yaml
+import pytest
+
+import display_image
+
+CONFIG_YAML = """
+PANEL:
+  DEVICE: {WIDTH: 3200, HEIGHT: 1800}
+  UPDATE: {INTERVAL: 60}
+RAIN_CLOUD: {WIDTH: 3200, HEIGHT: 1350}
+WEEKLY_FORECAST: {WIDTH: 3200, HEIGHT: 450}
+"""
+
+
+@pytest.fixture
+def display_list(monkeypatch):
+    display_list = []
+
+    def create_display(hostname, key_file_path, **kwargs):
+        display_list.append(dict(kwargs, hostname=hostname))
+        return display_list[-1]
+
+    monkeypatch.setattr(display_image, "RemoteDisplay", create_display)
+    monkeypatch.setattr(
+        display_image, "DisplayTarget", lambda display, frame_diff: display
+    )
+
+    return display_list
+
+
+@pytest.mark.parametrize(
+    "quantize_yaml, png_level",
+    [
+        ("", None),
+        ("  QUANTIZE:\n", None),
+        ("  QUANTIZE: {DITHER: bayer}\n", 16),
+        ("  QUANTIZE: {LEVEL: 4}\n", 4),
+    ],
+)
+def test_png_level(display_list, quantize_yaml, png_level):
+    # NOTE: 値の無い QUANTIZE (null) は，指定が無いものとして扱う
+    config = yaml.safe_load(CONFIG_YAML.replace("PANEL:\n", "PANEL:\n" + quantize_yaml))
+
+    display_image.create_display_target("display.local", "key", config)
+
+    assert display_list[0]["png_level"] == png_level
+
+
+@pytest.mark.parametrize(
+    "hostname, expected",
+    [
+        ("display.local", ("display.local", 22)),
+        ("display.local:2222", ("display.local", 2222)),
+        ("192.168.0.10:2222", ("192.168.0.10", 2222)),
+        ("fe80::1", ("fe80::1", 22)),
+        ("2001:db8::10", ("2001:db8::10", 22)),
+        ("[fe80::1]", ("fe80::1", 22)),
+        ("[2001:db8::10]:2222", ("2001:db8::10", 2222)),
+    ],
+)
+def test_parse_hostname(monkeypatch, hostname, expected):
+    monkeypatch.delenv("RASP_PORT", raising=False)
+
+    assert display_image.parse_hostname(hostname) == expected
+
+
+def test_parse_hostname_default_port(monkeypatch):
+    monkeypatch.setenv("RASP_PORT", "10022")
+
+    assert display_image.parse_hostname("fe80::1") == ("fe80::1", 10022)
+    assert display_image.parse_hostname("display.local:2222") == (
+        "display.local",
+        2222,
+    )
+
+
+def test_parse_hostname_invalid():
+    with pytest.raises(ValueError):
+        display_image.parse_hostname("[fe80::1]2222")
+    with pytest.raises(ValueError):
+        display_image.parse_hostname("display.local:ssh")
+
+
+def test_get_hostname_list(monkeypatch):
+    monkeypatch.setenv("RASP_HOSTNAME", " a.local, ,[fe80::1]:22,b.local ")
+    assert display_image.get_hostname_list() == ["a.local", "[fe80::1]:22", "b.local"]
+
+    monkeypatch.delenv("RASP_HOSTNAME")
+    monkeypatch.setattr(display_image.sys, "argv", ["display_image.py", "c.local"])
+    assert display_image.get_hostname_list() == ["c.local"]
+
+
+def test_no_display(monkeypatch):
+    # NOTE: 表示先が無い場合は，画像を生成し始める前に終了する
+    monkeypatch.delenv("RASP_HOSTNAME", raising=False)
+    monkeypatch.setattr(display_image.sys, "argv", ["display_image.py"])
+    monkeypatch.setattr(display_image.logger, "init", lambda name: None)
+    monkeypatch.setattr(
+        display_image,
+        "load_config",
+        lambda: pytest.fail("config should not be loaded"),
+    )
+
+    with pytest.raises(SystemExit):
+        display_image.main()
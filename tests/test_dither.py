@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import io
+
+import numpy as np
+import PIL.Image
+import pytest
+
+import dither
+
+
+def create_img(width=64, height=48):
+    # NOTE: 階調の変化と細かい模様の両方を含む画像
+    gradient = np.tile(np.linspace(0, 255, width, dtype=np.float32), (height, 1))
+    noise = np.random.default_rng(0).normal(0, 20, (height, width))
+
+    return PIL.Image.fromarray(np.clip(gradient + noise, 0, 255).astype(np.uint8), "L")
+
+
+def get_value_set(img):
+    return set(np.unique(np.asarray(img)).tolist())
+
+
+def test_get_gray_list():
+    assert dither.get_gray_list(2) == [0, 255]
+    assert dither.get_gray_list(4) == [0, 85, 170, 255]
+    assert dither.get_gray_list(16)[:3] == [0, 17, 34]
+
+
+@pytest.mark.parametrize("method", dither.DITHER_METHOD_LIST)
+@pytest.mark.parametrize("level", [2, 4, 16])
+def test_quantize(method, level):
+    img = create_img()
+    quantized = dither.quantize(img, level, method)
+
+    assert quantized.mode == "L"
+    assert quantized.size == img.size
+    assert get_value_set(quantized) <= set(dither.get_gray_list(level))
+    # NOTE: 平均的な明るさは保たれる
+    assert abs(np.asarray(quantized).mean() - np.asarray(img).mean()) < 255 / level
+
+
+def test_quantize_rgb():
+    quantized = dither.quantize(create_img().convert("RGB"), 4, "bayer")
+
+    assert quantized.mode == "L"
+    assert get_value_set(quantized) <= set(dither.get_gray_list(4))
+
+
+def test_quantize_none():
+    img = PIL.Image.fromarray(np.arange(256, dtype=np.uint8).reshape(16, 16), "L")
+    quantized = np.asarray(dither.quantize(img, 4, "none")).reshape(-1)
+
+    # NOTE: 一番近い階調になる
+    gray_list = np.array(dither.get_gray_list(4))
+    expected = gray_list[np.argmin(np.abs(np.arange(256)[:, None] - gray_list), axis=1)]
+    assert np.abs(quantized.astype(int) - expected).max() == 0
+
+
+def test_quantize_unknown():
+    with pytest.raises(ValueError):
+        dither.quantize(create_img(), 4, "unknown")
+
+
+def test_quantize_diffusion_box():
+    box_list = [(0, 0, 32, 24), (32, 0, 64, 24), (0, 24, 64, 48)]
+    img = create_img()
+    changed_img = img.copy()
+    changed_img.paste(0, (10, 10, 20, 20))
+
+    before = np.asarray(dither.quantize(img, 4, "diffusion", box_list))
+    after = np.asarray(dither.quantize(changed_img, 4, "diffusion", box_list))
+
+    # NOTE: 誤差は矩形の外に広がらない
+    assert not np.array_equal(before[:24, :32], after[:24, :32])
+    assert np.array_equal(before[:24, 32:], after[:24, 32:])
+    assert np.array_equal(before[24:], after[24:])
+
+    # NOTE: 矩形毎に処理しても，全体を処理したものと同じ階調だけを含む
+    assert get_value_set(after) <= set(dither.get_gray_list(4))
+
+
+def test_quantize_diffusion_box_uncovered():
+    img = create_img()
+    quantized = dither.quantize(img, 4, "diffusion", [(0, 0, 32, 48)])
+
+    # NOTE: 矩形に含まれない部分はディザ無しになる
+    assert np.array_equal(
+        np.asarray(quantized)[:, 32:],
+        np.asarray(dither.quantize(img, 4, "none"))[:, 32:],
+    )
+
+
+@pytest.mark.parametrize("level", [2, 4, 16])
+def test_to_palette(level):
+    quantized = dither.quantize(create_img(), level, "bayer")
+    palette_img = dither.to_palette(quantized, level)
+
+    assert palette_img.mode == "P"
+    assert np.asarray(palette_img).max() < level
+    assert np.array_equal(np.asarray(palette_img.convert("L")), np.asarray(quantized))
+
+
+@pytest.mark.parametrize("level,bits", [(2, 1), (4, 2), (16, 4), (64, 8)])
+def test_save_png(level, bits):
+    quantized = dither.quantize(create_img(), level, "bayer")
+
+    png_data = io.BytesIO()
+    dither.save_png(quantized, png_data, level)
+    png_data.seek(0)
+    img = PIL.Image.open(png_data)
+    img.load()
+
+    # NOTE: パレット形式の PNG になり，読み直すと元の画像に戻る
+    assert img.mode == "P"
+    assert dither.get_png_bits(level) == bits
+    assert np.array_equal(np.asarray(img.convert("L")), np.asarray(quantized))
+
+
+def test_save_png_no_level():
+    img = create_img()
+
+    png_data = io.BytesIO()
+    dither.save_png(img, png_data)
+    png_data.seek(0)
+
+    assert np.array_equal(np.asarray(PIL.Image.open(png_data)), np.asarray(img))
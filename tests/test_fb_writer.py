@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import sys
+import struct
+import pathlib
+import subprocess
+
+import numpy as np
+import PIL.Image
+import pytest
+
+import fb_format
+
+FB_WRITER_PATH = pathlib.Path(fb_format.__file__).parent / "fb_writer.py"
+
+
+class FbWriter:
+    # NOTE: 通常のファイルをフレームバッファの代わりにして fb_writer.py を動かす
+    def __init__(self, path, width, height, bpp):
+        self.process = subprocess.Popen(
+            [sys.executable, str(FB_WRITER_PATH), str(path)]
+            + [str(width), str(height), str(bpp)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        line = self.process.stdout.readline().decode().split()
+        self.width, self.height, self.bpp, self.stride = map(int, line)
+
+    def send(self, img, rect):
+        box = fb_format.align_box(rect, self.bpp, (self.width, self.height))
+        header, data = fb_format.encode_rect(img, box, self.bpp)
+        self.process.stdin.write(header)
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+        assert self.process.stdout.readline() == b"OK\n"
+
+        return box
+
+    def close(self):
+        self.process.stdin.write(fb_format.encode_end())
+        self.process.stdin.close()
+        assert self.process.wait(10) == 0
+
+
+def create_image(width, height):
+    # NOTE: 画素毎に値が異なるグラデーション
+    gray = (np.arange(width * height, dtype=np.uint32) * 7 % 256).astype(np.uint8)
+
+    return PIL.Image.fromarray(gray.reshape(height, width), "L")
+
+
+def test_geometry(tmp_path):
+    path = tmp_path / "fb"
+    writer = FbWriter(path, 13, 5, 4)
+    writer.close()
+
+    assert (writer.width, writer.height, writer.bpp, writer.stride) == (13, 5, 4, 7)
+    assert path.read_bytes() == bytes(7 * 5)
+
+
+def test_partial_rect_4bpp(tmp_path):
+    path = tmp_path / "fb"
+    img = create_image(10, 4)
+    gray = np.asarray(img)
+
+    writer = FbWriter(path, 10, 4, 4)
+    # NOTE: 1バイトに 2 ピクセル入るので，左右はバイト境界に広げられる
+    box = writer.send(img, (3, 1, 7, 3))
+    writer.close()
+    assert box == (2, 1, 8, 3)
+
+    expected = bytearray(5 * 4)
+    for y in range(1, 3):
+        for x in range(2, 8, 2):
+            expected[y * 5 + x // 2] = (gray[y, x] >> 4) << 4 | (gray[y, x + 1] >> 4)
+    assert path.read_bytes() == bytes(expected)
+
+
+def test_partial_rect_clip(tmp_path):
+    path = tmp_path / "fb"
+    img = create_image(10, 4)
+
+    writer = FbWriter(path, 10, 4, 8)
+    # NOTE: 画面外にはみ出す部分は書かない
+    box = writer.send(img, (-3, 2, 4, 9))
+    writer.close()
+    assert box == (0, 2, 4, 4)
+
+    expected = np.zeros((4, 10), dtype=np.uint8)
+    expected[2:4, 0:4] = np.asarray(img)[2:4, 0:4]
+    assert path.read_bytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize("bpp", [1, 2, 4, 8, 16, 24, 32])
+def test_full_screen(tmp_path, bpp):
+    path = tmp_path / "fb"
+    img = create_image(24, 6)
+    gray = np.asarray(img)
+
+    writer = FbWriter(path, 24, 6, bpp)
+    writer.send(img, (0, 0, 24, 6))
+    writer.close()
+
+    expected = bytearray()
+    for y in range(6):
+        if bpp < 8:
+            pixel_per_byte = 8 // bpp
+            for x in range(0, 24, pixel_per_byte):
+                value = 0
+                for i in range(pixel_per_byte):
+                    value = (value << bpp) | (int(gray[y, x + i]) >> (8 - bpp))
+                expected.append(value)
+            continue
+        for x in range(24):
+            value = int(gray[y, x])
+            if bpp == 8:
+                expected.append(value)
+            elif bpp == 16:
+                expected += struct.pack(
+                    "<H", (value >> 3) << 11 | (value >> 2) << 5 | (value >> 3)
+                )
+            elif bpp == 24:
+                expected += bytes([value] * 3)
+            else:
+                expected += bytes([value, value, value, 255])
+
+    assert path.read_bytes() == bytes(expected)
+
+
+def test_multiple_rect(tmp_path):
+    path = tmp_path / "fb"
+    writer = FbWriter(path, 16, 8, 8)
+
+    # NOTE: 後から送った矩形だけが書き換わる
+    writer.send(PIL.Image.new("L", (16, 8), 255), (0, 0, 16, 8))
+    writer.send(PIL.Image.new("L", (16, 8), 0), (4, 2, 8, 6))
+    writer.close()
+
+    expected = np.full((8, 16), 255, dtype=np.uint8)
+    expected[2:6, 4:8] = 0
+    assert path.read_bytes() == expected.tobytes()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import PIL.Image
+import PIL.ImageDraw
+import pytest
+
+import frame_diff
+
+CONFIG = {
+    "PANEL": {"DEVICE": {"WIDTH": 100, "HEIGHT": 80}},
+    "RAIN_CLOUD": {"WIDTH": 100, "HEIGHT": 40, "HOUR_LIST": [0, 1]},
+    "WEEKLY_FORECAST": {"HEIGHT": 30},
+}
+
+FULL_BOX = (0, 0, 100, 80)
+
+
+def create_img(box=None, mode="L", size=(100, 80)):
+    img = PIL.Image.new(mode, size, 255)
+    if box is not None:
+        PIL.ImageDraw.Draw(img).rectangle(box, fill=0)
+
+    return img
+
+
+@pytest.fixture
+def diff():
+    diff = frame_diff.FrameDiff(frame_diff.get_region_list(CONFIG))
+    # NOTE: 最初は全体になる
+    assert diff.update(create_img()) == [FULL_BOX]
+
+    return diff
+
+
+def test_get_region_list():
+    assert [
+        (region["name"], region["box"]) for region in frame_diff.get_region_list(CONFIG)
+    ] == [
+        ("RAIN_CLOUD_0", (0, 0, 50, 40)),
+        ("RAIN_CLOUD_1", (50, 0, 100, 40)),
+        ("WEEKLY_FORECAST", (0, 40, 100, 70)),
+        ("REST", (0, 70, 100, 80)),
+    ]
+
+
+def test_no_change(diff):
+    assert diff.update(create_img()) == []
+
+
+def test_changed_region(diff):
+    assert diff.update(create_img((60, 10, 70, 20))) == [(50, 0, 100, 40)]
+    # NOTE: 比較するのは直前の画像
+    assert diff.update(create_img((60, 10, 70, 20))) == []
+    assert diff.update(create_img((10, 10, 20, 50))) == [
+        (0, 0, 50, 40),
+        (50, 0, 100, 40),
+        (0, 40, 100, 70),
+    ]
+
+
+def test_mode_change(diff):
+    assert diff.update(create_img(mode="1")) == [FULL_BOX]
+    assert diff.update(create_img(mode="1")) == []
+
+
+def test_size_change(diff):
+    assert diff.update(create_img(size=(100, 90))) == [(0, 0, 100, 90)]
+
+
+def test_reset(diff):
+    diff.reset()
+
+    assert diff.update(create_img()) == [FULL_BOX]
+    assert diff.update(create_img()) == []
+
+
+def test_full_refresh_interval(diff, monkeypatch):
+    now = frame_diff.time.time()
+    monkeypatch.setattr(
+        frame_diff.time, "time", lambda: now + frame_diff.FULL_REFRESH_INTERVAL + 1
+    )
+
+    assert diff.update(create_img()) == [FULL_BOX]
+    assert diff.update(create_img()) == []
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import numpy as np
+import PIL.Image
+import pytest
+
+import frame_history
+import rain_cloud_panel
+import rain_cloud_tile
+
+WIDTH = 32
+HEIGHT = 24
+
+
+def create_frame(value):
+    return PIL.Image.new("L", (WIDTH, HEIGHT), value)
+
+
+def get_value_list(history):
+    return [(timestamp, int(frame[0, 0])) for timestamp, frame in history.get_latest()]
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "frame_history.bin"
+
+
+def test_append(path):
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 4)
+    assert len(history) == 0
+    assert history.get_latest() == []
+
+    assert history.append(create_frame(1), 100)
+    assert history.append(create_frame(2), 200)
+
+    assert len(history) == 2
+    timestamp, frame = history.get(0)
+    assert timestamp == 200
+    assert frame.shape == (HEIGHT, WIDTH)
+    assert (frame == 2).all()
+    assert get_value_list(history) == [(100, 1), (200, 2)]
+
+    with pytest.raises(IndexError):
+        history.get(2)
+
+
+def test_wraparound(path):
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 3)
+    for i in range(7):
+        history.append(create_frame(i + 1), i)
+
+    # NOTE: 容量を超えたら古いものから上書きする
+    assert len(history) == 3
+    assert get_value_list(history) == [(4, 5), (5, 6), (6, 7)]
+    assert [timestamp for timestamp, frame in history.get_latest(2)] == [5, 6]
+
+
+def test_skip_same_frame(path):
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 3)
+
+    assert history.append(create_frame(1), 100)
+    # NOTE: 前回と同じ画像は保存しない
+    assert not history.append(create_frame(1), 200)
+    assert history.append(create_frame(2), 300)
+    assert history.append(create_frame(1), 400)
+
+    assert get_value_list(history) == [(100, 1), (300, 2), (400, 1)]
+
+
+def test_append_rgb(path):
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 3)
+    history.append(PIL.Image.new("RGB", (WIDTH, HEIGHT), (255, 255, 255)), 100)
+
+    assert get_value_list(history) == [(100, 255)]
+
+
+def test_append_size_mismatch(path):
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 3)
+
+    with pytest.raises(ValueError):
+        history.append(PIL.Image.new("L", (WIDTH + 1, HEIGHT)), 100)
+    assert len(history) == 0
+
+
+def test_read_only(path):
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 3)
+    history.append(create_frame(1), 100)
+
+    timestamp, frame = history.get(0)
+    with pytest.raises(ValueError):
+        frame[0, 0] = 0
+
+
+def test_append_in_place(path):
+    # NOTE: 追加で書き換わるのは，ヘッダと1枚分の領域だけ
+    capacity = 4
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, capacity)
+    for i in range(capacity + 1):
+        history.append(create_frame(i + 1), i)
+    history.flush()
+    before = np.fromfile(path, dtype=np.uint8)
+
+    history.append(create_frame(100), 100)
+    history.flush()
+    after = np.fromfile(path, dtype=np.uint8)
+
+    changed = np.flatnonzero(before != after)
+    header_size = frame_history.HEADER_DTYPE.itemsize
+    frame_size = WIDTH * HEIGHT
+    frame_offset = header_size + 8 * capacity
+    head = (capacity + 1) % capacity
+    assert len(changed) != 0
+    assert (
+        (changed < header_size)
+        | ((changed >= header_size + 8 * head) & (changed < header_size + 8 * head + 8))
+        | (
+            (changed >= frame_offset + frame_size * head)
+            & (changed < frame_offset + frame_size * (head + 1))
+        )
+    ).all()
+
+
+def test_file_size(path):
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 5)
+    file_size = path.stat().st_size
+    assert file_size == (
+        frame_history.HEADER_DTYPE.itemsize + 5 * 8 + 5 * WIDTH * HEIGHT
+    )
+
+    # NOTE: 何枚追加してもファイルサイズは変わらない
+    for i in range(12):
+        history.append(create_frame(i), i)
+    history.flush()
+    assert path.stat().st_size == file_size
+
+
+def test_reopen(path):
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 3)
+    for i in range(4):
+        history.append(create_frame(i + 1), i)
+    history.flush()
+    del history
+
+    # NOTE: 開き直しても，続きから追加できる
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 3)
+    assert get_value_list(history) == [(1, 2), (2, 3), (3, 4)]
+    history.append(create_frame(5), 4)
+    assert get_value_list(history) == [(2, 3), (3, 4), (4, 5)]
+
+
+@pytest.mark.parametrize(
+    "width,height,capacity",
+    [(WIDTH + 1, HEIGHT, 3), (WIDTH, HEIGHT + 1, 3), (WIDTH, HEIGHT, 4)],
+)
+def test_recreate(path, width, height, capacity):
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 3)
+    history.append(create_frame(1), 100)
+    history.flush()
+    del history
+
+    # NOTE: サイズや容量が変わった場合は作り直す
+    history = frame_history.FrameHistory(path, width, height, capacity)
+    assert len(history) == 0
+    assert path.stat().st_size == history.file_size
+
+
+def test_recreate_broken(path):
+    path.write_bytes(b"broken")
+
+    history = frame_history.FrameHistory(path, WIDTH, HEIGHT, 3)
+    assert len(history) == 0
+    history.append(create_frame(1), 100)
+    assert get_value_list(history) == [(100, 1)]
+
+
+def test_get_frame_history(path):
+    history = frame_history.get_frame_history(WIDTH, HEIGHT, 3, path)
+
+    assert frame_history.get_frame_history(WIDTH, HEIGHT, 3, path) is history
+    assert frame_history.get_frame_history(WIDTH, HEIGHT, 4, path) is not history
+
+
+@pytest.fixture
+def rain_cloud_create(path, monkeypatch):
+    # NOTE: タイルの取得と文字の描画を省いて，パネルを生成する
+    monkeypatch.setattr(frame_history, "FRAME_HISTORY_PATH", path)
+    monkeypatch.setattr(frame_history, "_frame_history_map", {})
+    monkeypatch.setattr(rain_cloud_panel, "get_face_map", lambda font_config: {})
+    monkeypatch.setattr(rain_cloud_panel, "draw_caption", lambda img, title, face: img)
+    monkeypatch.setattr(
+        rain_cloud_tile,
+        "fetch_cloud_image",
+        lambda tile_config, width, height, hour_list: {
+            hour: np.full((height, width, 3), 255, dtype=np.uint8) for hour in hour_list
+        },
+    )
+
+    def create(history_config):
+        panel_config = {
+            "WIDTH": WIDTH * 2,
+            "HEIGHT": HEIGHT,
+            "BACKEND": "tile",
+            "TILE": {"ZOOM": 10, "LAT": 35.0, "LON": 135.0},
+            "HISTORY": history_config,
+        }
+        return rain_cloud_panel.create(panel_config, {})
+
+    return create
+
+
+def test_rain_cloud_panel_history(path, rain_cloud_create):
+    rain_cloud_create({"SIZE": 3})
+
+    history = frame_history.get_frame_history(WIDTH, HEIGHT, 3)
+    assert len(history) == 1
+
+
+def test_rain_cloud_panel_history_null(path, rain_cloud_create, caplog):
+    # NOTE: 値の無い HISTORY (null) は，指定が無いものとして扱う
+    rain_cloud_create(None)
+
+    assert not path.exists()
+    assert not any(record.levelname == "WARNING" for record in caplog.records)
+
+
+def test_rain_cloud_panel_history_error(path, rain_cloud_create, caplog, monkeypatch):
+    def get_frame_history(*args):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(frame_history, "get_frame_history", get_frame_history)
+
+    # NOTE: 履歴に残せなくても，パネルは生成する
+    assert rain_cloud_create({"SIZE": 3}) is not None
+    record_list = [record for record in caplog.records if record.levelname == "WARNING"]
+    assert len(record_list) == 1
+    assert record_list[0].exc_info is not None
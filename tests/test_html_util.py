@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import pytest
+
+from conftest import DATA_PATH
+from html_util import parse_subtree
+
+BASE_URL = "https://weather.yahoo.co.jp/weather/jp/13/4410.html"
+
+
+@pytest.fixture
+def html():
+    return (DATA_PATH / "weekly_forecast.html").read_text(encoding="utf-8")
+
+
+def test_parse_subtree_root(html):
+    # NOTE: script の中の文字列や別の表は対象にならない
+    root = parse_subtree(html, "yjw_week", BASE_URL)
+
+    assert root.tag == "div"
+    assert root.attrs["class"] == "yjw_clr"
+    assert len(root.find_children("table")) == 1
+    assert len(root.find_all("tr")) == 4
+    assert len(root.find_all("img")) == 6
+
+
+def test_parse_subtree_text(html):
+    root = parse_subtree(html, "yjw_week", BASE_URL)
+    row_list = root.find("table").find_all("tr")
+
+    # NOTE: Selenium の WebElement.text と同じく，<br> は改行にして空白は詰める
+    assert row_list[0].find_children("td")[1].text == "8月28日\n(日)"
+    assert row_list[2].find_children("td")[1].text == "31\n24"
+    assert row_list[3].find_children("td")[3].text == "80"
+    assert root.find_children("p")[0].text == "© 日本気象協会"
+
+
+def test_parse_subtree_url(html):
+    root = parse_subtree(html, "yjw_week", BASE_URL)
+    src_list = [img.get_attribute("src") for img in root.find_all("img")]
+
+    # NOTE: 相対 URL は絶対 URL にする
+    assert src_list[2] == (
+        "https://s.yimg.jp/images/weather/general/next/size90/300_day.png"
+    )
+    assert src_list[3] == (
+        "https://weather.yahoo.co.jp/images/weather/general/next/size90/302_day.png"
+    )
+    assert root.find("img").get_attribute("alt") == "曇り"
+    assert root.find("img").get_attribute("title") is None
+
+
+def test_parse_subtree_void_and_unclosed():
+    root = parse_subtree(
+        '<div id="a"><p>x<br>y<img src="i.png"/><p>z</div><p id="b">w</p>',
+        "a",
+        "http://example.com/",
+    )
+
+    # NOTE: 閉じ忘れた <p> は入れ子のまま，外側の </div> で閉じる
+    assert [p.text for p in root.find_all("p")] == ["x\nyz", "z"]
+    assert root.find("img").get_attribute("src") == "http://example.com/i.png"
+    assert root.find_child("span") is None
+    assert root.find("span") is None
+
+
+def test_parse_subtree_not_found(html):
+    with pytest.raises(ValueError):
+        parse_subtree(html, "not_exist", BASE_URL)
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import os
+import sys
+import time
+import threading
+import subprocess
+
+import pytest
+
+import http_client
+import metrics
+
+# NOTE: 再試行の待ち時間を記録するために time.sleep を差し替えるので，
+# サーバー側やテスト自身で待つ場合はこちらを使う
+sleep = time.sleep
+
+
+@pytest.fixture
+def client():
+    client = http_client.HTTPClient(max_connection=2, timeout=2)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def sleep_list(monkeypatch):
+    # NOTE: 再試行の待ち時間は記録だけして，実際には待たない
+    sleep_list = []
+    monkeypatch.setattr(http_client.time, "sleep", sleep_list.append)
+
+    return sleep_list
+
+
+def get_counter(name, **labels):
+    for metric in metrics.get_snapshot()["counter"].values():
+        if (metric["name"] == name) and (metric["labels"] == labels):
+            return metric["value"]
+
+    return 0
+
+
+def test_keep_alive(client, stand_in_server):
+    stand_in_server.add("/ok", 200, {"Content-Type": "text/plain"}, b"hello")
+
+    for i in range(5):
+        res = client.get(stand_in_server.url("/ok"))
+        assert res["status"] == 200
+        assert res["data"] == b"hello"
+
+    # NOTE: 接続は使い回す
+    assert stand_in_server.connection_count == 1
+    assert stand_in_server.hit_map["/ok"] == 5
+
+
+def test_user_agent_and_header(client, stand_in_server):
+    stand_in_server.add("/ok?a=1", body=b"ok")
+
+    client.get(stand_in_server.url("/ok?a=1"), {"If-None-Match": '"v1"'})
+
+    path, header_map = stand_in_server.request_list[0]
+    assert path == "/ok?a=1"
+    assert header_map["User-Agent"] == http_client.USER_AGENT
+    assert header_map["If-None-Match"] == '"v1"'
+
+
+def test_redirect(client, stand_in_server):
+    stand_in_server.add("/old", 301, {"Location": "/new"})
+    stand_in_server.add("/new", 302, {"Location": stand_in_server.url("/ok")})
+    stand_in_server.add("/ok", body=b"ok")
+
+    res = client.get(stand_in_server.url("/old"))
+
+    assert res["url"] == stand_in_server.url("/ok")
+    assert res["data"] == b"ok"
+
+
+def test_redirect_loop(client, stand_in_server):
+    stand_in_server.add("/loop", 302, {"Location": "/loop"})
+
+    with pytest.raises(ValueError):
+        client.get(stand_in_server.url("/loop"))
+    assert stand_in_server.hit_map["/loop"] == http_client.REDIRECT_MAX + 1
+
+
+def test_not_modified(client, stand_in_server):
+    stand_in_server.add("/etag", 304, {"ETag": '"v1"'})
+
+    # NOTE: 304 は例外にせずに返す
+    res = client.get(stand_in_server.url("/etag"))
+    assert res["status"] == 304
+    assert res["headers"]["ETag"] == '"v1"'
+    assert res["data"] == b""
+
+
+def test_not_found(client, stand_in_server, sleep_list):
+    with pytest.raises(http_client.HTTPError) as e:
+        client.get(stand_in_server.url("/missing"))
+
+    assert e.value.code == 404
+    assert e.value.url == stand_in_server.url("/missing")
+    # NOTE: 404 は再試行しない
+    assert stand_in_server.hit_map["/missing"] == 1
+    assert sleep_list == []
+
+    # NOTE: request() は状態コードに関わらず応答を返す
+    assert client.request(stand_in_server.url("/missing"))["status"] == 404
+
+
+def test_retry_after(client, stand_in_server, sleep_list):
+    def route(handler):
+        if stand_in_server.hit_map["/flaky"] < 3:
+            return (503, {"Retry-After": "3"}, b"busy")
+        return (200, {}, b"recovered")
+
+    stand_in_server.route_map["/flaky"] = route
+    host = "127.0.0.1"
+    retry_count = get_counter("http_retry_total", host=host)
+
+    res = client.get(stand_in_server.url("/flaky"))
+
+    assert res["data"] == b"recovered"
+    assert stand_in_server.hit_map["/flaky"] == 3
+    # NOTE: バックオフより Retry-After の方が長い場合はそれに従う
+    assert sleep_list == [3, 3]
+    assert get_counter("http_retry_total", host=host) == retry_count + 2
+
+
+def test_retry_backoff(stand_in_server, sleep_list):
+    client = http_client.HTTPClient(retry=3)
+    stand_in_server.add("/error", 500)
+
+    with pytest.raises(http_client.HTTPError) as e:
+        client.get(stand_in_server.url("/error"))
+
+    assert e.value.code == 500
+    assert stand_in_server.hit_map["/error"] == 4
+    assert sleep_list == [
+        http_client.RETRY_WAIT,
+        http_client.RETRY_WAIT * 2,
+        http_client.RETRY_WAIT * 4,
+    ]
+    client.close()
+
+
+def test_timeout(client, stand_in_server, sleep_list):
+    def route(handler):
+        sleep(0.3)
+        return (200, {}, b"slow")
+
+    stand_in_server.route_map["/slow"] = route
+
+    with pytest.raises(TimeoutError):
+        client.get(stand_in_server.url("/slow"), timeout=0.05, retry=1)
+    assert len(sleep_list) == 1
+
+
+def test_max_size(client, stand_in_server):
+    stand_in_server.add("/big", body=b"x" * 5000)
+
+    def chunked(handler):
+        handler.send_response(200)
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        for i in range(10):
+            handler.wfile.write(b"3e8\r\n" + b"y" * 1000 + b"\r\n")
+        handler.wfile.write(b"0\r\n\r\n")
+
+    stand_in_server.route_map["/chunked"] = chunked
+
+    # NOTE: Content-Length で分かる場合も，読みながら分かる場合も例外にする
+    with pytest.raises(ValueError):
+        client.get(stand_in_server.url("/big"), max_size=1000)
+    with pytest.raises(ValueError):
+        client.get(stand_in_server.url("/chunked"), max_size=5000)
+
+    assert len(client.get(stand_in_server.url("/big"))["data"]) == 5000
+    assert len(client.get(stand_in_server.url("/chunked"))["data"]) == 10000
+
+
+def test_reconnect_after_server_close(client, stand_in_server, sleep_list):
+    def route(handler):
+        # NOTE: Connection: close を付けずに切断し，接続が使い回されるようにする
+        handler.send(200, {}, b"closed")
+        handler.close_connection = True
+
+    stand_in_server.route_map["/close"] = route
+    stand_in_server.add("/ok", body=b"ok")
+
+    assert client.get(stand_in_server.url("/close"))["data"] == b"closed"
+    sleep(0.05)
+
+    # NOTE: 切られた接続を使ってしまっても，新しい接続で送り直す
+    assert client.get(stand_in_server.url("/ok"))["data"] == b"ok"
+    assert stand_in_server.connection_count == 2
+    assert stand_in_server.hit_map["/ok"] == 1
+    assert sleep_list == []
+
+
+def test_connection_close(client, stand_in_server):
+    stand_in_server.add("/close", 200, {"Connection": "close"}, b"closed")
+    stand_in_server.add("/ok", body=b"ok")
+
+    # NOTE: サーバーが閉じると言っている接続は使い回さない
+    client.get(stand_in_server.url("/close"))
+    client.get(stand_in_server.url("/ok"))
+
+    assert stand_in_server.connection_count == 2
+
+
+def test_idle_timeout(client, stand_in_server, monkeypatch):
+    stand_in_server.add("/ok", body=b"ok")
+
+    client.get(stand_in_server.url("/ok"))
+    monkeypatch.setattr(http_client, "IDLE_TIMEOUT", 0)
+    client.get(stand_in_server.url("/ok"))
+
+    # NOTE: 長く使っていない接続は使わずに閉じる
+    assert stand_in_server.connection_count == 2
+
+
+def test_max_connection(client, stand_in_server):
+    lock = threading.Lock()
+    state = {"active": 0, "max_active": 0}
+
+    def route(handler):
+        with lock:
+            state["active"] += 1
+            state["max_active"] = max(state["max_active"], state["active"])
+        sleep(0.1)
+        with lock:
+            state["active"] -= 1
+        return (200, {}, b"ok")
+
+    stand_in_server.route_map["/slow"] = route
+
+    thread_list = [
+        threading.Thread(target=client.get, args=(stand_in_server.url("/slow"),))
+        for i in range(6)
+    ]
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+
+    # NOTE: 同じホストへの同時接続数は制限する
+    assert stand_in_server.hit_map["/slow"] == 6
+    assert state["max_active"] == 2
+    assert stand_in_server.connection_count == 2
+
+
+def test_fetch(stand_in_server):
+    stand_in_server.add("/ok", body=b"ok")
+
+    assert http_client.fetch(stand_in_server.url("/ok")) == b"ok"
+    assert http_client.get_http_client() is http_client.get_http_client()
+
+
+def test_unsupported_url(client):
+    with pytest.raises(ValueError):
+        client.get("ftp://127.0.0.1/file")
+
+
+def test_no_browser_dependency():
+    # NOTE: ブラウザを使わないモジュールは，selenium を読み込まない
+    code = (
+        "import sys, http_client, rain_cloud_tile, frame_history; "
+        + "sys.exit('selenium' in sys.modules)"
+    )
+    subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.join(os.path.dirname(__file__), "..", "src"),
+        check=True,
+    )
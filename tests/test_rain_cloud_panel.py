@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import cv2
+import numpy as np
+import PIL.Image
+import pytest
+
+import rain_cloud_panel
+import benchmark
+
+URL = "https://www.jma.go.jp/bosai/nowc/#zoom:11/lat:35.0/lon:135.0"
+
+# NOTE: ウィンドウの枠やツールバーの分，要素はウィンドウより小さい
+FRAME_SIZE = (16, 120)
+
+
+class FakeElement:
+    def __init__(self, driver):
+        self.driver = driver
+
+    @property
+    def size(self):
+        return {
+            "width": self.driver.window_size["width"] - FRAME_SIZE[0],
+            "height": self.driver.window_size["height"] - FRAME_SIZE[1],
+        }
+
+    @property
+    def screenshot_as_png(self):
+        return "png-{count}".format(count=self.driver.tile_count).encode()
+
+    def click(self):
+        pass
+
+
+class FakeDriver:
+    def __init__(self):
+        self.window_size = {"width": 800, "height": 600}
+        self.capabilities = {"browserVersion": "100.0"}
+        self.get_list = []
+        self.refresh_count = 0
+        self.tile_count = 0
+
+    def get(self, url):
+        self.get_list.append(url)
+
+    def refresh(self):
+        self.refresh_count += 1
+
+    def set_window_size(self, width, height):
+        self.window_size = {"width": width, "height": height}
+
+    def get_window_size(self):
+        return dict(self.window_size)
+
+    def find_element(self, by, value):
+        return FakeElement(self)
+
+    def execute_script(self, script, *args):
+        # NOTE: タイルの読み込み完了の確認では，毎回異なるタイルの一覧を返す
+        if script == rain_cloud_panel.TILE_READY_SCRIPT:
+            self.tile_count += 1
+            return "tile-{count}".format(count=self.tile_count)
+
+        return None
+
+
+@pytest.fixture
+def window_size_cache(tmp_path, monkeypatch):
+    path = tmp_path / "window_size.json"
+    monkeypatch.setattr(rain_cloud_panel, "WINDOW_SIZE_CACHE_PATH", path)
+
+    return path
+
+
+def fetch(driver, hour_list):
+    is_loaded = rain_cloud_panel.change_window_size(driver, URL, 400, 300)
+
+    return rain_cloud_panel.fetch_cloud_image(
+        driver, URL, 400, 300, hour_list, is_loaded=is_loaded
+    )
+
+
+def test_fetch_cloud_image_calibrate(window_size_cache):
+    driver = FakeDriver()
+    png_data_map = fetch(driver, [0, 1])
+
+    assert sorted(png_data_map.keys()) == [0, 1]
+    assert driver.get_window_size() == {
+        "width": 400 + FRAME_SIZE[0],
+        "height": 300 + FRAME_SIZE[1],
+    }
+    # NOTE: 調整の際に読み込んだページをそのまま使う
+    assert driver.get_list == [URL]
+    assert window_size_cache.exists()
+
+
+def test_fetch_cloud_image_cached(window_size_cache):
+    fetch(FakeDriver(), [0])
+
+    driver = FakeDriver()
+    png_data_map = fetch(driver, [0, 1, 2])
+
+    assert sorted(png_data_map.keys()) == [0, 1, 2]
+    # NOTE: キャッシュが使える場合は，ページの読み込みは1回だけ
+    assert driver.get_list == [URL]
+    assert driver.refresh_count == 0
+
+
+def test_fetch_cloud_image_not_loaded(window_size_cache):
+    driver = FakeDriver()
+    rain_cloud_panel.fetch_cloud_image(driver, URL, 400, 300, [0])
+
+    assert driver.get_list == [URL]
+
+
+def create_all_color_png():
+    # NOTE: RGB の全ての組み合わせを，4 刻みで並べた画像
+    value = np.arange(0, 256, 4, dtype=np.uint8)
+    b, g, r = np.meshgrid(value, value, value, indexing="ij")
+    img = np.stack([b, g, r], axis=-1).reshape(512, 512, 3)
+
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+@pytest.mark.parametrize(
+    "png_data",
+    [create_all_color_png(), benchmark.create_cloud_png(256, 256)],
+    ids=["all_color", "noise"],
+)
+def test_retouch_cloud_image(png_data):
+    # NOTE: 変換表を使う前の実装と，グレースケールへの変換の丸め誤差 (±1) を
+    # 除いて一致する
+    reference = np.asarray(
+        benchmark.retouch_cloud_image_reference(png_data).convert("L"),
+        dtype=np.int16,
+    )
+    current = np.asarray(rain_cloud_panel.retouch_cloud_image(png_data), dtype=np.int16)
+
+    assert current.shape == reference.shape
+    assert np.abs(current - reference).max() <= 1
+
+
+# NOTE: 気象庁の降水強度の色 (BGR)
+COLOR_YELLOW = (0, 245, 250)
+COLOR_RED = (0, 40, 255)
+
+AREA_SIZE = 240
+PIXEL_PER_KM = 10
+
+
+def create_area_img():
+    # NOTE: 中心から東に 3km の位置に黄色 (強い雨)，北に 7km の位置に赤色
+    # (非常に激しい雨) の雨雲がある画像
+    img = np.full((AREA_SIZE, AREA_SIZE, 3), 255, dtype=np.uint8)
+    center = AREA_SIZE // 2
+    cv2.circle(img, (center + 3 * PIXEL_PER_KM, center), 3, COLOR_YELLOW, -1)
+    cv2.circle(img, (center, center - 7 * PIXEL_PER_KM), 3, COLOR_RED, -1)
+
+    return img
+
+
+def test_classify_cloud_array():
+    img = np.array([[(255, 255, 255), COLOR_YELLOW, COLOR_RED]], dtype=np.uint8)
+
+    assert rain_cloud_panel.classify_cloud_array(img).tolist() == [
+        [len(rain_cloud_panel.RAINFALL_INTENSITY_LEVEL), 4, 6]
+    ]
+
+
+def test_analyze_rain_area():
+    area = rain_cloud_panel.analyze_rain_area(
+        create_area_img(), (1, 2.5, 5, 10), 8, PIXEL_PER_KM
+    )
+
+    # NOTE: hist は (円, 方角, 降雨強度) 毎の画素数
+    hist = area["hist"]
+    rain_hist = hist[:, :, : len(rain_cloud_panel.RAINFALL_INTENSITY_LEVEL)]
+    assert hist.shape == (4, 8, len(rain_cloud_panel.RAINFALL_INTENSITY_LEVEL) + 1)
+    assert sorted(zip(*np.nonzero(rain_hist))) == [(2, 2, 4), (3, 0, 6)]
+    assert rain_hist[2, 2, 4] == rain_hist[3, 0, 6] > 0
+
+    assert [ring["level"] for ring in area["ring"]] == [None, None, 4, 6]
+    assert [within["level"] for within in area["within"]] == [None, None, 4, 6]
+    assert [within["radius"] for within in area["within"]] == [1, 2.5, 5, 10]
+    # NOTE: 方角は北から時計回り
+    sector_level_list = [sector["level"] for sector in area["sector"]]
+    assert sector_level_list == [6, None, 4] + [None] * 5
+
+    assert area["within"][1]["coverage"] == 0
+    assert 0 < area["within"][2]["coverage"] < area["ring"][2]["coverage"]
+    # NOTE: 各円の画素数は，円の面積とほぼ一致する
+    assert hist[0].sum() == pytest.approx(np.pi * PIXEL_PER_KM**2, rel=0.05)
+    assert hist[:3].sum() == pytest.approx(np.pi * (5 * PIXEL_PER_KM) ** 2, rel=0.01)
+
+
+def test_analyze_rain_area_unsorted():
+    img = create_area_img()
+    area = rain_cloud_panel.analyze_rain_area(img, (10, 1, 5, 2.5), 8, PIXEL_PER_KM)
+    expected = rain_cloud_panel.analyze_rain_area(img, (1, 2.5, 5, 10), 8, PIXEL_PER_KM)
+
+    # NOTE: 設定の順番によらず，内側から順に集計する
+    assert np.array_equal(area["hist"], expected["hist"])
+    assert [ring["radius"] for ring in area["ring"]] == [1, 2.5, 5, 10]
+
+
+def test_analyze_rain_area_scale():
+    # NOTE: 縮尺が半分なら，東の雨雲は 6km，北の雨雲は 14km 先になる
+    area = rain_cloud_panel.analyze_rain_area(
+        create_area_img(), (1, 2.5, 5, 10), 8, PIXEL_PER_KM / 2
+    )
+
+    assert [ring["level"] for ring in area["ring"]] == [None, None, None, 4]
+    assert [sector["level"] for sector in area["sector"]][:3] == [None, None, 4]
+
+
+def test_get_rain_area_text():
+    area = rain_cloud_panel.analyze_rain_area(
+        create_area_img(), (1, 2.5, 5, 10), 8, PIXEL_PER_KM
+    )
+
+    assert rain_cloud_panel.get_rain_area_text(area, 5) == "5km圏内: 強い雨"
+    assert rain_cloud_panel.get_rain_area_text(area, 2.5) == "2.5km圏内: 雨なし"
+    assert rain_cloud_panel.get_rain_area_text(area, 10) == "10km圏内: 非常に激しい雨"
+    assert rain_cloud_panel.get_rain_area_text(area, 3) is None
+
+
+def test_get_radial_index():
+    radial_index = rain_cloud_panel.get_radial_index(
+        AREA_SIZE, AREA_SIZE, (1, 5), 4, PIXEL_PER_KM
+    )
+
+    # NOTE: 計算するのは一番外側の円を囲む範囲だけ
+    box = radial_index["box"]
+    assert box == (70, 70, 171, 171)
+    assert radial_index["index"].shape == (box[3] - box[1], box[2] - box[0])
+    assert radial_index["bin_count"] == 2 * 4 + 1
+
+
+@pytest.mark.parametrize(
+    "panel_config,expected",
+    [
+        ({}, rain_cloud_panel.BROWSER_PIXEL_PER_KM),
+        ({"BACKEND": "browser"}, rain_cloud_panel.BROWSER_PIXEL_PER_KM),
+        # NOTE: 赤道では，ズームレベル 0 の 256 ピクセルが地球一周
+        (
+            {"BACKEND": "tile", "TILE": {"LAT": 0, "ZOOM": 0}},
+            256 / (2 * np.pi * 6378.137),
+        ),
+        ({"BACKEND": "tile", "TILE": {"LAT": 35, "ZOOM": 12}}, 31.94),
+        ({"BACKEND": "tile", "TILE": {"LAT": 35, "ZOOM": 11}}, 15.97),
+        ({"BACKEND": "tile", "TILE": {"LAT": 60, "ZOOM": 12}}, 52.32),
+    ],
+)
+def test_get_pixel_per_km(panel_config, expected):
+    assert rain_cloud_panel.get_pixel_per_km(panel_config) == pytest.approx(
+        expected, rel=1e-3
+    )
+
+
+def get_circle_radius(img):
+    # NOTE: 中心から右に向かって，一番外側の白い線の位置を探す
+    row = np.asarray(img)[img.size[1] // 2, img.size[0] // 2 :]
+
+    return np.flatnonzero(row == 255)[-1]
+
+
+@pytest.mark.parametrize(
+    "pixel_per_km", [rain_cloud_panel.BROWSER_PIXEL_PER_KM, 16, 64]
+)
+def test_draw_equidistant_circle(pixel_per_km):
+    img = PIL.Image.new("L", (800, 700), 128)
+    rain_cloud_panel.draw_equidistant_circle(img, pixel_per_km)
+
+    # NOTE: 円の半径は，縮尺に合わせて 5km になる
+    radius = rain_cloud_panel.CIRCLE_RADIUS * pixel_per_km
+    assert abs(get_circle_radius(img) - radius) <= 1
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import os
+import json
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from conftest import DATA_PATH
+import http_client
+import rain_cloud_tile
+
+TILE_SIZE = rain_cloud_tile.TILE_SIZE
+
+
+@pytest.fixture
+def base_tile():
+    return cv2.imread(str(DATA_PATH / "tile" / "base.png"), cv2.IMREAD_UNCHANGED)
+
+
+@pytest.fixture
+def tile_cache(tmp_path, monkeypatch):
+    cache = rain_cloud_tile.TileCache(tmp_path / "tile")
+    monkeypatch.setattr(rain_cloud_tile, "_tile_cache", cache)
+    monkeypatch.setattr(http_client, "RETRY_WAIT", 0)
+
+    return cache
+
+
+@pytest.fixture
+def tile_server(stand_in_server):
+    # NOTE: /{kind}/{z}/{x}/{y}.png に対して，記録しておいたタイルを返す．
+    # missing_set に含まれる (z, x, y) は 404 にする．
+    stand_in_server.missing_set = set()
+    tile_map = {
+        kind: (DATA_PATH / "tile" / (kind + ".png")).read_bytes()
+        for kind in ["base", "rain"]
+    }
+
+    def route(handler):
+        part_list = handler.path[: -len(".png")].strip("/").split("/")
+        kind = part_list[0]
+        z, x, y = part_list[-3:]
+        if (int(z), int(x), int(y)) in stand_in_server.missing_set:
+            return (404, {}, b"not found")
+        return (200, {"Content-Type": "image/png"}, tile_map[kind])
+
+    stand_in_server.route_map["/base/*"] = route
+    stand_in_server.route_map["/rain/*"] = route
+
+    return stand_in_server
+
+
+def get_expected_base(base_tile, left, top, width, height):
+    # NOTE: 全てのタイルが同じなので，タイル内の位置だけで画素が決まる
+    y, x = np.mgrid[top : top + height, left : left + width]
+
+    return base_tile[y % TILE_SIZE, x % TILE_SIZE]
+
+
+def test_get_tile_range():
+    tile_range = rain_cloud_tile.get_tile_range((1000, 600), 300, 200)
+
+    assert tile_range["x"] == range(3, 5)
+    assert tile_range["y"] == range(1, 3)
+    assert tile_range["offset"] == (850 % TILE_SIZE, 500 % TILE_SIZE)
+
+    # NOTE: タイルの境界にちょうど収まる場合は，余分なタイルを含めない
+    tile_range = rain_cloud_tile.get_tile_range((384, 384), 256, 256)
+    assert tile_range["x"] == range(1, 2)
+    assert tile_range["y"] == range(1, 2)
+    assert tile_range["offset"] == (0, 0)
+
+
+def test_get_pixel_pos():
+    assert rain_cloud_tile.get_pixel_pos(0, 0, 0) == pytest.approx((128, 128))
+    x, y = rain_cloud_tile.get_pixel_pos(35.681, 139.767, 10)
+    assert (int(x // TILE_SIZE), int(y // TILE_SIZE)) == (909, 403)
+
+
+@pytest.mark.parametrize(
+    "tile_config,expected",
+    [({}, rain_cloud_tile.TILE_ZOOM), ({"ZOOM": 0}, 0), ({"ZOOM": 18}, 18)],
+)
+def test_get_zoom(tile_config, expected):
+    assert rain_cloud_tile.get_zoom(tile_config) == expected
+
+
+@pytest.mark.parametrize("zoom", [-1, 19, 11.5, "11"])
+def test_get_zoom_invalid(zoom):
+    with pytest.raises(ValueError):
+        rain_cloud_tile.get_zoom({"ZOOM": zoom})
+
+
+def test_get_pixel_per_km():
+    # NOTE: ズームレベルが 1 増えると倍になり，緯度が高いほど大きくなる
+    pixel_per_km = rain_cloud_tile.get_pixel_per_km(35, 12)
+    assert rain_cloud_tile.get_pixel_per_km(35, 13) == pytest.approx(pixel_per_km * 2)
+    assert rain_cloud_tile.get_pixel_per_km(45, 12) > pixel_per_km
+
+    # NOTE: 隣り合う 1km 離れた地点のピクセル座標の差と一致する
+    lat = 35
+    lon_per_km = 1 / (2 * np.pi * 6378.137 * np.cos(np.radians(lat)) / 360)
+    x0 = rain_cloud_tile.get_pixel_pos(lat, 135, 12)[0]
+    x1 = rain_cloud_tile.get_pixel_pos(lat, 135 + lon_per_km, 12)[0]
+    assert x1 - x0 == pytest.approx(pixel_per_km)
+
+
+def test_compose_layer(tile_cache, tile_server, base_tile):
+    url_format = tile_server.url("/base/{z}/{x}/{y}.png")
+    layer = rain_cloud_tile.compose_layer(url_format, (1000, 600), 3, 18, 300, 200)
+
+    assert layer.shape == (200, 300, 4)
+    expected = get_expected_base(base_tile, 850, 500, 300, 200)
+    assert np.array_equal(layer[:, :, :3], expected)
+    assert np.all(layer[:, :, 3] == 255)
+    assert sorted(path for path in tile_server.hit_map) == [
+        "/base/3/{x}/{y}.png".format(x=x, y=y) for x in [3, 4] for y in [1, 2]
+    ]
+
+
+def test_compose_layer_edge(tile_cache, tile_server, base_tile):
+    # NOTE: 経度方向は折り返し，緯度方向の範囲外と 404 のタイルは透明にする
+    tile_server.missing_set.add((2, 1, 0))
+    url_format = tile_server.url("/base/{z}/{x}/{y}.png")
+    layer = rain_cloud_tile.compose_layer(url_format, (100, 100), 2, 18, 400, 300)
+
+    assert sorted(tile_server.hit_map) == [
+        "/base/2/0/0.png",
+        "/base/2/1/0.png",
+        "/base/2/3/0.png",
+    ]
+
+    expected = get_expected_base(base_tile, -100, -50, 400, 300)
+    # NOTE: 上側 (y < 0) は透明
+    assert np.all(layer[:50, :, 3] == 0)
+    assert np.array_equal(layer[50:, :356, :3], expected[50:, :356])
+    assert np.all(layer[50:, :356, 3] == 255)
+    # NOTE: (2, 1, 0) のタイルは存在しないので透明
+    assert np.all(layer[50:, 356:, 3] == 0)
+
+
+def test_compose_layer_upscale(tile_cache, tile_server, base_tile):
+    # NOTE: タイルが無いズームレベルでは，上限のタイルを補間せずに引き伸ばす
+    url_format = tile_server.url("/base/{z}/{x}/{y}.png")
+    layer = rain_cloud_tile.compose_layer(url_format, (1024, 1024), 3, 2, 128, 64)
+
+    assert layer.shape == (64, 128, 4)
+    assert all(path.startswith("/base/2/") for path in tile_server.hit_map)
+    expected = get_expected_base(base_tile, 512 - 32, 512 - 16, 64, 32)
+    assert np.array_equal(layer[0::2, 0::2, :3], expected)
+    assert np.array_equal(layer[1::2, 1::2, :3], expected)
+
+
+def test_blend_layer():
+    base = np.zeros((2, 2, 4), dtype=np.uint8)
+    base[0, :] = (10, 20, 30, 255)
+    overlay = np.zeros((2, 2, 4), dtype=np.uint8)
+    overlay[:, 1] = (0, 0, 255, 255)
+    overlay[1, 0] = (0, 0, 255, 128)
+
+    img = rain_cloud_tile.blend_layer(base, overlay)
+
+    assert img.dtype == np.uint8
+    # NOTE: 背景の透明部分は白にして，その上に雨雲を重ねる
+    assert img[0, 0].tolist() == [10, 20, 30]
+    assert img[0, 1].tolist() == [0, 0, 255]
+    assert img[1, 1].tolist() == [0, 0, 255]
+    assert img[1, 0].tolist() == [127, 127, 255]
+
+
+def test_fetch_tile(tile_cache, tile_server):
+    url = tile_server.url("/rain/10/909/403.png")
+    data = rain_cloud_tile.fetch_tile(url)
+
+    assert data == (DATA_PATH / "tile" / "rain.png").read_bytes()
+    # NOTE: 2回目はキャッシュを使う
+    assert rain_cloud_tile.fetch_tile(url) == data
+    assert tile_server.hit_map["/rain/10/909/403.png"] == 1
+
+
+def test_fetch_tile_max_age(tile_cache, tile_server):
+    url = tile_server.url("/base/10/909/403.png")
+    rain_cloud_tile.fetch_tile(url, 60)
+
+    # NOTE: 期限が切れたものは取得し直す
+    old_time = time.time() - 120
+    os.utime(tile_cache.get_file_path(url), (old_time, old_time))
+    rain_cloud_tile.fetch_tile(url, 60)
+    rain_cloud_tile.fetch_tile(url, 60)
+
+    assert tile_server.hit_map["/base/10/909/403.png"] == 2
+
+
+def test_fetch_tile_not_found(tile_cache, tile_server):
+    tile_server.missing_set.add((10, 0, 0))
+    url = tile_server.url("/rain/10/0/0.png")
+
+    # NOTE: 存在しないタイルは空のファイルとしてキャッシュし，取得し直さない
+    assert rain_cloud_tile.fetch_tile(url) is None
+    assert tile_cache.get_file_path(url).read_bytes() == b""
+    assert rain_cloud_tile.fetch_tile(url) is None
+    assert tile_server.hit_map["/rain/10/0/0.png"] == 1
+
+
+def test_fetch_tile_fallback(tile_cache, tile_server):
+    url = tile_server.url("/base/10/909/403.png")
+    data = rain_cloud_tile.fetch_tile(url, 60)
+
+    old_time = time.time() - 120
+    os.utime(tile_cache.get_file_path(url), (old_time, old_time))
+    tile_server.add("/base/10/909/403.png", 503)
+
+    # NOTE: 取得できない場合は，期限切れのキャッシュを使う
+    assert rain_cloud_tile.fetch_tile(url, 60) == data
+    assert tile_server.hit_map["/base/10/909/403.png"] == 1 + (
+        http_client.RETRY_COUNT + 1
+    )
+
+
+def test_fetch_tile_error(tile_cache, tile_server):
+    # NOTE: キャッシュも無い場合は例外にする
+    tile_server.add("/base/10/909/403.png", 500)
+
+    with pytest.raises(http_client.HTTPError) as e:
+        rain_cloud_tile.fetch_tile(tile_server.url("/base/10/909/403.png"), 60)
+    assert e.value.code == 500
+
+
+def test_fetch_cloud_image(tile_cache, tile_server, base_tile):
+    time_list = [
+        {"basetime": "20220827020000", "validtime": "20220827020000"},
+        {"basetime": "20220827015500", "validtime": "20220827015500"},
+    ]
+    tile_server.add("/time/N1.json", body=json.dumps(time_list).encode())
+    tile_server.add(
+        "/time/N2.json",
+        body=json.dumps(
+            [{"basetime": "20220827020000", "validtime": "20220827030000"}]
+        ).encode(),
+    )
+    tile_config = {
+        "LAT": 0,
+        "LON": 0,
+        "ZOOM": 2,
+        "TIME_URL": tile_server.url("/time/{kind}.json"),
+        "BASE_URL": tile_server.url("/base/{z}/{x}/{y}.png"),
+        "RAIN_URL": tile_server.url("/rain/{basetime}/{validtime}/{z}/{x}/{y}.png"),
+    }
+
+    img_map = rain_cloud_tile.fetch_cloud_image(tile_config, 256, 256, [0, 1])
+
+    assert sorted(img_map.keys()) == [0, 1]
+    assert "/rain/20220827020000/20220827030000/2/1/1.png" in tile_server.hit_map
+    # NOTE: 中心 (512, 512) の周りの 256 x 256 は 4 枚のタイルにまたがる
+    img = img_map[0]
+    assert img.shape == (256, 256, 3)
+    expected = get_expected_base(base_tile, 384, 384, 256, 256)
+    # NOTE: 雨雲の無い部分は背景のまま，不透明な雨雲は雨雲の色
+    assert np.array_equal(img[0:64, 0:64], expected[0:64, 0:64])
+    assert img[128 + 64, 128 + 64].tolist() == [0, 40, 255]
+
+    with pytest.raises(ValueError):
+        rain_cloud_tile.fetch_cloud_image(tile_config, 256, 256, [2])
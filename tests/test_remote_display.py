@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import io
+import re
+import hashlib
+
+import PIL.Image
+import pytest
+
+import metrics
+import remote_display
+
+
+class FakeChannel:
+    def __init__(self, remote=None):
+        self.remote = remote
+        self.command = None
+        self.is_closed = False
+        self.exit_status = -1
+        self.output = ""
+
+    def exec_command(self, command):
+        self.command = command
+        if self.remote is not None:
+            self.exit_status, self.output = self.remote.run(command)
+
+    def recv_exit_status(self):
+        return self.exit_status
+
+    def makefile(self, mode):
+        return io.StringIO(self.output)
+
+    def makefile_stderr(self, mode):
+        return io.StringIO("")
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def close(self):
+        self.is_closed = True
+
+
+class FakeTransport:
+    def __init__(self, client):
+        self.client = client
+        self.is_closed = False
+
+    def is_active(self):
+        return not self.is_closed
+
+    def set_keepalive(self, interval):
+        self.keepalive = interval
+
+    def open_session(self):
+        channel = FakeChannel(self.client.remote)
+        self.client.channel_list.append(channel)
+        return channel
+
+
+class FakeSFTPFile(io.BytesIO):
+    def __init__(self, sftp, path):
+        super().__init__()
+        self.sftp = sftp
+        self.path = path
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def close(self):
+        self.sftp.file_map[self.path] = self.getvalue()
+        super().close()
+
+
+class FakeSFTP:
+    def __init__(self, client):
+        self.client = client
+        self.file_map = client.remote.file_map
+        self.op_list = client.remote.op_list
+
+    def get_channel(self):
+        return FakeChannel()
+
+    def open(self, path, mode):
+        if self.client.remote.fail_count > 0:
+            self.client.remote.fail_count -= 1
+            raise OSError("Socket is closed")
+        self.op_list.append(("open", path, mode))
+        return FakeSFTPFile(self, path)
+
+    def posix_rename(self, old_path, new_path):
+        self.op_list.append(("rename", old_path, new_path))
+        self.file_map[new_path] = self.file_map.pop(old_path)
+
+    def close(self):
+        pass
+
+
+class FakeRemote:
+    # NOTE: 表示側の状態．接続し直しても引き継がれる．
+    def __init__(self):
+        self.client_list = []
+        self.file_map = {}
+        self.op_list = []
+        self.fail_count = 0
+        # NOTE: root の所有で設置されたファイル
+        self.installed_map = {}
+        self.command_list = []
+
+    def run(self, command):
+        # NOTE: 試験で使うコマンドだけを模擬する．戻り値は (終了コード, 出力)
+        self.command_list.append(command)
+        match = re.search(r"sudo install .* (\S+) (\S+) && rm -f", command)
+        if match is not None:
+            self.installed_map[match.group(2)] = self.file_map.pop(match.group(1))
+        match = re.search(r"echo '(\w+)  (\S+)' \| sha256sum", command)
+        if match is not None:
+            data = self.installed_map.get(match.group(2), b"")
+            is_ok = hashlib.sha256(data).hexdigest() == match.group(1)
+            return (0 if is_ok else 1, "")
+        if "python3" in command:
+            return (-1, "64 32 4 32\n")
+
+        return (0, "")
+
+    def create_client(self):
+        client = FakeSSHClient(self)
+        self.client_list.append(client)
+        return client
+
+
+class FakeSSHClient:
+    def __init__(self, remote):
+        self.remote = remote
+        self.transport = FakeTransport(self)
+        self.channel_list = []
+        self.connect_kwargs = None
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, hostname, **kwargs):
+        self.connect_kwargs = dict(kwargs, hostname=hostname)
+
+    def get_transport(self):
+        return self.transport
+
+    def open_sftp(self):
+        return FakeSFTP(self)
+
+    def close(self):
+        self.transport.is_closed = True
+
+
+@pytest.fixture
+def remote(tmp_path, monkeypatch):
+    remote = FakeRemote()
+    monkeypatch.setattr(remote_display.paramiko, "SSHClient", remote.create_client)
+    monkeypatch.setattr(
+        remote_display.paramiko.RSAKey, "from_private_key", lambda file: "key"
+    )
+    (tmp_path / "panel.id_rsa").write_text("dummy")
+
+    return remote
+
+
+def create_display(tmp_path, **kwargs):
+    return remote_display.RemoteDisplay(
+        "display.local", str(tmp_path / "panel.id_rsa"), port=2222, **kwargs
+    )
+
+
+def create_image():
+    img = PIL.Image.new("L", (64, 32), 255)
+    img.paste(0, (8, 8, 24, 24))
+
+    return img
+
+
+def get_failure_count(hostname):
+    for metric in metrics.get_snapshot()["counter"].values():
+        if (metric["name"] == "push_failure_total") and (
+            metric["labels"] == {"host": hostname}
+        ):
+            return metric["value"]
+
+    return 0
+
+
+def test_show_png(tmp_path, remote):
+    display = create_display(tmp_path, timeout=5)
+    img = create_image()
+
+    display.show(img)
+
+    assert len(remote.client_list) == 1
+    connect_kwargs = remote.client_list[0].connect_kwargs
+    assert connect_kwargs["hostname"] == "display.local"
+    assert connect_kwargs["port"] == 2222
+    assert connect_kwargs["timeout"] == 5
+    assert connect_kwargs["banner_timeout"] == 5
+    assert connect_kwargs["auth_timeout"] == 5
+
+    # NOTE: 一時ファイルに書いてからリネームする
+    tmp_path = remote_display.DISPLAY_PATH + ".tmp"
+    assert remote.op_list == [
+        ("open", tmp_path, "wb"),
+        ("rename", tmp_path, remote_display.DISPLAY_PATH),
+    ]
+    shown = PIL.Image.open(io.BytesIO(remote.file_map[remote_display.DISPLAY_PATH]))
+    assert list(shown.convert("L").getdata()) == list(img.getdata())
+
+    channel_list = remote.client_list[0].channel_list
+    assert [channel.command for channel in channel_list] == [
+        remote_display.DISPLAY_COMMAND
+    ]
+
+
+def test_show_png_level(tmp_path, remote):
+    display = create_display(tmp_path, png_level=4)
+
+    display.show(create_image())
+
+    shown = PIL.Image.open(io.BytesIO(remote.file_map[remote_display.DISPLAY_PATH]))
+    assert shown.mode == "P"
+    assert sorted(shown.convert("L").getcolors()) == [(256, 0), (1792, 255)]
+
+
+def test_display_channel_is_closed(tmp_path, remote):
+    display = create_display(tmp_path)
+
+    for i in range(3):
+        display.show(create_image())
+
+    # NOTE: 接続は使い回し，前回の fbi のチャンネルは次の表示の際に閉じる
+    assert len(remote.client_list) == 1
+    channel_list = remote.client_list[0].channel_list
+    assert [channel.is_closed for channel in channel_list] == [True, True, False]
+
+    display.close()
+    assert channel_list[-1].is_closed
+    assert remote.client_list[0].transport.is_closed
+
+
+def test_push_retry(tmp_path, remote):
+    display = create_display(tmp_path, retry=1)
+    failure_count = get_failure_count("display.local")
+
+    display.show(create_image())
+    remote.fail_count = 1
+    display.show(create_image())
+
+    # NOTE: 失敗したら接続し直して，もう一度送る
+    assert len(remote.client_list) == 2
+    assert remote.client_list[0].transport.is_closed
+    assert not remote.client_list[1].transport.is_closed
+    assert [op[0] for op in remote.op_list] == ["open", "rename"] * 2
+    assert get_failure_count("display.local") == failure_count + 1
+
+
+def test_push_retry_exhausted(tmp_path, remote):
+    display = create_display(tmp_path, retry=2)
+    remote.fail_count = 3
+
+    with pytest.raises(OSError):
+        display.show(create_image())
+
+    assert len(remote.client_list) == 3
+    assert all(client.transport.is_closed for client in remote.client_list)
+    assert remote.file_map == {}
+
+
+def test_reconnect_when_inactive(tmp_path, remote):
+    display = create_display(tmp_path)
+
+    display.show(create_image())
+    assert display.is_connected()
+
+    # NOTE: keepalive などで切断を検出した場合は，次の送信の前に接続し直す
+    remote.client_list[0].transport.is_closed = True
+    assert not display.is_connected()
+    display.show(create_image())
+
+    assert len(remote.client_list) == 2
+    assert remote_display.DISPLAY_PATH in remote.file_map
+
+
+def test_install_fb_writer(tmp_path, remote):
+    with open(remote_display.FB_WRITER_LOCAL_PATH, "rb") as file:
+        script = file.read()
+
+    display = create_display(tmp_path, output="framebuffer")
+    display.ensure_connected()
+    display.start_fb_writer()
+
+    # NOTE: ホームディレクトリ経由で，root の所有する場所に設置してから実行する
+    assert remote.installed_map == {remote_display.FB_WRITER_PATH: script}
+    assert remote.file_map == {}
+    assert remote.command_list[-1] == remote_display.FB_WRITER_COMMAND.format(
+        path=remote_display.FB_WRITER_PATH, device="/dev/fb0"
+    )
+    assert display.fb_geometry == {"size": (64, 32), "bpp": 4, "stride": 32}
+
+    # NOTE: 設置済みのものが同じ内容なら，送り直さない
+    remote.op_list.clear()
+    display.start_fb_writer()
+    assert remote.op_list == []
+    channel_list = remote.client_list[0].channel_list
+    assert [channel.is_closed for channel in channel_list] == [
+        True,
+        True,
+        False,
+        True,
+        False,
+    ]
+
+
+def test_install_fb_writer_modified(tmp_path, remote):
+    with open(remote_display.FB_WRITER_LOCAL_PATH, "rb") as file:
+        script = file.read()
+    remote.installed_map[remote_display.FB_WRITER_PATH] = b"import os"
+
+    display = create_display(tmp_path, output="framebuffer")
+    display.ensure_connected()
+    display.start_fb_writer()
+
+    # NOTE: 内容が異なる場合は設置し直す
+    assert remote.installed_map == {remote_display.FB_WRITER_PATH: script}
+
+
+def test_install_fb_writer_failed(tmp_path, remote, monkeypatch):
+    # NOTE: 設置後の確認に失敗した場合は，実行しない
+    monkeypatch.setattr(
+        remote,
+        "run",
+        lambda command: (1, "") if "sha256sum" in command else (-1, "64 32 4 32\n"),
+    )
+    display = create_display(tmp_path, output="framebuffer")
+    display.ensure_connected()
+
+    with pytest.raises(RuntimeError):
+        display.start_fb_writer()
+    assert display.fb_channel is None
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import os
+import time
+
+import PIL.Image
+import pytest
+
+import weather_icon
+
+URL = "https://www.jma.go.jp/bosai/forecast/img/100.png"
+
+
+def create_icon(value):
+    return PIL.Image.new("LA", (32, 32), (value, 255))
+
+
+def set_mtime(cache, url, param_key, mtime):
+    file_path = cache.get_file_path(url, param_key)
+    os.utime(file_path, (mtime, mtime))
+
+
+@pytest.fixture
+def icon_cache(tmp_path, monkeypatch):
+    cache = weather_icon.IconCache(tmp_path / "icon")
+    monkeypatch.setattr(weather_icon, "_icon_cache", cache)
+
+    return cache
+
+
+def test_put_get(icon_cache):
+    icon_cache.put(URL, "param", create_icon(10))
+
+    assert icon_cache.get(URL, "param").getpixel((0, 0)) == (10, 255)
+    assert icon_cache.get(URL, "other") is None
+    assert icon_cache.get(URL + "?", "param") is None
+
+
+def test_evict(icon_cache):
+    now = time.time()
+    url_list = ["{url}?{i}".format(url=URL, i=i) for i in range(4)]
+    for i, url in enumerate(url_list):
+        icon_cache.put(url, "param", create_icon(i))
+        set_mtime(icon_cache, url, "param", now - 100 + i * 10)
+
+    # NOTE: 読み出したものは新しいものとして扱う
+    assert icon_cache.get(url_list[0], "param") is not None
+
+    icon_cache.max_size = sum(
+        icon_cache.get_file_path(url, "param").stat().st_size
+        for url in [url_list[0], url_list[3]]
+    )
+    icon_cache.evict()
+
+    exist_list = [icon_cache.get_file_path(url, "param").exists() for url in url_list]
+    assert exist_list == [True, False, False, True]
+
+
+def test_evict_on_put(icon_cache):
+    icon_cache.put(URL, "param", create_icon(0))
+    set_mtime(icon_cache, URL, "param", time.time() - 100)
+
+    icon_cache.max_size = icon_cache.get_file_path(URL, "param").stat().st_size
+    icon_cache.put(URL + "?", "param", create_icon(1))
+
+    assert not icon_cache.get_file_path(URL, "param").exists()
+    assert icon_cache.get(URL + "?", "param") is not None
+
+
+def test_get_fallback(icon_cache):
+    now = time.time()
+    icon_cache.put(URL, "old", create_icon(10))
+    set_mtime(icon_cache, URL, "old", now - 100)
+    icon_cache.put(URL, "new", create_icon(20))
+    set_mtime(icon_cache, URL, "new", now - 10)
+
+    # NOTE: パラメータが異なるものの中から，一番新しいものを返す
+    assert icon_cache.get_fallback(URL).getpixel((0, 0)) == (20, 255)
+    assert icon_cache.get_fallback(URL + "?") is None
+
+
+def fetch_fail(info):
+    raise OSError("network is unreachable")
+
+
+def test_load_icon_list_fallback(icon_cache):
+    icon_cache.put(URL, "old", create_icon(10))
+
+    icon_list = weather_icon.load_icon_list([{"icon": URL}], fetch_fail)
+
+    assert icon_list[0].getpixel((0, 0)) == (10, 255)
+
+
+def test_load_icon_list_no_fallback(icon_cache):
+    with pytest.raises(OSError):
+        weather_icon.load_icon_list([{"icon": URL}], fetch_fail)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# - coding: utf-8 --
+import datetime
+
+import pytest
+
+from conftest import DATA_PATH
+import http_client
+import weekly_forecast_panel
+
+BASE_URL = "https://weather.yahoo.co.jp/weather/jp/13/4410.html"
+ICON_URL = "https://s.yimg.jp/images/weather/general/next/size150/{name}_day.png"
+
+
+@pytest.fixture
+def html():
+    return (DATA_PATH / "weekly_forecast.html").read_text(encoding="utf-8")
+
+
+@pytest.fixture(autouse=True)
+def html_cache_path(tmp_path, monkeypatch):
+    path = tmp_path / "weekly_forecast.json"
+    monkeypatch.setattr(weekly_forecast_panel, "WEEKLY_FORECAST_CACHE_PATH", path)
+    monkeypatch.setattr(http_client, "RETRY_WAIT", 0)
+
+    return path
+
+
+def test_parse_weekly_forecast_list(html):
+    now = datetime.datetime(2022, 8, 27, 12, 0)
+    forecast_list = weekly_forecast_panel.parse_weekly_forecast_list(
+        html, BASE_URL, now
+    )
+
+    assert [forecast["date"] for forecast in forecast_list] == [
+        datetime.datetime(2022, 8, 28),
+        datetime.datetime(2022, 8, 29),
+        datetime.datetime(2022, 8, 30),
+        datetime.datetime(2022, 8, 31),
+        datetime.datetime(2022, 9, 1),
+        datetime.datetime(2022, 9, 2),
+    ]
+    # NOTE: アイコンは大きいサイズのものを使い，URL は絶対 URL にする
+    assert [forecast["weather"] for forecast in forecast_list] == [
+        ["曇り", ICON_URL.format(name=200)],
+        ["曇時々晴", ICON_URL.format(name=201)],
+        ["雨", ICON_URL.format(name=300)],
+        [
+            "雨時々曇",
+            "https://weather.yahoo.co.jp/images/weather/general/next/size150/302_day.png",
+        ],
+        ["晴れ", ICON_URL.format(name=100)],
+        ["晴時々曇", ICON_URL.format(name=101)],
+    ]
+    assert [forecast["temp"] for forecast in forecast_list] == [
+        [31, 24],
+        [32, 25],
+        [27, 23],
+        [26, 22],
+        [30, 21],
+        [29, -1],
+    ]
+    assert [forecast["prec"] for forecast in forecast_list] == [30, 20, 80, 60, 10, 0]
+
+
+def test_parse_weekly_forecast_list_broken(html):
+    # NOTE: 表の構造が変わった場合は例外になる (ブラウザでの取得に切り替える)
+    with pytest.raises(Exception):
+        weekly_forecast_panel.parse_weekly_forecast_list(
+            html.replace("<small>曇り</small></td>", "</tr>"),
+            BASE_URL,
+            datetime.datetime(2022, 8, 27),
+        )
+
+
+def test_fetch_html_etag(html, html_cache_path, stand_in_server):
+    def route(handler):
+        if handler.headers.get("If-None-Match") == '"v1"':
+            return (304, {"ETag": '"v1"'}, b"")
+        return (
+            200,
+            {"ETag": '"v1"', "Content-Type": "text/html; charset=UTF-8"},
+            html.encode("utf-8"),
+        )
+
+    stand_in_server.route_map["/weekly.html"] = route
+    url = stand_in_server.url("/weekly.html")
+
+    assert weekly_forecast_panel.fetch_html(url) == html
+    assert html_cache_path.exists()
+    assert "If-None-Match" not in stand_in_server.request_list[0][1]
+
+    # NOTE: 2回目は ETag を送り，304 が返ってきたらキャッシュを使う
+    assert weekly_forecast_panel.fetch_html(url) == html
+    assert stand_in_server.request_list[1][1]["If-None-Match"] == '"v1"'
+    assert stand_in_server.hit_map["/weekly.html"] == 2
+
+
+def test_fetch_html_last_modified(html, stand_in_server):
+    last_modified = "Sat, 27 Aug 2022 02:00:00 GMT"
+
+    def route(handler):
+        if handler.headers.get("If-Modified-Since") == last_modified:
+            return (304, {}, b"")
+        return (200, {"Last-Modified": last_modified}, html.encode("utf-8"))
+
+    stand_in_server.route_map["/weekly.html"] = route
+    url = stand_in_server.url("/weekly.html")
+
+    assert weekly_forecast_panel.fetch_html(url) == html
+    assert weekly_forecast_panel.fetch_html(url) == html
+    assert stand_in_server.request_list[1][1]["If-Modified-Since"] == last_modified
+
+
+def test_fetch_html_other_url(html, stand_in_server):
+    # NOTE: URL が変わった場合は，キャッシュを使わずに取り直す
+    stand_in_server.add("/a.html", 200, {"ETag": '"v1"'}, b"a")
+    stand_in_server.add("/b.html", 200, {"ETag": '"v1"'}, b"b")
+
+    assert weekly_forecast_panel.fetch_html(stand_in_server.url("/a.html")) == "a"
+    assert weekly_forecast_panel.fetch_html(stand_in_server.url("/b.html")) == "b"
+    assert "If-None-Match" not in stand_in_server.request_list[1][1]
+
+
+def test_fetch_html_error(stand_in_server):
+    stand_in_server.add("/error.html", 500)
+
+    with pytest.raises(http_client.HTTPError) as e:
+        weekly_forecast_panel.fetch_html(stand_in_server.url("/error.html"))
+    assert e.value.code == 500
+
+
+def test_fallback_to_browser(monkeypatch):
+    def fail(panel_config, now):
+        raise RuntimeError("page structure is changed")
+
+    browser_call_list = []
+
+    def browser(panel_config, now):
+        browser_call_list.append(panel_config)
+        return ["browser"]
+
+    monkeypatch.setattr(weekly_forecast_panel, "get_weekly_forecast_list_by_http", fail)
+    monkeypatch.setattr(
+        weekly_forecast_panel, "get_weekly_forecast_list_by_browser", browser
+    )
+
+    panel_config = {"URL": BASE_URL}
+    assert weekly_forecast_panel.get_weekly_forecast_list(panel_config) == ["browser"]
+    assert browser_call_list == [panel_config]
+
+
+def test_http_backend(html, monkeypatch):
+    monkeypatch.setattr(weekly_forecast_panel, "fetch_html", lambda url: html)
+    monkeypatch.setattr(
+        weekly_forecast_panel,
+        "get_weekly_forecast_list_by_browser",
+        lambda panel_config, now: pytest.fail("browser should not be used"),
+    )
+
+    forecast_list = weekly_forecast_panel.get_weekly_forecast_list({"URL": BASE_URL})
+    assert [forecast["prec"] for forecast in forecast_list] == [30, 20, 80, 60, 10, 0]
+
+
+def test_browser_backend(monkeypatch):
+    monkeypatch.setattr(
+        weekly_forecast_panel,
+        "get_weekly_forecast_list_by_http",
+        lambda panel_config, now: pytest.fail("HTTP should not be used"),
+    )
+    monkeypatch.setattr(
+        weekly_forecast_panel,
+        "get_weekly_forecast_list_by_browser",
+        lambda panel_config, now: ["browser"],
+    )
+
+    assert weekly_forecast_panel.get_weekly_forecast_list(
+        {"URL": BASE_URL, "BACKEND": "browser"}
+    ) == ["browser"]